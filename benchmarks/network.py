@@ -0,0 +1,192 @@
+''' Network benchmarks: triage of a synthetic C: tree served over SMB, through DPLootRemoteSMBConnection
+
+The tree is shared as C$ by impacket's SimpleSMBServer on 127.0.0.1, behind a proxy adding latency and
+limiting bandwidth, so that changes to round trips, caching and concurrency can be measured without a
+Windows host:
+
+    python -m benchmarks.network -rtt 20 -bandwidth 100 -smb-sessions 4 -json results.json
+'''
+import argparse
+import json
+import logging
+import queue
+import shutil
+import socket
+import sys
+import threading
+import time
+from typing import Tuple
+
+from impacket.examples import logger
+from impacket.ntlm import compute_lmhash, compute_nthash
+from impacket.smbserver import SimpleSMBServer
+
+from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.target import Target
+
+from benchmarks.offline import add_tree_arguments, create_tree, tree_parameters, tree_root
+from benchmarks.runner import SUBSYSTEMS, as_dict, report, run_benchmarks
+
+USERNAME = 'administrator'
+PASSWORD = 'Benchmark!2024'
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class SyntheticSMBServer:
+    ''' Shares root as C$ on 127.0.0.1 with SMB2 support, for USERNAME / PASSWORD '''
+
+    def __init__(self, root: str, port: int = None) -> None:
+        self.port = port if port is not None else free_port()
+        self.server = SimpleSMBServer(listenAddress='127.0.0.1', listenPort=self.port)
+        self.server.addShare('C$', root, 'synthetic C:')
+        self.server.setSMB2Support(True)
+        self.server.addCredential(USERNAME, 500, compute_lmhash(PASSWORD).hex(), compute_nthash(PASSWORD).hex())
+        self.thread = threading.Thread(target=self.server.start, name='smbserver', daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.stop()
+
+class LatencyProxy:
+    ''' TCP proxy delaying every chunk by half the round trip time each way, at a limited bandwidth
+
+    Chunks are timestamped when read and sent once their delay has passed, so back to back chunks are
+    delayed once, not once each, as on a network link. Bandwidth is shared by every connection.
+    '''
+
+    def __init__(self, remote: Tuple[str, int], rtt: float = 0.0, bandwidth: float = None) -> None:
+        self.remote = remote
+        self.delay = rtt / 2
+        # bytes per second, None for unlimited
+        self.bandwidth = bandwidth
+
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(64)
+        self.port = self.listener.getsockname()[1]
+        self._link_lock = threading.Lock()
+        self._link_free = 0.0
+        self._closed = False
+
+    def start(self) -> None:
+        threading.Thread(target=self._accept, name='proxy', daemon=True).start()
+
+    def stop(self) -> None:
+        self._closed = True
+        self.listener.close()
+
+    def _accept(self) -> None:
+        while not self._closed:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            server = socket.create_connection(self.remote)
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            for source, destination in ((client, server), (server, client)):
+                chunks = queue.Queue()
+                threading.Thread(target=self._read, args=(source, chunks), daemon=True).start()
+                threading.Thread(target=self._write, args=(destination, chunks), daemon=True).start()
+
+    def _read(self, source: socket.socket, chunks: queue.Queue) -> None:
+        while True:
+            try:
+                data = source.recv(65536)
+            except OSError:
+                data = b''
+            chunks.put((time.perf_counter() + self.delay, data))
+            if len(data) == 0:
+                return
+
+    def _transmit_time(self, size: int) -> float:
+        ''' Reserves the link for size bytes, returns when they are transmitted '''
+        with self._link_lock:
+            self._link_free = max(self._link_free, time.perf_counter()) + size / self.bandwidth
+            return self._link_free
+
+    def _write(self, destination: socket.socket, chunks: queue.Queue) -> None:
+        while True:
+            due, data = chunks.get()
+            if self.bandwidth is not None and len(data) > 0:
+                due = max(due, self._transmit_time(len(data)))
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            if len(data) == 0:
+                try:
+                    destination.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                return
+            try:
+                destination.sendall(data)
+            except OSError:
+                return
+
+def main() -> None:
+    logger.init()
+    parser = argparse.ArgumentParser(description="Benchmarks dploot triage classes on a synthetic Windows tree served over SMB on localhost")
+    parser.add_argument("-debug", action="store_true", help="Turn DEBUG output ON")
+    add_tree_arguments(parser)
+    group = parser.add_argument_group('network')
+    group.add_argument("-rtt", action="store", type=float, default=10.0, metavar="ms", help="Round trip time added to the SMB traffic (default: 10)")
+    group.add_argument("-bandwidth", action="store", type=float, metavar="Mbit/s", help="Bandwidth of the link (default: unlimited)")
+    group.add_argument("-smb-sessions", action="store", type=int, default=1, metavar="N", help="SMB sessions opened by dploot (default: 1)")
+    parser.add_argument("-subsystems", action="store", nargs="+", choices=list(SUBSYSTEMS), default=list(SUBSYSTEMS), help="Subsystems to benchmark (default: all)")
+    parser.add_argument("-no-memory", action="store_true", help="Do not measure peak memory (it needs a second, slower, run of each subsystem)")
+    parser.add_argument("-json", action="store", metavar="file.json", help="Also write results to this file")
+    options = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.DEBUG if options.debug else logging.INFO)
+    logging.getLogger("impacket").disabled = not options.debug
+    # the server logs every request
+    logging.getLogger("impacket.smbserver").disabled = not options.debug
+
+    root = tree_root(options)
+    server = proxy = None
+    try:
+        tree = create_tree(options, root)
+
+        server = SyntheticSMBServer(root)
+        server.start()
+        proxy = LatencyProxy(('127.0.0.1', server.port), rtt=options.rtt / 1000,
+                             bandwidth=options.bandwidth * 1000 * 1000 / 8 if options.bandwidth is not None else None)
+        proxy.start()
+        logging.info("Serving the synthetic tree on 127.0.0.1:%d, through 127.0.0.1:%d with %.1fms RTT" % (server.port, proxy.port, options.rtt))
+
+        target = Target.create(target='127.0.0.1', username=USERNAME, password=PASSWORD, port=proxy.port,
+                               smb_sessions=options.smb_sessions, use_cache=False)
+
+        def connect() -> DPLootSMBConnection:
+            conn = DPLootSMBConnection(target)
+            if conn.connect() is None:
+                raise Exception("Could not connect to the SMB server")
+            return conn
+
+        results = run_benchmarks(tree, target, connect, options.subsystems, memory=not options.no_memory)
+    finally:
+        if proxy is not None:
+            proxy.stop()
+        if server is not None:
+            server.stop()
+        if options.root is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print('\n'.join(report(results)))
+    if options.json is not None:
+        with open(options.json, 'w') as f:
+            json.dump(as_dict(results, mode='network', rtt=options.rtt, bandwidth=options.bandwidth,
+                              smb_sessions=options.smb_sessions, **tree_parameters(options)), f, indent=2)
+    if any(result.found != result.expected for result in results):
+        logging.error("Some subsystems did not find every synthetic secret")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+''' Offline benchmarks: triage of a synthetic C: tree through DPLootLocalSMBConnection
+
+    python -m benchmarks.offline -users 20 -blobs 16 -rows 5000 -json results.json
+'''
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from impacket.examples import logger
+
+from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.target import Target
+
+from benchmarks.runner import SUBSYSTEMS, as_dict, report, run_benchmarks
+from benchmarks.synthetic import SyntheticTree
+
+def add_tree_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group('synthetic tree')
+    group.add_argument("-root", action="store", help="Empty directory where the synthetic tree is generated and kept (default: temporary directory, deleted at the end)")
+    group.add_argument("-users", action="store", type=int, default=4, help="Number of user profiles (default: 4)")
+    group.add_argument("-masterkeys", action="store", type=int, default=2, help="Masterkeys per user (default: 2)")
+    group.add_argument("-blobs", action="store", type=int, default=8, help="Credential files, vault entries, certificates and SCCM secrets of each kind, per user (default: 8)")
+    group.add_argument("-rows", action="store", type=int, default=1000, help="Logins and cookies per Chrome profile (default: 1000)")
+    group.add_argument("-objects-data-size", action="store", type=int, default=16, metavar="MB", help="Size of OBJECTS.DATA in MB (default: 16)")
+    group.add_argument("-iterations", action="store", type=int, default=8000, help="PBKDF2 iterations of masterkeys (default: 8000, as Windows 10)")
+    group.add_argument("-seed", action="store", type=int, default=0, help="Random seed")
+
+def tree_root(options: argparse.Namespace) -> str:
+    ''' Returns the empty directory where the tree is generated '''
+    if options.root is None:
+        return tempfile.mkdtemp(prefix='dploot_bench_')
+    if os.path.isdir(options.root) and len(os.listdir(options.root)) > 0:
+        logging.error("%s is not empty, the synthetic tree needs an empty directory" % options.root)
+        sys.exit(1)
+    return options.root
+
+def create_tree(options: argparse.Namespace, root: str) -> SyntheticTree:
+    logging.info("Generating synthetic tree in %s" % root)
+    start = time.perf_counter()
+    tree = SyntheticTree(root, users=options.users, masterkeys=options.masterkeys, blobs=options.blobs, rows=options.rows,
+                         objects_data_size=options.objects_data_size * 1024 * 1024, iterations=options.iterations, seed=options.seed).generate()
+    logging.info("Generated in %.1fs" % (time.perf_counter() - start))
+    return tree
+
+def tree_parameters(options: argparse.Namespace) -> dict:
+    return dict(users=options.users, masterkeys=options.masterkeys, blobs=options.blobs, rows=options.rows,
+                objects_data_size=options.objects_data_size, iterations=options.iterations, seed=options.seed)
+
+def main() -> None:
+    logger.init()
+    parser = argparse.ArgumentParser(description="Benchmarks dploot triage classes on a synthetic Windows tree, offline")
+    parser.add_argument("-debug", action="store_true", help="Turn DEBUG output ON")
+    add_tree_arguments(parser)
+    parser.add_argument("-subsystems", action="store", nargs="+", choices=list(SUBSYSTEMS), default=list(SUBSYSTEMS), help="Subsystems to benchmark (default: all)")
+    parser.add_argument("-no-memory", action="store_true", help="Do not measure peak memory (it needs a second, slower, run of each subsystem)")
+    parser.add_argument("-json", action="store", metavar="file.json", help="Also write results to this file")
+    options = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.DEBUG if options.debug else logging.INFO)
+    logging.getLogger("impacket").disabled = not options.debug
+
+    root = tree_root(options)
+    try:
+        tree = create_tree(options, root)
+        target = Target.create(target='LOCAL', local_root=root, use_cache=False)
+
+        def connect() -> DPLootSMBConnection:
+            conn = DPLootSMBConnection(target)
+            conn.connect()
+            return conn
+
+        results = run_benchmarks(tree, target, connect, options.subsystems, memory=not options.no_memory)
+    finally:
+        if options.root is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print('\n'.join(report(results)))
+    if options.json is not None:
+        with open(options.json, 'w') as f:
+            json.dump(as_dict(results, mode='offline', **tree_parameters(options)), f, indent=2)
+    if any(result.found != result.expected for result in results):
+        logging.error("Some subsystems did not find every synthetic secret")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import gc
+import logging
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import stats
+from dploot.lib.target import Target
+from dploot.triage.browser import BrowserTriage
+from dploot.triage.certificates import CertificatesTriage
+from dploot.triage.credentials import CredentialsTriage
+from dploot.triage.masterkeys import MasterkeysTriage
+from dploot.triage.sccm import SCCMTriage
+from dploot.triage.vaults import VaultsTriage
+
+from benchmarks.synthetic import SyntheticTree
+
+@dataclass
+class BenchmarkResult:
+    subsystem: str
+    found: int
+    expected: int
+    duration: float
+    files_read: int
+    bytes_read: int
+    peak_memory: int = None
+
+    @property
+    def items_per_second(self) -> float:
+        return self.found / self.duration if self.duration > 0 else 0.0
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.bytes_read / self.duration / 1024 / 1024 if self.duration > 0 else 0.0
+
+def _browser(tree: SyntheticTree, target: Target, conn: DPLootSMBConnection) -> Dict[str, int]:
+    credentials, cookies = BrowserTriage(target=target, conn=conn, masterkeys=tree.masterkeys).triage_browsers(gather_cookies=True)
+    return dict(logins=len(credentials), cookies=len(cookies))
+
+def _sccm(tree: SyntheticTree, target: Target, conn: DPLootSMBConnection) -> Dict[str, int]:
+    return dict(sccm=sum(len(findings) for findings in SCCMTriage(target=target, conn=conn, masterkeys=tree.system_masterkeys, use_wmi=False).triage_sccm()))
+
+# each subsystem returns what it found, under the keys of SyntheticTree.expected
+SUBSYSTEMS: Dict[str, Callable[[SyntheticTree, Target, DPLootSMBConnection], Dict[str, int]]] = {
+    'masterkeys': lambda tree, target, conn: dict(masterkeys=len(MasterkeysTriage(target=target, conn=conn, passwords=tree.passwords).triage_masterkeys())),
+    'credentials': lambda tree, target, conn: dict(credentials=len(CredentialsTriage(target=target, conn=conn, masterkeys=tree.masterkeys).triage_credentials())),
+    'vaults': lambda tree, target, conn: dict(vaults=len(VaultsTriage(target=target, conn=conn, masterkeys=tree.masterkeys).triage_vaults())),
+    'certificates': lambda tree, target, conn: dict(certificates=len(CertificatesTriage(target=target, conn=conn, masterkeys=tree.masterkeys).triage_certificates())),
+    'browser': _browser,
+    'sccm': _sccm,
+}
+
+def run_subsystem(name: str, tree: SyntheticTree, target: Target, connect: Callable[[], DPLootSMBConnection], memory: bool = False) -> BenchmarkResult:
+    ''' Runs the triage of one subsystem on a new connection, measuring time or peak memory '''
+    conn = connect()
+    try:
+        gc.collect()
+        stats.reset()
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        found = SUBSYSTEMS[name](tree, target, conn)
+        duration = time.perf_counter() - start
+        peak_memory = None
+        if memory:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        conn.close()
+    counters = stats.as_dict()['counters']
+    prefix = 'local.' if target.is_local else 'smb.'
+    return BenchmarkResult(
+        subsystem=name,
+        found=sum(found.values()),
+        expected=sum(tree.expected[key] for key in found),
+        duration=duration,
+        files_read=counters.get(prefix + 'files_read', 0),
+        bytes_read=counters.get(prefix + 'bytes_read', 0),
+        peak_memory=peak_memory,
+    )
+
+def run_benchmarks(tree: SyntheticTree, target: Target, connect: Callable[[], DPLootSMBConnection], subsystems: List[str], memory: bool = True) -> List[BenchmarkResult]:
+    ''' Times every subsystem, then measures its peak memory in a second run (tracemalloc slows it down) '''
+    results = list()
+    for name in subsystems:
+        logging.info("Benchmarking %s" % name)
+        result = run_subsystem(name, tree, target, connect)
+        if memory:
+            result.peak_memory = run_subsystem(name, tree, target, connect, memory=True).peak_memory
+        results.append(result)
+    return results
+
+def report(results: List[BenchmarkResult]) -> List[str]:
+    lines = ['%-14s %10s %10s %10s %10s %10s %10s %12s' % ('Subsystem', 'Found', 'Time (s)', 'Items/s', 'Files', 'MB', 'MB/s', 'Peak MB')]
+    for result in results:
+        lines.append('%-14s %10s %10.3f %10.1f %10d %10.1f %10.1f %12s' % (
+            result.subsystem,
+            '%d/%d' % (result.found, result.expected),
+            result.duration,
+            result.items_per_second,
+            result.files_read,
+            result.bytes_read / 1024 / 1024,
+            result.megabytes_per_second,
+            '%.1f' % (result.peak_memory / 1024 / 1024) if result.peak_memory is not None else '-',
+        ))
+    return lines
+
+def as_dict(results: List[BenchmarkResult], **parameters: Any) -> Dict[str, Any]:
+    return dict(
+        parameters=parameters,
+        results={result.subsystem: dict(
+            found=result.found,
+            expected=result.expected,
+            duration=result.duration,
+            items_per_second=result.items_per_second,
+            files_read=result.files_read,
+            bytes_read=result.bytes_read,
+            megabytes_per_second=result.megabytes_per_second,
+            peak_memory=result.peak_memory,
+        ) for result in results},
+    )
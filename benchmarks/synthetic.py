@@ -0,0 +1,317 @@
+import base64
+import datetime
+import json
+import os
+import random
+import sqlite3
+import uuid
+from struct import pack
+from typing import Dict, List, Tuple
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Hash import HMAC, SHA1, SHA512
+from Cryptodome.Util.Padding import pad
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+from impacket.dpapi import ALGORITHMS
+from impacket.uuid import string_to_bin
+
+from dploot.lib.crypto import deriveKeysFromUser
+from dploot.triage.masterkeys import Masterkey
+
+PASSWORD = 'Synthetic!2024'
+DOMAIN_SID = 'S-1-5-21-1004336348-1177238915-682003330'
+DPAPI_PROVIDER = 'df9d8cd0-1501-11d1-8c7a-00c04fc297eb'
+CALG_AES_256 = ALGORITHMS.CALG_AES_256.value
+CALG_SHA_512 = ALGORITHMS.CALG_SHA_512.value
+
+class SyntheticRandom(random.Random):
+    ''' Seeded random source, so that a given set of parameters always generates the same tree '''
+
+    def bytes(self, size: int) -> bytes:
+        return self.getrandbits(8 * size).to_bytes(size, 'little') if size > 0 else b''
+
+    def guid(self) -> str:
+        return str(uuid.UUID(bytes=self.bytes(16), version=4))
+
+def utf16(value: str) -> bytes:
+    return value.encode('utf-16le')
+
+def sized(value: bytes) -> bytes:
+    return pack('<L', len(value)) + value
+
+def protect(data: bytes, masterkey: Masterkey, rng: SyntheticRandom, entropy: bytes = None, description: str = '') -> bytes:
+    ''' Encrypts data in a DPAPI blob (AES-256, SHA-512), as CryptProtectData() does with masterkey '''
+    key_hash = bytes.fromhex(masterkey.sha1)
+    salt = rng.bytes(32)
+    hmac_salt = rng.bytes(32)
+
+    session_key = HMAC.new(key_hash, salt, SHA512)
+    if entropy is not None:
+        session_key.update(entropy)
+    cipher = AES.new(session_key.digest()[:32], AES.MODE_CBC, iv=b'\x00' * 16)
+    encrypted = cipher.encrypt(pad(data, AES.block_size))
+
+    signed = pack('<L', 1) + string_to_bin(masterkey.guid) + pack('<L', 0) + sized(utf16(description + '\0')) \
+        + pack('<LL', CALG_AES_256, 256) + sized(salt) + sized(b'') \
+        + pack('<LL', CALG_SHA_512, 512) + sized(hmac_salt) + sized(encrypted)
+    sign = HMAC.new(key_hash, hmac_salt, SHA512)
+    if entropy is not None:
+        sign.update(entropy)
+    sign.update(signed)
+    return pack('<L', 1) + string_to_bin(DPAPI_PROVIDER) + signed + sized(sign.digest())
+
+def dpapi_pbkdf2(passphrase: bytes, salt: bytes, iterations: int, size: int) -> bytes:
+    ''' PBKDF2-HMAC-SHA512 as DPAPI implements it: each round hashes the xor of the previous ones '''
+    derived = b''
+    block = 1
+    while len(derived) < size:
+        result = HMAC.new(passphrase, salt + pack('>L', block), SHA512).digest()
+        for _ in range(iterations - 1):
+            result = bytes(a ^ b for a, b in zip(result, HMAC.new(passphrase, result, SHA512).digest()))
+        derived += result
+        block += 1
+    return derived[:size]
+
+def masterkey_file(guid: str, key: bytes, sid: str, password: str, iterations: int, rng: SyntheticRandom) -> bytes:
+    ''' Returns a user masterkey file protecting key with the password of sid '''
+    user_key = deriveKeysFromUser(sid, password)[1]
+    salt = rng.bytes(16)
+    derived = dpapi_pbkdf2(user_key, salt, iterations, 48)
+
+    hmac_salt = rng.bytes(16)
+    hmac = HMAC.new(HMAC.new(user_key, hmac_salt, SHA512).digest(), key, SHA512).digest()
+    encrypted = AES.new(derived[:32], AES.MODE_CBC, iv=derived[32:48]).encrypt(hmac_salt + hmac + key)
+    masterkey = pack('<L', 2) + salt + pack('<LLL', iterations, CALG_SHA_512, CALG_AES_256) + encrypted
+
+    return pack('<LLL', 2, 0, 0) + utf16(guid) + pack('<LLL', 0, 0, 5) \
+        + pack('<QQQQ', len(masterkey), 0, 0, 0) + masterkey
+
+def credential_file(masterkey: Masterkey, target: str, username: str, password: str, rng: SyntheticRandom) -> bytes:
+    ''' Returns a Credential Manager file (CREDENTIAL_BLOB of a generic credential) '''
+    fields = sized(utf16(target)) + sized(b'') + sized(utf16('synthetic credential')) + sized(b'') \
+        + sized(utf16(username)) + sized(utf16(password))
+    header = pack('<LLLLLQLLLQ', 0x30, 0, 0, 1, 0, 133000000000000000, 0, 2, 0, 0)
+    credential = header + fields
+    credential = credential[:4] + pack('<L', len(credential)) + credential[8:]
+    blob = protect(credential, masterkey, rng, description='Local Credential Data')
+    return pack('<LLL', 1, len(blob), 0) + blob
+
+def vault_policy(vault_guid: str, masterkey: Masterkey, keys: Tuple[bytes, bytes], rng: SyntheticRandom) -> bytes:
+    ''' Returns a Policy.vpol protecting the two AES keys of a vault
+
+    Key wraps are laid out the way impacket parses them (VAULT_VPOL_KEYS), Key1 then Key2.
+    '''
+    wraps = b''.join(pack('<LLL', 0x24, 1, 2) + b'KDBM' + pack('<LL', 1, len(key)) + key for key in keys)
+    blob = protect(wraps, masterkey, rng)
+    return pack('<L', 1) + string_to_bin(vault_guid) + sized(utf16('Web Credentials\0')) + b'\x00' * 12 \
+        + pack('<L', len(blob) + 36) + string_to_bin(rng.guid()) + string_to_bin(rng.guid()) + sized(blob)
+
+def vault_credential(key: bytes, resource: str, username: str, password: str, rng: SyntheticRandom) -> bytes:
+    ''' Returns a .vcrd Internet Explorer (web credentials) vault entry encrypted with key '''
+    cleartext = pack('<LLL', 1, 3, 0) + pack('<L', 1) + sized(utf16(username)) \
+        + pack('<L', 2) + sized(utf16(resource)) + pack('<L', 3) + sized(utf16(password))
+    iv = rng.bytes(16)
+    encrypted = AES.new(key, AES.MODE_CBC, iv=iv).encrypt(pad(cleartext, AES.block_size))
+    attribute = pack('<LLLL', 1, 0, 0, 0) + pack('<L', 1 + 4 + len(iv) + len(encrypted)) + b'\x01' + sized(iv) + encrypted
+
+    friendly_name = utf16('Internet Explorer\0')
+    header_size = 16 + 4 + 8 + 4 + 4 + 4 + len(friendly_name) + 4 + 12
+    return string_to_bin('3ccd5499-87a8-4b10-a215-608888dd3b55') + pack('<LQLL', 0, 133000000000000000, 0, 0) \
+        + sized(friendly_name) + sized(pack('<LLL', 1, header_size, 0)) + attribute
+
+def _le(value: int, size: int) -> bytes:
+    return value.to_bytes(size, 'little')
+
+def capi_private_key(key: rsa.RSAPrivateKey, masterkey: Masterkey, rng: SyntheticRandom) -> bytes:
+    ''' Returns a CAPI private key file (PVKFile, without signature key) for key '''
+    numbers = key.private_numbers()
+    bitlen = key.key_size
+    size = bitlen // 8 + 8
+    half = size // 2
+    public = b'RSA1' + pack('<LLLL', size, bitlen, bitlen // 8 - 1, numbers.public_numbers.e) + _le(numbers.public_numbers.n, size)
+    private = b'RSA2' + pack('<LLLL', size, bitlen, bitlen // 8 - 1, numbers.public_numbers.e) \
+        + _le(numbers.public_numbers.n, size) + _le(numbers.p, half) + _le(numbers.q, half) \
+        + _le(numbers.dmp1, half) + _le(numbers.dmq1, half) + _le(numbers.iqmp, half) + _le(numbers.d, size)
+    blob = protect(private, masterkey, rng, description='Private Key')
+    export_flag = protect(b'\x00' * 4, masterkey, rng, entropy=b'Hj1diQ6kpUx7VC4m\x00', description='Export Flag')
+    description = b'synthetic\x00'
+    return pack('<LLLLLLLLLL', 2, 0, len(description), 0, 0, len(public), len(blob), 0x14, 0, len(export_flag)) \
+        + description + b'\x00' * 20 + public + blob + export_flag
+
+def certificate_blob(key: rsa.RSAPrivateKey, upn: str) -> Tuple[str, bytes]:
+    ''' Returns the thumbprint and the SystemCertificates\\My file of a client authentication certificate for upn '''
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, upn)])
+    now = datetime.datetime(2024, 1, 1)
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()).serial_number(x509.random_serial_number()) \
+        .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=365)) \
+        .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.CLIENT_AUTH]), critical=False) \
+        .add_extension(x509.SubjectAlternativeName([x509.OtherName(x509.ObjectIdentifier('1.3.6.1.4.1.311.20.2.3'), b'\x0c' + bytes([len(upn)]) + upn.encode())]), critical=False) \
+        .sign(key, hashes.SHA256())
+    der = cert.public_bytes(Encoding.DER)
+    return cert.fingerprint(hashes.SHA1()).hex().upper(), pack('<LLL', 32, 1, len(der)) + der
+
+def chrome_encrypt(value: str, aeskey: bytes, rng: SyntheticRandom) -> bytes:
+    nonce = rng.bytes(12)
+    cipher = AES.new(aeskey, AES.MODE_GCM, nonce)
+    encrypted, tag = cipher.encrypt_and_digest(value.encode('utf-8'))
+    return b'v10' + nonce + encrypted + tag
+
+def sqlite_file(path: str, schema: str, insert: str, rows: List[tuple]) -> None:
+    db = sqlite3.connect(path)
+    db.execute(schema)
+    db.executemany(insert, rows)
+    db.commit()
+    db.close()
+
+def sccm_policy_secret(value: str, masterkey: Masterkey, rng: SyntheticRandom) -> bytes:
+    blob = protect(utf16(value + '\0'), masterkey, rng)
+    return b'<PolicySecret Version="1"><![CDATA[' + (pack('<L', len(blob)) + blob).hex().upper().encode() + b']]></PolicySecret>'
+
+class SyntheticTree:
+    ''' Writes a synthetic C: tree under root, with known secrets
+
+    users user profiles each get masterkeys masterkeys protected by PASSWORD, blobs credential files,
+    vault entries and certificates, a Chrome profile with rows logins, cookies and tokens, and the
+    machine gets an OBJECTS.DATA of objects_data_size bytes with blobs SCCM secrets of each kind.
+    expected counts what a triage should find, masterkeys holds every masterkey in clear.
+    '''
+
+    def __init__(self, root: str, users: int = 4, masterkeys: int = 2, blobs: int = 8, rows: int = 1000,
+                 objects_data_size: int = 16 * 1024 * 1024, iterations: int = 8000, seed: int = 0) -> None:
+        self.root = root
+        self.users = users
+        self.masterkeys_per_user = max(1, masterkeys)
+        self.blobs = blobs
+        self.rows = rows
+        self.objects_data_size = objects_data_size
+        self.iterations = iterations
+        self.rng = SyntheticRandom(seed)
+
+        self.usernames = ['user%03d' % i for i in range(users)]
+        self.passwords = {username: PASSWORD for username in self.usernames}
+        self.masterkeys: List[Masterkey] = list()
+        self.system_masterkeys: List[Masterkey] = list()
+        self.expected: Dict[str, int] = dict()
+        self._rsa_keys = None
+
+    def path(self, *parts: str) -> str:
+        path = os.path.join(self.root, *[part.replace('\\', os.sep) for part in parts])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def write(self, data: bytes, *parts: str) -> None:
+        with open(self.path(*parts), 'wb') as f:
+            f.write(data)
+
+    @property
+    def rsa_keys(self) -> List[rsa.RSAPrivateKey]:
+        # RSA key generation is slow, the same keys are used for every user
+        if self._rsa_keys is None:
+            self._rsa_keys = [rsa.generate_private_key(public_exponent=65537, key_size=2048) for _ in range(self.blobs)]
+        return self._rsa_keys
+
+    def generate(self) -> "SyntheticTree":
+        self.expected = dict(masterkeys=0, credentials=0, vaults=0, certificates=0, logins=0, cookies=0, sccm=0)
+        for index, username in enumerate(self.usernames):
+            sid = '%s-%d' % (DOMAIN_SID, 1100 + index)
+            masterkeys = self.generate_masterkeys(username, sid)
+            self.generate_credentials(username, masterkeys)
+            self.generate_vaults(username, masterkeys)
+            self.generate_certificates(username, sid, masterkeys)
+            self.generate_chrome(username, masterkeys)
+        self.generate_objects_data()
+        return self
+
+    def generate_masterkeys(self, username: str, sid: str) -> List[Masterkey]:
+        masterkeys = list()
+        for _ in range(self.masterkeys_per_user):
+            guid = self.rng.guid()
+            key = self.rng.bytes(64)
+            self.write(masterkey_file(guid, key, sid, PASSWORD, self.iterations, self.rng),
+                       'Users', username, 'AppData\\Roaming\\Microsoft\\Protect', sid, guid)
+            masterkeys.append(Masterkey(guid=guid, sha1=SHA1.new(key).hexdigest(), user=username))
+        self.write(string_to_bin(masterkeys[0].guid) + b'\x00' * 8, 'Users', username, 'AppData\\Roaming\\Microsoft\\Protect', sid, 'Preferred')
+        self.masterkeys += masterkeys
+        self.expected['masterkeys'] += len(masterkeys)
+        return masterkeys
+
+    def generate_credentials(self, username: str, masterkeys: List[Masterkey]) -> None:
+        for i in range(self.blobs):
+            data = credential_file(masterkeys[i % len(masterkeys)], 'Domain:target=srv%03d.synthetic.local' % i, 'SYNTHETIC\\%s' % username, 'CredPassword%03d' % i, self.rng)
+            self.write(data, 'Users', username, 'AppData\\Local\\Microsoft\\Credentials', self.rng.bytes(16).hex().upper())
+        self.expected['credentials'] += self.blobs
+
+    def generate_vaults(self, username: str, masterkeys: List[Masterkey]) -> None:
+        if self.blobs == 0:
+            return
+        vault_guid = self.rng.guid()
+        keys = (self.rng.bytes(16), self.rng.bytes(16))
+        vault_path = ('Users', username, 'AppData\\Local\\Microsoft\\Vault', vault_guid)
+        self.write(vault_policy(vault_guid, masterkeys[0], keys, self.rng), *vault_path, 'Policy.vpol')
+        for i in range(self.blobs):
+            # vault entries are tried with Key2 first
+            data = vault_credential(keys[1], 'https://intranet%03d.synthetic.local/' % i, username, 'VaultPassword%03d' % i, self.rng)
+            self.write(data, *vault_path, '%s.vcrd' % self.rng.bytes(20).hex().upper())
+        self.expected['vaults'] += self.blobs
+
+    def generate_certificates(self, username: str, sid: str, masterkeys: List[Masterkey]) -> None:
+        for i, key in enumerate(self.rsa_keys):
+            key_name = '%s_%s' % (self.rng.bytes(16).hex(), self.rng.guid())
+            self.write(capi_private_key(key, masterkeys[i % len(masterkeys)], self.rng),
+                       'Users', username, 'AppData\\Roaming\\Microsoft\\Crypto\\RSA', sid, key_name)
+            thumbprint, blob = certificate_blob(key, '%s@synthetic.local' % username)
+            self.write(blob, 'Users', username, 'AppData\\Roaming\\Microsoft\\SystemCertificates\\My\\Certificates', thumbprint)
+        self.expected['certificates'] += len(self.rsa_keys)
+
+    def generate_chrome(self, username: str, masterkeys: List[Masterkey]) -> None:
+        user_data = ('Users', username, 'AppData\\Local\\Google\\Chrome\\User Data')
+        aeskey = self.rng.bytes(32)
+        encrypted_key = b'DPAPI' + protect(aeskey, masterkeys[0], self.rng)
+        local_state = dict(os_crypt=dict(encrypted_key=base64.b64encode(encrypted_key).decode()))
+        self.write(json.dumps(local_state).encode(), *user_data, 'Local State')
+
+        sqlite_file(self.path(*user_data, 'Default\\Login Data'),
+                    'CREATE TABLE logins (origin_url TEXT, action_url TEXT, username_value TEXT, password_value BLOB)',
+                    'INSERT INTO logins VALUES (?, ?, ?, ?)',
+                    [('https://site%05d.synthetic.local/' % i, 'https://site%05d.synthetic.local/login' % i, '%s%05d' % (username, i),
+                      chrome_encrypt('LoginPassword%05d' % i, aeskey, self.rng)) for i in range(self.rows)])
+        sqlite_file(self.path(*user_data, 'Default\\Network\\Cookies'),
+                    'CREATE TABLE cookies (creation_utc INTEGER, host_key TEXT, name TEXT, path TEXT, expires_utc INTEGER, last_access_utc INTEGER, encrypted_value BLOB)',
+                    'INSERT INTO cookies VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(13300000000000000 + i, '.site%05d.synthetic.local' % i, 'session', '/', 13400000000000000, 13300000000000000 + i,
+                      chrome_encrypt(self.rng.bytes(24).hex(), aeskey, self.rng)) for i in range(self.rows)])
+        sqlite_file(self.path(*user_data, 'Default\\Web Data'),
+                    'CREATE TABLE token_service (service TEXT, encrypted_token BLOB)',
+                    'INSERT INTO token_service VALUES (?, ?)',
+                    [('AccountId-%d' % i, chrome_encrypt('1//0g' + self.rng.bytes(32).hex(), aeskey, self.rng)) for i in range(2)])
+        self.expected['logins'] += self.rows + 2
+        self.expected['cookies'] += self.rows
+
+    def generate_objects_data(self) -> None:
+        ''' Writes a WMI repository with SCCM policies (NAA, task sequences, collection variables) among random data '''
+        masterkey = Masterkey(guid=self.rng.guid(), sha1=SHA1.new(self.rng.bytes(64)).hexdigest(), user='SYSTEM')
+        self.system_masterkeys = [masterkey]
+
+        records = list()
+        for i in range(self.blobs):
+            records.append(b'CCM_NetworkAccessAccount\x00\x00' + sccm_policy_secret('NaaPassword%03d' % i, masterkey, self.rng)
+                           + b'\x00\x00' + sccm_policy_secret('SYNTHETIC\\naa%03d' % i, masterkey, self.rng))
+            records.append(b'<SWDReserved></SWDReserved>' + sccm_policy_secret('<sequence step="%d"/>' % i, masterkey, self.rng))
+            records.append(b'CCM_CollectionVariable\x00\x00Variable%03d\x00\x00' % i + sccm_policy_secret('CollectionValue%03d' % i, masterkey, self.rng))
+        self.expected['sccm'] = len(records)
+
+        # a random chunk without newlines (regexes stop at them) is repeated up to the requested size
+        filler = bytes(byte if byte != 0x0a else 0x20 for byte in self.rng.bytes(1024 * 1024))
+        gap = max(0, self.objects_data_size - sum(len(record) for record in records)) // (len(records) + 1)
+        with open(self.path('Windows\\System32\\wbem\\Repository\\OBJECTS.DATA'), 'wb') as f:
+            for record in records + [b'']:
+                remaining = gap
+                while remaining > 0:
+                    f.write(filler[:remaining])
+                    remaining -= len(filler)
+                f.write(record)
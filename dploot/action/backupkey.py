@@ -5,6 +5,7 @@ import sys
 from typing import Callable, Tuple
 
 from dploot.lib.target import Target, add_target_argument_group
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.triage.backupkey import BackupkeyTriage
 
@@ -15,6 +16,7 @@ class BackupkeyAction:
     def __init__(self, options: argparse.Namespace) -> None:
         self.options = options
         self.target = Target.from_options(options)
+        self.output = get_output(options)
         
         self.conn = None
         self._is_admin = None
@@ -28,6 +30,8 @@ class BackupkeyAction:
             self.outputfile = 'key.pvk'
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -48,11 +52,7 @@ class BackupkeyAction:
                 print("\n")
             logging.info("Exporting key to file {}".format(self.outputfile  + ".key"))
             open(self.outputfile + ".key", 'wb').write(backupkey.backupkey_v1)
-        if not self.options.quiet:
-            print("[DOMAIN BACKUPKEY V2]")
-            backupkey.pvk_header.dump()
-            print("PRIVATEKEYBLOB:{%s}" % (hexlify(backupkey.backupkey_v2).decode('latin-1')))
-            print("\n")
+        self.output.dump(backupkey)
         logging.critical("Exporting domain backupkey to file {}".format(self.outputfile ))
         open(self.outputfile, 'wb').write(backupkey.backupkey_v2)
 
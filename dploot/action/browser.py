@@ -3,8 +3,9 @@ import logging
 import os
 import sys
 from typing import Callable, Tuple
-from dploot.action.masterkeys import add_masterkeys_argument_group, parse_masterkeys_options
+from dploot.action.masterkeys import add_masterkeys_argument_group, dump_lazy_masterkeys, parse_masterkeys_options, triage_users_masterkeys
 
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.lib.utils import handle_outputdir_option
@@ -18,6 +19,7 @@ class BrowserAction:
     def __init__(self, options: argparse.Namespace) -> None:
         self.options = options
         self.target = Target.from_options(options)
+        self.output = get_output(options)
         
         self.conn = None
         self._is_admin = None
@@ -39,6 +41,8 @@ class BrowserAction:
         self.pvkbytes, self.passwords, self.nthashes = parse_masterkeys_options(self.options, self.target)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -50,26 +54,12 @@ class BrowserAction:
         if self.is_admin:
             if self.masterkeys is None:
                 masterkeytriage = MasterkeysTriage(target=self.target, conn=self.conn, pvkbytes=self.pvkbytes, nthashes=self.nthashes, passwords=self.passwords)
-                logging.info("Triage ALL USERS masterkeys\n")
-                self.masterkeys = masterkeytriage.triage_masterkeys()
-                if not self.options.quiet: 
-                    for masterkey in self.masterkeys:
-                        masterkey.dump()
-                    print()
+                self.masterkeys = triage_users_masterkeys(masterkeytriage, self.options, self.output)
         
-            triage = BrowserTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            triage = BrowserTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.output.dump)
             logging.info('Triage Browser Credentials%sfor ALL USERS\n' % (' and Cookies ' if self.options.show_cookies else ' '))
-            credentials, cookies = triage.triage_browsers(gather_cookies=self.options.show_cookies)
-            for credential in credentials:
-                if self.options.quiet:
-                    credential.dump_quiet()
-                else:
-                    credential.dump()
-            if self.options.show_cookies:
-                for cookie in cookies:
-                    if self.options.quiet:
-                        cookie.dump_quiet()
-                    cookie.dump() 
+            triage.triage_browsers(gather_cookies=self.options.show_cookies)
+            dump_lazy_masterkeys(self.masterkeys, self.output)
             if self.outputdir is not None:
                 for filename, bytes in triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
@@ -99,7 +89,7 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         "-mkfile",
         action="store",
         help=(
-            "File containing {GUID}:SHA1 masterkeys mappings"
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
         ),
     )
 
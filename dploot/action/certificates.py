@@ -3,12 +3,13 @@ import logging
 import os
 import sys
 from typing import Callable, Tuple
-from dploot.action.masterkeys import add_masterkeys_argument_group, parse_masterkeys_options
+from dploot.action.masterkeys import add_masterkeys_argument_group, dump_lazy_masterkeys, parse_masterkeys_options, triage_users_masterkeys
 
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.lib.utils import handle_outputdir_option
-from dploot.triage.certificates import CertificatesTriage
+from dploot.triage.certificates import Certificate, CertificatesTriage
 from dploot.triage.masterkeys import MasterkeysTriage, parse_masterkey_file
 
 NAME = 'certificates'
@@ -18,6 +19,7 @@ class CertificatesAction:
     def __init__(self, options: argparse.Namespace) -> None:
         self.options = options
         self.target = Target.from_options(options)
+        self.output = get_output(options)
         
         self.conn = None
         self._is_admin = None
@@ -39,6 +41,8 @@ class CertificatesAction:
         self.pvkbytes, self.passwords, self.nthashes = parse_masterkeys_options(self.options, self.target)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -50,27 +54,12 @@ class CertificatesAction:
         if self.is_admin:
             if self.masterkeys is None:
                 masterkeytriage = MasterkeysTriage(target=self.target, conn=self.conn, pvkbytes=self.pvkbytes, nthashes=self.nthashes, passwords=self.passwords)
-                logging.info("Triage ALL USERS masterkeys\n")
-                self.masterkeys = masterkeytriage.triage_masterkeys()
-                if not self.options.quiet: 
-                    for masterkey in self.masterkeys:
-                        masterkey.dump()
-                    print()
+                self.masterkeys = triage_users_masterkeys(masterkeytriage, self.options, self.output)
                 
-            triage = CertificatesTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            triage = CertificatesTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.dump_certificate)
             logging.info('Triage Certificates for ALL USERS\n')
-            certificates = triage.triage_certificates()
-            for certificate in certificates:
-                if not self.options.dump_all and not certificate.clientauth:
-                    continue
-                if not self.options.quiet:
-                    certificate.dump()
-                filename = "%s_%s.pfx" % (certificate.username,certificate.filename[:16])
-                logging.critical("Writting certificate to %s" % filename)
-                if not self.options.quiet:
-                    print() # better outputing
-                with open(filename, "wb") as f:
-                    f.write(certificate.pfx)
+            triage.triage_certificates()
+            dump_lazy_masterkeys(self.masterkeys, self.output)
             if self.outputdir is not None:
                 for filename, bytes in triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
@@ -78,6 +67,16 @@ class CertificatesAction:
         else:
             logging.info("Not an admin, exiting...")
 
+    def dump_certificate(self, certificate: Certificate) -> None:
+        if not self.options.dump_all and not certificate.clientauth:
+            return
+        self.output.dump(certificate)
+        filename = "%s_%s.pfx" % (certificate.username,certificate.filename[:16])
+        logging.critical("Writting certificate to %s" % filename)
+        self.output.newline()
+        with open(filename, "wb") as f:
+            f.write(certificate.pfx)
+
     @property
     def is_admin(self) -> bool:
         if self._is_admin is not None:
@@ -100,7 +99,7 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         "-mkfile",
         action="store",
         help=(
-            "File containing {GUID}:SHA1 masterkeys mappings"
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
         ),
     )
 
@@ -4,10 +4,11 @@ import os
 import sys
 from typing import Callable, Tuple
 
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.lib.utils import handle_outputdir_option
-from dploot.triage.certificates import CertificatesTriage
+from dploot.triage.certificates import Certificate, CertificatesTriage
 from dploot.triage.masterkeys import MasterkeysTriage, parse_masterkey_file
 
 
@@ -19,6 +20,7 @@ class MachineCertificatesAction:
         self.options = options
 
         self.target = Target.from_options(options)
+        self.output = get_output(options)
 
         self.conn = None
         self._is_admin = None
@@ -35,6 +37,8 @@ class MachineCertificatesAction:
                 sys.exit(1)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -45,26 +49,14 @@ class MachineCertificatesAction:
         logging.info("Connected to %s as %s\\%s %s\n" % (self.target.address, self.target.domain, self.target.username, ( "(admin)"if self.is_admin  else "")))
         if self.is_admin:
             if self.masterkeys is None:
-                triage = MasterkeysTriage(target=self.target, conn=self.conn)
+                triage = MasterkeysTriage(target=self.target, conn=self.conn, per_finding_callback=self.output.dump)
                 logging.info("Triage SYSTEM masterkeys\n")
                 self.masterkeys = triage.triage_system_masterkeys()
-                if not self.options.quiet: 
-                    for masterkey in self.masterkeys:
-                        masterkey.dump()
-                    print()
+                self.output.newline()
                 
-            certificate_triage = CertificatesTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            certificate_triage = CertificatesTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.dump_certificate)
             logging.info('Triage SYSTEM Certificates\n')
-            certificates = certificate_triage.triage_system_certificates()
-            for certificate in certificates:
-                if not self.options.dump_all and not certificate.clientauth:
-                    continue
-                if not self.options.quiet:
-                    certificate.dump()
-                filename = "%s_%s.pfx" % (certificate.username,certificate.filename[:16])
-                logging.critical("Writting certificate to %s" % filename)
-                with open(filename, "wb") as f:
-                    f.write(certificate.pfx)
+            certificate_triage.triage_system_certificates()
             if self.outputdir is not None:
                 for filename, bytes in certificate_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
@@ -73,6 +65,15 @@ class MachineCertificatesAction:
         else:
             logging.info("Not an admin, exiting...")
 
+    def dump_certificate(self, certificate: Certificate) -> None:
+        if not self.options.dump_all and not certificate.clientauth:
+            return
+        self.output.dump(certificate)
+        filename = "%s_%s.pfx" % (certificate.username,certificate.filename[:16])
+        logging.critical("Writting certificate to %s" % filename)
+        with open(filename, "wb") as f:
+            f.write(certificate.pfx)
+
     @property
     def is_admin(self) -> bool:
         if self._is_admin is not None:
@@ -95,7 +96,7 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         "-mkfile",
         action="store",
         help=(
-            "File containing {GUID}:SHA1 masterkeys mappings"
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
         ),
     )
 
@@ -4,6 +4,8 @@ import os
 import sys
 from typing import Callable, Tuple
 
+from dploot.lib.journal import get_journal
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.lib.utils import handle_outputdir_option
@@ -19,6 +21,7 @@ class MachineCredentialsAction:
         self.options = options
 
         self.target = Target.from_options(options)
+        self.output = get_output(options)
 
         self.conn = None
         self._is_admin = None
@@ -35,6 +38,8 @@ class MachineCredentialsAction:
                 sys.exit(1)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -45,22 +50,15 @@ class MachineCredentialsAction:
         logging.info("Connected to %s as %s\\%s %s\n" % (self.target.address, self.target.domain, self.target.username, ( "(admin)"if self.is_admin  else "")))
         if self.is_admin:
             if self.masterkeys is None:
-                triage = MasterkeysTriage(target=self.target, conn=self.conn)
+                triage = MasterkeysTriage(target=self.target, conn=self.conn, per_finding_callback=self.output.dump)
                 logging.info("Triage SYSTEM masterkeys\n")
                 self.masterkeys = triage.triage_system_masterkeys()
-                if not self.options.quiet: 
-                    for masterkey in self.masterkeys:
-                        masterkey.dump()
-                    print()
+                self.output.newline()
 
-            cred_triage = CredentialsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            cred_triage = CredentialsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.output.dump)
             logging.info('Triage SYSTEM Credentials\n')
-            credentials = cred_triage.triage_system_credentials()
-            for credential in credentials:
-                if self.options.quiet:
-                    credential.dump_quiet()
-                else:
-                    credential.dump()
+            cred_triage.triage_system_credentials()
+            get_journal(self.target).commit('credentials', output=self.output)
             if self.outputdir is not None:
                 for filename, bytes in cred_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
@@ -91,7 +89,7 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         "-mkfile",
         action="store",
         help=(
-            "File containing {GUID}:SHA1 masterkeys mappings"
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
         ),
     )
 
@@ -4,6 +4,7 @@ import os
 import sys
 from typing import Callable, Tuple
 
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.lib.utils import handle_outputdir_option
@@ -18,6 +19,7 @@ class MachineMasterkeysAction:
         self.options = options
 
         self.target = Target.from_options(options)
+        self.output = get_output(options)
 
         self.conn = None
         self._is_admin = None
@@ -31,6 +33,8 @@ class MachineMasterkeysAction:
             self.outputfile = self.options.outputfile
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -40,18 +44,14 @@ class MachineMasterkeysAction:
         self.connect()
         logging.info("Connected to %s as %s\\%s %s\n" % (self.target.address, self.target.domain, self.target.username, ( "(admin)"if self.is_admin  else "")))
         if self.is_admin:
-            triage = MasterkeysTriage(target=self.target, conn=self.conn)
+            triage = MasterkeysTriage(target=self.target, conn=self.conn, per_finding_callback=lambda masterkey: self.output.dump(masterkey, always=True))
             logging.info("Triage SYSTEM masterkeys\n")
             masterkeys = triage.triage_system_masterkeys()
             if self.outputfile is not None:
                 with open(self.outputfile + '.mkf', ('a+' if self.append else 'w')) as file:
                     logging.critical("Writting masterkeys to %s" % self.outputfile)
                     for masterkey in masterkeys:
-                        masterkey.dump()
                         file.write(str(masterkey)+'\n')
-            else:
-                for masterkey in masterkeys:
-                    masterkey.dump()
             if self.outputdir is not None:
                 for filename, bytes in triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
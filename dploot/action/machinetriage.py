@@ -4,10 +4,12 @@ import os
 import sys
 from typing import Callable, Tuple
 
+from dploot.lib.journal import get_journal
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.lib.utils import handle_outputdir_option
-from dploot.triage.certificates import CertificatesTriage
+from dploot.triage.certificates import Certificate, CertificatesTriage
 from dploot.triage.credentials import CredentialsTriage
 from dploot.triage.masterkeys import MasterkeysTriage, parse_masterkey_file
 from dploot.triage.vaults import VaultsTriage
@@ -19,6 +21,7 @@ class MachineTriageAction:
     def __init__(self, options: argparse.Namespace) -> None:
         self.options = options
         self.target = Target.from_options(options)
+        self.output = get_output(options)
         
         self.conn = None
         self._is_admin = None
@@ -39,6 +42,8 @@ class MachineTriageAction:
                 sys.exit(1)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -50,53 +55,36 @@ class MachineTriageAction:
         
         if self.is_admin:
             if self.masterkeys is None:
-                masterkeys_triage = MasterkeysTriage(target=self.target, conn=self.conn)
+                masterkeys_triage = MasterkeysTriage(target=self.target, conn=self.conn, per_finding_callback=self.output.dump)
                 logging.info("Triage SYSTEM masterkeys\n")
                 self.masterkeys = masterkeys_triage.triage_system_masterkeys()
-                if not self.options.quiet: 
-                    for masterkey in self.masterkeys:
-                        masterkey.dump()
-                    print()
+                self.output.newline()
                 if self.outputdir is not None:
                         for filename, bytes in masterkeys_triage.looted_files.items():
                             with open(os.path.join(self.outputdir, 'masterkeys', filename),'wb') as outputfile:
                                 outputfile.write(bytes)
 
-            credentials_triage = CredentialsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            credentials_triage = CredentialsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.output.dump)
             logging.info('Triage SYSTEM Credentials\n')
-            credentials = credentials_triage.triage_system_credentials()
-            for credential in credentials:
-                if self.options.quiet:
-                    credential.dump_quiet()
-                else:
-                    credential.dump()
+            credentials_triage.triage_system_credentials()
+            get_journal(self.target).commit('credentials', output=self.output)
             if self.outputdir is not None:
                 for filename, bytes in credentials_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
                         outputfile.write(bytes)
 
-            vaults_triage = VaultsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            vaults_triage = VaultsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.output.dump)
             logging.info('Triage SYSTEM Vaults\n')
-            vaults = vaults_triage.triage_system_vaults()
-            for vault in vaults:
-                vault.dump()
+            vaults_triage.triage_system_vaults()
+            get_journal(self.target).commit('vaults', output=self.output)
             if self.outputdir is not None:
                 for filename, bytes in vaults_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
                         outputfile.write(bytes)
 
-            certificate_triage = CertificatesTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            certificate_triage = CertificatesTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.dump_certificate)
             logging.info('Triage SYSTEM Certificates\n')
-            certificates = certificate_triage.triage_system_certificates()
-            for certificate in certificates:
-                if self.options.dump_all and not certificate.clientauth:
-                    continue
-                if not self.options.quiet:
-                    certificate.dump()
-                filename = "%s_%s.pfx" % (certificate.username,certificate.filename[:16])
-                logging.critical("Writting certificate to %s" % filename)
-                with open(filename, "wb") as f:
-                    f.write(certificate.pfx)
+            certificate_triage.triage_system_certificates()
             if self.outputdir is not None:
                 for filename, bytes in certificate_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
@@ -104,6 +92,15 @@ class MachineTriageAction:
         else:
             logging.info("Not an admin, exiting...")
 
+    def dump_certificate(self, certificate: Certificate) -> None:
+        if self.options.dump_all and not certificate.clientauth:
+            return
+        self.output.dump(certificate)
+        filename = "%s_%s.pfx" % (certificate.username,certificate.filename[:16])
+        logging.critical("Writting certificate to %s" % filename)
+        with open(filename, "wb") as f:
+            f.write(certificate.pfx)
+
     @property
     def is_admin(self) -> bool:
         if self._is_admin is not None:
@@ -126,7 +123,7 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         "-mkfile",
         action="store",
         help=(
-            "File containing {GUID}:SHA1 masterkeys mappings"
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
         ),
     )
 
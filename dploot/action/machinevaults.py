@@ -4,6 +4,8 @@ import os
 import sys
 from typing import Callable, Tuple
 
+from dploot.lib.journal import get_journal
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.lib.utils import handle_outputdir_option
@@ -20,6 +22,7 @@ class MachineVaultsAction:
         self.options = options
 
         self.target = Target.from_options(options)
+        self.output = get_output(options)
 
         self.conn = None
         self._is_admin = None
@@ -36,6 +39,8 @@ class MachineVaultsAction:
                 sys.exit(1)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -46,22 +51,15 @@ class MachineVaultsAction:
         logging.info("Connected to %s as %s\\%s %s\n" % (self.target.address, self.target.domain, self.target.username, ( "(admin)"if self.is_admin  else "")))
         if self.is_admin:
             if self.masterkeys is None:
-                triage = MasterkeysTriage(target=self.target, conn=self.conn)
+                triage = MasterkeysTriage(target=self.target, conn=self.conn, per_finding_callback=self.output.dump)
                 logging.info("Triage SYSTEM masterkeys\n")
                 self.masterkeys = triage.triage_system_masterkeys()
-                if not self.options.quiet: 
-                    for masterkey in self.masterkeys:
-                        masterkey.dump()
-                    print()
+                self.output.newline()
 
-            vaults_triage = VaultsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            vaults_triage = VaultsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.output.dump)
             logging.info('Triage SYSTEM Vaults\n')
-            vaults = vaults_triage.triage_system_vaults()
-            for vault in vaults:
-                if self.options.quiet:
-                    vault.dump_quiet() 
-                else:
-                    vault.dump()
+            vaults_triage.triage_system_vaults()
+            get_journal(self.target).commit('vaults', output=self.output)
             if self.outputdir is not None:
                 for filename, bytes in vaults_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
@@ -92,7 +90,7 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         "-mkfile",
         action="store",
         help=(
-            "File containing {GUID}:SHA1 masterkeys mappings"
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
         ),
     )
 
@@ -2,12 +2,13 @@ import argparse
 import logging
 import os
 import sys
-from typing import Callable, Dict, Tuple
+from typing import Any, Callable, Dict, List, Tuple
 
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
-from dploot.lib.utils import handle_outputdir_option, parse_file_as_dict
-from dploot.triage.masterkeys import MasterkeysTriage
+from dploot.lib.utils import handle_outputdir_option, parse_file_as_multidict
+from dploot.triage.masterkeys import LazyMasterkeys, Masterkey, MasterkeysTriage
 
 
 NAME = 'masterkeys'
@@ -18,6 +19,7 @@ class MasterkeysAction:
         self.options = options
 
         self.target = Target.from_options(options)
+        self.output = get_output(options)
 
         self.conn = None
         self._is_admin = None
@@ -35,6 +37,8 @@ class MasterkeysAction:
         self.pvkbytes, self.passwords, self.nthashes = parse_masterkeys_options(self.options, self.target)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -44,18 +48,14 @@ class MasterkeysAction:
         self.connect()
         logging.info("Connected to %s as %s\\%s %s\n" % (self.target.address, self.target.domain, self.target.username, ( "(admin)"if self.is_admin  else "")))
         if self.is_admin:
-            triage = MasterkeysTriage(target=self.target, conn=self.conn, pvkbytes=self.pvkbytes, nthashes=self.nthashes, passwords=self.passwords)
+            triage = MasterkeysTriage(target=self.target, conn=self.conn, pvkbytes=self.pvkbytes, nthashes=self.nthashes, passwords=self.passwords, per_finding_callback=lambda masterkey: self.output.dump(masterkey, always=True))
             logging.info("Triage ALL USERS masterkeys\n")
             masterkeys = triage.triage_masterkeys()
             if self.outputfile is not None:
                 with open(self.outputfile + '.mkf', 'a+')as file:
                     logging.critical("Writting masterkeys to %s" % self.outputfile)
                     for masterkey in masterkeys:
-                        masterkey.dump()
                         file.write(str(masterkey)+'\n')
-            else:
-                for masterkey in masterkeys:
-                    masterkey.dump()
             if self.outputdir is not None:
                 for filename, bytes in triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
@@ -76,7 +76,7 @@ def entry(options: argparse.Namespace) -> None:
     a = MasterkeysAction(options)
     a.run()
 
-def parse_masterkeys_options(options: argparse.Namespace, target: Target) -> Tuple[bytes,Dict[str,str],Dict[str,str]]:
+def parse_masterkeys_options(options: argparse.Namespace, target: Target) -> Tuple[bytes,Dict[str,List[str]],Dict[str,List[str]]]:
     pvkbytes = None
     passwords = {}
     nthashes = {}
@@ -89,14 +89,14 @@ def parse_masterkeys_options(options: argparse.Namespace, target: Target) -> Tup
 
     if hasattr(options,'passwords') and options.passwords is not None:
         try:
-            passwords = parse_file_as_dict(options.passwords)
+            passwords = parse_file_as_multidict(options.passwords)
         except Exception as e:
             logging.error(str(e))
             sys.exit(1)
 
     if hasattr(options,'nthashes') and options.nthashes is not None:
         try:
-            nthashes = parse_file_as_dict(options.nthashes)
+            nthashes = parse_file_as_multidict(options.nthashes)
         except Exception as e:
             logging.error(str(e))
             sys.exit(1)
@@ -104,22 +104,52 @@ def parse_masterkeys_options(options: argparse.Namespace, target: Target) -> Tup
     if target.password is not None and target.password != '':
         if passwords is None:
             passwords = dict()
-        passwords[target.username] = target.password
+        passwords[target.username] = [target.password] + passwords.get(target.username, list())
 
     if target.nthash is not None and target.nthash != '':
         if nthashes is None:
             nthashes = dict()
-        nthashes[target.username] = target.nthash.lower()
+        nthashes[target.username] = [target.nthash] + nthashes.get(target.username, list())
 
     if nthashes is not None:
-        nthashes = {k.lower():v.lower() for k, v in nthashes.items()}
+        nthashes = merge_usernames({k:[v.lower() for v in values] for k, values in nthashes.items()})
     
     if passwords is not None:
-        passwords = {k.lower():v for k, v in passwords.items()}
+        passwords = merge_usernames(passwords)
 
     return pvkbytes, passwords, nthashes
 
-def add_masterkeys_argument_group(group: argparse._ArgumentGroup) -> None:
+def triage_users_masterkeys(triage: MasterkeysTriage, options: argparse.Namespace, output: Any) -> "List[Masterkey] | LazyMasterkeys":
+    ''' Triages and outputs the masterkeys of every user, for actions decrypting their blobs
+
+    With -lazy-masterkeys, returns them to be decrypted as blobs need them instead, see dump_lazy_masterkeys
+    '''
+    if getattr(options, 'lazy_masterkeys', False):
+        logging.info("ALL USERS masterkeys will be decrypted as blobs need them\n")
+        return triage.lazy_masterkeys()
+    logging.info("Triage ALL USERS masterkeys\n")
+    triage.per_finding_callback = output.dump
+    masterkeys = triage.triage_masterkeys()
+    output.newline()
+    return masterkeys
+
+def dump_lazy_masterkeys(masterkeys: "List[Masterkey] | LazyMasterkeys", output: Any) -> None:
+    ''' Outputs the lazy masterkeys decrypted since the last call '''
+    if not isinstance(masterkeys, LazyMasterkeys):
+        return
+    decrypted = masterkeys.pop_decrypted()
+    for masterkey in decrypted:
+        output.dump(masterkey)
+    if len(decrypted) > 0:
+        output.newline()
+
+def merge_usernames(secrets: Dict[str,List[str]]) -> Dict[str,List[str]]:
+    merged = dict()
+    for username, values in secrets.items():
+        merged.setdefault(username.lower(), list()).extend(values)
+    return merged
+
+def add_masterkeys_argument_group(group: argparse._ArgumentGroup, lazy: bool = True) -> None:
 
     group.add_argument(
         "-pvk",
@@ -133,7 +163,8 @@ def add_masterkeys_argument_group(group: argparse._ArgumentGroup) -> None:
         "-passwords",
         action="store",
         help=(
-            "File containing username:password that will be used eventually to decrypt masterkeys"
+            "File containing username:password (or SID:password) that will be used eventually to decrypt masterkeys. "
+            "A username may have several lines, the secrets of * are tried for every user"
         ),
     )
 
@@ -141,17 +172,27 @@ def add_masterkeys_argument_group(group: argparse._ArgumentGroup) -> None:
         "-nthashes",
         action="store",
         help=(
-            "File containing username:nthash that will be used eventually to decrypt masterkeys"
+            "File containing username:nthash (or SID:nthash) that will be used eventually to decrypt masterkeys. "
+            "A username may have several lines, the secrets of * are tried for every user"
         ),
     )
 
+    if lazy:
+        group.add_argument(
+            "-lazy-masterkeys",
+            action="store_true",
+            help=(
+                "Only read and decrypt the masterkeys of the blobs found, instead of every masterkey first"
+            ),
+        )
+
 def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable]:
 
     subparser = subparsers.add_parser(NAME, help="Dump users masterkey from remote target")
 
     group = subparser.add_argument_group("masterkeys options")
 
-    add_masterkeys_argument_group(group)
+    add_masterkeys_argument_group(group, lazy=False)
 
     group.add_argument(
         "-outputfile",
@@ -0,0 +1,71 @@
+import argparse
+import logging
+import sys
+from typing import Callable, Tuple
+
+from dploot.triage.masterkeys import parse_masterkey_file, write_masterkey_file
+
+NAME = 'mkfile'
+
+class MkfileAction:
+    ''' Converts masterkey files between the text and the binary format, offline '''
+
+    def __init__(self, options: argparse.Namespace) -> None:
+        self.options = options
+
+    def run(self) -> None:
+        masterkeys = list()
+        for filename in self.options.mkfile:
+            try:
+                masterkeys.extend(parse_masterkey_file(filename))
+            except Exception as e:
+                logging.error("Could not read %s: %s" % (filename, e))
+                sys.exit(1)
+
+        if self.options.text:
+            written = set()
+            with open(self.options.outputfile, 'w') as f:
+                for masterkey in masterkeys:
+                    if masterkey.guid not in written:
+                        written.add(masterkey.guid)
+                        f.write(str(masterkey) + '\n')
+            count = len(written)
+        else:
+            count = write_masterkey_file(self.options.outputfile, masterkeys)
+        logging.info("Wrote %d masterkeys to %s" % (count, self.options.outputfile))
+
+def entry(options: argparse.Namespace) -> None:
+    a = MkfileAction(options)
+    a.run()
+
+def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable]:
+    subparser = subparsers.add_parser(NAME, help="Convert masterkey files to the binary format accepted by -mkfile, offline")
+
+    subparser.add_argument(
+        "mkfile",
+        nargs="+",
+        help=(
+            "Masterkey files to merge, text files of {GUID}:SHA1 lines or binary masterkey files"
+        ),
+    )
+
+    group = subparser.add_argument_group("mkfile options")
+
+    group.add_argument(
+        "-outputfile",
+        action="store",
+        required=True,
+        help=(
+            "Masterkey file to write"
+        ),
+    )
+
+    group.add_argument(
+        "-text",
+        action="store_true",
+        help=(
+            "Write {GUID}:SHA1 lines instead of the binary format"
+        ),
+    )
+
+    return NAME, entry
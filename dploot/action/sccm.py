@@ -3,6 +3,7 @@ import logging
 import sys
 from typing import Callable, Tuple
 
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.lib.utils import handle_outputdir_option
@@ -16,6 +17,7 @@ class SCCMAction:
     def __init__(self, options: argparse.Namespace) -> None:
         self.options = options
         self.target = Target.from_options(options)
+        self.output = get_output(options)
         
         self.conn = None
         self._is_admin = None
@@ -33,6 +35,8 @@ class SCCMAction:
                 sys.exit(1)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -43,32 +47,14 @@ class SCCMAction:
         logging.info("Connected to %s as %s\\%s %s\n" % (self.target.address, self.target.domain, self.target.username, ( "(admin)"if self.is_admin  else "")))
         if self.is_admin:
             if self.masterkeys is None:
-                triage = MasterkeysTriage(target=self.target, conn=self.conn)
+                triage = MasterkeysTriage(target=self.target, conn=self.conn, per_finding_callback=self.output.dump)
                 logging.info("Triage SYSTEM masterkeys\n")
                 self.masterkeys = triage.triage_system_masterkeys()
-                if not self.options.quiet:
-                    for masterkey in self.masterkeys:
-                        masterkey.dump()
-                    print()
+                self.output.newline()
 
-            triage = SCCMTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, use_wmi=self.options.wmi)
+            triage = SCCMTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, use_wmi=self.options.wmi, wmi_batch_size=self.options.wmi_batch_size, per_finding_callback=self.output.dump)
             logging.info('Triage SCCM Secrets\n')
-            sccmcreds, sccmtasks, sccmcollections = triage.triage_sccm()
-            for sccm_cred in sccmcreds:
-                if self.options.quiet:
-                    sccm_cred.dump_quiet()
-                else:
-                    sccm_cred.dump()
-            for sccm_task in sccmtasks:
-                if self.options.quiet:
-                    sccm_task.dump_quiet()
-                else:
-                    sccm_task.dump()
-            for sccm_collection in sccmcollections:
-                if self.options.quiet:
-                    sccm_collection.dump_quiet()
-                else:
-                    sccm_collection.dump()
+            triage.triage_sccm()
         else:
             logging.info("Not an admin, exiting...")
 
@@ -94,7 +80,7 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         "-mkfile",
         action="store",
         help=(
-            "File containing {GUID}:SHA1 masterkeys mappings"
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
         ),
     )
 
@@ -115,6 +101,17 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         )
     )
 
+    group.add_argument(
+        "-wmi-batch-size",
+        action="store",
+        type=int,
+        default=100,
+        metavar="N",
+        help=(
+            "Number of WMI objects fetched per request with -wmi (default 100)"
+        )
+    )
+
     add_target_argument_group(subparser)
 
     return NAME, entry
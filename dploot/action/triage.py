@@ -3,12 +3,14 @@ import logging
 import os
 import sys
 from typing import Callable, Tuple
-from dploot.action.masterkeys import add_masterkeys_argument_group, parse_masterkeys_options
+from dploot.action.masterkeys import add_masterkeys_argument_group, dump_lazy_masterkeys, parse_masterkeys_options, triage_users_masterkeys
 
+from dploot.lib.journal import get_journal
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.lib.utils import handle_outputdir_option
-from dploot.triage.certificates import CertificatesTriage
+from dploot.triage.certificates import Certificate, CertificatesTriage
 from dploot.triage.credentials import CredentialsTriage
 from dploot.triage.masterkeys import MasterkeysTriage, parse_masterkey_file
 from dploot.triage.rdg import RDGTriage
@@ -21,6 +23,7 @@ class TriageAction:
     def __init__(self, options: argparse.Namespace) -> None:
         self.options = options
         self.target = Target.from_options(options)
+        self.output = get_output(options)
         
         self.conn = None
         self._is_admin = None
@@ -45,6 +48,8 @@ class TriageAction:
         self.pvkbytes, self.passwords, self.nthashes = parse_masterkeys_options(self.options, self.target)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -55,90 +60,65 @@ class TriageAction:
         logging.info("Connected to %s as %s\\%s %s\n" % (self.target.address, self.target.domain, self.target.username, ( "(admin)"if self.is_admin  else "")))
         
         if self.is_admin:
+            masterkeys_triage = None
             if self.masterkeys is None:
                 masterkeys_triage = MasterkeysTriage(target=self.target, conn=self.conn, pvkbytes=self.pvkbytes, nthashes=self.nthashes, passwords=self.passwords)
-                logging.info("Triage ALL USERS masterkeys\n")
-                self.masterkeys = masterkeys_triage.triage_masterkeys()
-                if not self.options.quiet: 
-                    for masterkey in self.masterkeys:
-                        masterkey.dump()
-                    print()
-                if self.outputdir is not None:
-                    for filename, bytes in masterkeys_triage.looted_files.items():
-                        with open(os.path.join(self.outputdir, 'masterkeys', filename),'wb') as outputfile:
-                            outputfile.write(bytes)
+                self.masterkeys = triage_users_masterkeys(masterkeys_triage, self.options, self.output)
                 
-            credentials_triage = CredentialsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            credentials_triage = CredentialsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.output.dump)
             logging.info('Triage Credentials for ALL USERS\n')
-            credentials = credentials_triage.triage_credentials()
-            for credential in credentials:
-                if self.options.quiet:
-                    credential.dump_quiet()
-                else:
-                    credential.dump()
+            credentials_triage.triage_credentials()
+            dump_lazy_masterkeys(self.masterkeys, self.output)
+            get_journal(self.target).commit('credentials', output=self.output)
             if self.outputdir is not None:
                 for filename, bytes in credentials_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
                         outputfile.write(bytes)
 
-            vaults_triage = VaultsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            vaults_triage = VaultsTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.output.dump)
             logging.info('Triage Vaults for ALL USERS\n')
-            vaults = vaults_triage.triage_vaults()
-            for vault in vaults:
-                if self.options.quiet:
-                    vault.dump_quiet()
-                else: 
-                    vault.dump()
+            vaults_triage.triage_vaults()
+            dump_lazy_masterkeys(self.masterkeys, self.output)
+            get_journal(self.target).commit('vaults', output=self.output)
             if self.outputdir is not None:
                 for filename, bytes in vaults_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
                         outputfile.write(bytes)
 
-            rdg_triage = RDGTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            rdg_triage = RDGTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.output.dump)
             logging.info('Triage RDCMAN Settings and RDG files for ALL USERS\n')
-            rdcman_files, rdgfiles = rdg_triage.triage_rdcman()
-            for rdcman_file in rdcman_files:
-                if rdcman_file is None:
-                    continue
-                logging.debug("RDCMAN File: %s\n" %  (rdcman_file.filepath))
-                for rdg_cred in rdcman_file.rdg_creds:
-                    if self.options.quiet:
-                        rdg_cred.dump_quiet()
-                    else:
-                        rdg_cred.dump()
-            for rdgfile in rdgfiles:
-                if rdgfile is None:
-                    continue
-                logging.debug("Found RDG file: %s\n" %  (rdgfile.filepath))
-                for rdg_cred in rdgfile.rdg_creds:
-                    if self.options.quiet:
-                        rdg_cred.dump_quiet()
-                    else:
-                        rdg_cred.dump() 
+            rdg_triage.triage_rdcman()
+            dump_lazy_masterkeys(self.masterkeys, self.output)
             if self.outputdir is not None:
                 for filename, bytes in rdg_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
                         outputfile.write(bytes)
 
-            certificates_triage = CertificatesTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            certificates_triage = CertificatesTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.dump_certificate)
             logging.info('Triage Certificates for ALL USERS\n')
-            certificates = certificates_triage.triage_certificates()
-            for certificate in certificates:
-                if self.options.dump_all and not certificate.clientauth:
-                    continue
-                if not self.options.quiet:
-                    certificate.dump()
-                filename = "%s_%s.pfx" % (certificate.username,certificate.filename[:16])
-                logging.critical("Writting certificate to %s" % filename)
-                with open(filename, "wb") as f:
-                    f.write(certificate.pfx)
+            certificates_triage.triage_certificates()
+            dump_lazy_masterkeys(self.masterkeys, self.output)
             if self.outputdir is not None:
                 for filename, bytes in certificates_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
                         outputfile.write(bytes)
+            # lazy masterkeys are only read once blobs need them
+            if self.outputdir is not None and masterkeys_triage is not None:
+                for filename, bytes in masterkeys_triage.looted_files.items():
+                    with open(os.path.join(self.outputdir, 'masterkeys', filename),'wb') as outputfile:
+                        outputfile.write(bytes)
         else:
             logging.info("Not an admin, exiting...")
 
+    def dump_certificate(self, certificate: Certificate) -> None:
+        if self.options.dump_all and not certificate.clientauth:
+            return
+        self.output.dump(certificate)
+        filename = "%s_%s.pfx" % (certificate.username,certificate.filename[:16])
+        logging.critical("Writting certificate to %s" % filename)
+        with open(filename, "wb") as f:
+            f.write(certificate.pfx)
+
     @property
     def is_admin(self) -> bool:
         if self._is_admin is not None:
@@ -161,7 +141,7 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         "-mkfile",
         action="store",
         help=(
-            "File containing {GUID}:SHA1 masterkeys mappings"
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
         ),
     )
 
@@ -4,6 +4,7 @@ import os
 import sys
 from typing import Callable, Tuple
 
+from dploot.lib.output import get_output
 from dploot.lib.smb import DPLootSMBConnection
 from dploot.lib.target import Target, add_target_argument_group
 from dploot.lib.utils import handle_outputdir_option
@@ -20,6 +21,7 @@ class WifiAction:
         self.options = options
 
         self.target = Target.from_options(options)
+        self.output = get_output(options)
 
         self.conn = None
         self._is_admin = None
@@ -38,6 +40,8 @@ class WifiAction:
                 sys.exit(1)
 
     def connect(self) -> None:
+        if self.conn is not None:
+            return
         self.conn = DPLootSMBConnection(self.target)
         if self.conn.connect() is None:
             logging.error("Could not connect to %s" % self.target.address)
@@ -48,25 +52,17 @@ class WifiAction:
         logging.info("Connected to %s as %s\\%s %s\n" % (self.target.address, self.target.domain, self.target.username, ( "(admin)"if self.is_admin  else "")))
         if self.is_admin:
             if self.masterkeys is None:
-                triage = MasterkeysTriage(target=self.target, conn=self.conn, pvkbytes=self.pvkbytes, nthashes=self.nthashes, passwords=self.passwords)
+                triage = MasterkeysTriage(target=self.target, conn=self.conn, pvkbytes=self.pvkbytes, nthashes=self.nthashes, passwords=self.passwords, per_finding_callback=self.output.dump)
                 logging.info("Triage SYSTEM masterkeys\n")
                 self.masterkeys = triage.triage_system_masterkeys()
                 # we need user masterkeys, too.
                 logging.info("Triage ALL USERS masterkeys\n")
                 self.masterkeys.extend(triage.triage_masterkeys())
-                if not self.options.quiet:
-                    for masterkey in self.masterkeys:
-                        masterkey.dump()
-                    print()
+                self.output.newline()
 
-            wifi_triage = WifiTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys)
+            wifi_triage = WifiTriage(target=self.target, conn=self.conn, masterkeys=self.masterkeys, per_finding_callback=self.output.dump)
             logging.info('Triage ALL WIFI profiles\n')
-            wifi_creds = wifi_triage.triage_wifi()
-            for wifi_cred in wifi_creds:
-                if self.options.quiet:
-                    wifi_cred.dump_quiet()
-                else:
-                    wifi_cred.dump()
+            wifi_triage.triage_wifi()
             if self.outputdir is not None:
                 for filename, bytes in wifi_triage.looted_files.items():
                     with open(os.path.join(self.outputdir, filename),'wb') as outputfile:
@@ -97,7 +93,7 @@ def add_subparser(subparsers: argparse._SubParsersAction) -> Tuple[str, Callable
         "-mkfile",
         action="store",
         help=(
-            "File containing {GUID}:SHA1 masterkeys mappings"
+            "File containing {GUID}:SHA1 masterkeys mappings, or a binary masterkey file written by the mkfile action"
         ),
     )
 
@@ -1,64 +1,94 @@
 import argparse
-import importlib.metadata
+import importlib
 import logging
 import sys
 import traceback
+from types import ModuleType
+from typing import List
 
 from impacket.examples import logger
 
-from dploot.action import (
-    certificates,
-    credentials,
-    masterkeys,
-    vaults,
-    backupkey,
-    rdg,
-    sccm,
-    triage,
-    machinemasterkeys,
-    machinecredentials,
-    machinevaults,
-    machinecertificates,
-    machinetriage,
-    browser,
-    wifi,
-    mobaxterm,
-    )
-
+from dploot.lib.cache import save_incremental_caches
+from dploot.lib.journal import close_journals
+from dploot.lib.masterkeydb import close_masterkey_databases
+from dploot.lib.output import close_outputs
+from dploot.lib.profile import DPLootProfiler
+from dploot.lib.stats import stats
 
+# action modules, named after their action. They are only imported when needed (see
+# load_entry_parsers): through the triage classes they load impacket, cryptography, lxml, ...
 ENTRY_PARSERS = [
-    certificates,
-    credentials,
-    masterkeys,
-    vaults,
-    backupkey,
-    rdg,
-    sccm,
-    triage,
-    machinemasterkeys,
-    machinecredentials,
-    machinevaults,
-    machinecertificates,
-    machinetriage,
-    browser,
-    wifi,
-    mobaxterm,
+    'certificates',
+    'credentials',
+    'masterkeys',
+    'vaults',
+    'backupkey',
+    'rdg',
+    'sccm',
+    'triage',
+    'machinemasterkeys',
+    'machinecredentials',
+    'machinevaults',
+    'machinecertificates',
+    'machinetriage',
+    'browser',
+    'wifi',
+    'mobaxterm',
+    'run',
+    'mkfile',
 ]
 
-def main() -> None:
-    logger.init()
-    version = importlib.metadata.version("dploot")
-    parser = argparse.ArgumentParser(description=f"DPAPI looting remotely in Python.\nVersion {version}", add_help=True)
-
+def add_main_arguments(parser: argparse.ArgumentParser) -> None:
     parser.add_argument("-debug", action="store_true", help="Turn DEBUG output ON")
 
     parser.add_argument("-quiet", action="store_true", help="Only output dumped credentials")
 
+    parser.add_argument(
+        "-profile",
+        action="store",
+        metavar="file",
+        help=(
+            "Profile the action: a Chrome trace of connections, triages, remote files and decryption "
+            "if file ends with .json (chrome://tracing, Perfetto), a cProfile pstats file otherwise"
+        ),
+    )
+
+class _ActionParser(argparse.ArgumentParser):
+    ''' Finds the action in the command line, leaving errors to the full parser '''
+
+    def error(self, message: str) -> None:
+        raise ValueError(message)
+
+def load_entry_parsers(argv: List[str]) -> List[ModuleType]:
+    ''' Imports the module of the action in argv, or every action module for the main help and errors '''
+    preparser = _ActionParser(add_help=False)
+    add_main_arguments(preparser)
+    preparser.add_argument("action", nargs="?")
+    preparser.add_argument("args", nargs=argparse.REMAINDER)
+    try:
+        action = preparser.parse_known_args(argv)[0].action
+    except ValueError:
+        action = None
+    names = [action] if action in ENTRY_PARSERS else ENTRY_PARSERS
+    return [importlib.import_module('dploot.action.' + name) for name in names]
+
+def main() -> None:
+    logger.init()
+    parser = argparse.ArgumentParser(add_help=True)
+    add_main_arguments(parser)
+
     subparsers = parser.add_subparsers(help="Action", dest="action", required=True)
 
     actions = dict()
 
-    for entry_parser in ENTRY_PARSERS:
+    entry_parsers = load_entry_parsers(sys.argv[1:])
+    if len(entry_parsers) > 1:
+        # only shown by the main help, and importlib.metadata is slow to load
+        import importlib.metadata
+        version = importlib.metadata.version("dploot")
+        parser.description = f"DPAPI looting remotely in Python.\nVersion {version}"
+
+    for entry_parser in entry_parsers:
         action, entry = entry_parser.add_subparser(subparsers)
         actions[action] = entry
 
@@ -75,15 +105,43 @@ def main() -> None:
     else:
         logging.getLogger().setLevel(logging.INFO)
 
+    if getattr(options, 'format', 'text') == 'jsonl':
+        # stdout only carries records: text output is off and logs go to stderr
+        options.quiet = True
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, logging.StreamHandler):
+                handler.setStream(sys.stderr)
+
     logging.debug(f"{options=}")
+    profiler = DPLootProfiler(options.profile) if options.profile is not None else None
     try:
-        actions[options.action](options)
+        if profiler is not None:
+            profiler.start()
+        with stats.timer('action.' + options.action):
+            actions[options.action](options)
     except Exception as e:
         logging.error("Got error: %s" % e)
         if options.debug:
             traceback.print_exc()
         else:
             logging.error("Use -debug to print a stacktrace")
+    finally:
+        if 'dploot.lib.wmi' in sys.modules:
+            # otherwise no WMI connection was opened
+            sys.modules['dploot.lib.wmi'].close_wmi_connections()
+        close_outputs()
+        close_journals()
+        close_masterkey_databases()
+        save_incremental_caches()
+        if 'dploot.lib.dpapi' in sys.modules:
+            # otherwise no masterkey candidate was tested in the pool of processes
+            sys.modules['dploot.lib.dpapi'].close_process_pool()
+        if profiler is not None:
+            profiler.stop()
+        if getattr(options, 'stats', False):
+            print('\n'.join(stats.summary()), file=sys.stderr)
+        if getattr(options, 'stats_file', None) is not None:
+            stats.dump(options.stats_file)
 
 
 if __name__ == "__main__":
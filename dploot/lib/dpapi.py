@@ -1,5 +1,10 @@
 import logging
-from typing import Any, Dict, List
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterable, List
 from Cryptodome.Cipher import AES, PKCS1_v1_5
 from Cryptodome.PublicKey import RSA
 from binascii import hexlify,unhexlify
@@ -13,9 +18,118 @@ from impacket.dpapi import MasterKeyFile, MasterKey, DomainKey,  DPAPI_BLOB, \
     PVK_FILE_HDR, PRIVATE_KEY_BLOB, ALGORITHMS_DATA, privatekeyblob_to_pkcs1, DPAPI_DOMAIN_RSA_MASTER_KEY, CredentialFile
 
 from dploot.lib.crypto import PRIVATE_KEY_RSA, PVKFile, PVKFile_SIG, PVKHeader, deriveKeysFromUser, deriveKeysFromUserkey, pvkblob_to_pkcs1
+from dploot.lib.stats import instrument, stats
 
-def decrypt_masterkey(masterkey:bytes, domain_backupkey:bytes= None, dpapi_systemkey:Dict= None, sid: str = '', password:str = None, nthash:str = None) -> Any:
-    if domain_backupkey is None and password is None and nthash is None and dpapi_systemkey is None:
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool() -> ProcessPoolExecutor:
+    ''' Returns the pool of processes testing masterkey candidates, PBKDF2 of impacket is pure Python '''
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawned, not forked: SMB sessions run in threads
+            _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+def close_process_pool() -> None:
+    ''' Stops the processes of the pool, if it was started, instead of leaving them to the exit handlers '''
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is None:
+        return
+    if sys.version_info >= (3, 9):
+        pool.shutdown(cancel_futures=True)
+    else:
+        pool.shutdown()
+
+def _derive_candidate_keys(sid: str, nthashes: List[str], passwords: List[str]) -> List[bytes]:
+    keys = list()
+    for nthash in nthashes:
+        key1, key2 = deriveKeysFromUserkey(sid, unhexlify(nthash))
+        keys += [key2, key1]
+    for password in passwords:
+        key1, key2, key3 = deriveKeysFromUser(sid, password)
+        keys += [key3, key2, key1]
+    return [key for key in keys if key is not None]
+
+def _try_candidate_keys(masterkey: bytes, keys: List[bytes]) -> "bytes | None":
+    mk = MasterKey(masterkey)
+    for key in keys:
+        decryptedKey = mk.decrypt(key)
+        if decryptedKey:
+            return decryptedKey
+    return None
+
+def _chunks(items: List[Any], size: int) -> Iterable[List[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class DPLootMasterkeyCandidates:
+    ''' Passwords and nthashes tried on the masterkeys of a SID
+
+    Keys are derived from the secrets once, on the first masterkey, then tested on each masterkey. Beyond
+    parallel_threshold keys, derivation and tests are spread over a pool of processes in chunks, and the
+    chunks not started yet are cancelled once one of them decrypts the masterkey.
+    '''
+
+    parallel_threshold = 8
+    chunk_size = 4
+
+    def __init__(self, sid: str, passwords: List[str] = None, nthashes: List[str] = None) -> None:
+        self.sid = sid
+        self.passwords = list(dict.fromkeys(passwords or []))
+        self.nthashes = list(dict.fromkeys(nthashes or []))
+        self._keys = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.passwords) + len(self.nthashes)
+
+    def parallel(self, count: int) -> bool:
+        return count > self.parallel_threshold and (os.cpu_count() or 1) > 1
+
+    @property
+    def keys(self) -> List[bytes]:
+        with self._lock:
+            if self._keys is None:
+                if not self.parallel(len(self) * 2):
+                    keys = _derive_candidate_keys(self.sid, self.nthashes, self.passwords)
+                else:
+                    pool = get_process_pool()
+                    futures = [pool.submit(_derive_candidate_keys, self.sid, nthashes, list())
+                               for nthashes in _chunks(self.nthashes, self.chunk_size)]
+                    futures += [pool.submit(_derive_candidate_keys, self.sid, list(), passwords)
+                                for passwords in _chunks(self.passwords, self.chunk_size)]
+                    keys = [key for future in futures for key in future.result()]
+                # the MD4 key of a password is the SHA1 key of its nthash
+                self._keys = list(dict.fromkeys(keys))
+            return self._keys
+
+    def decrypt(self, mk: MasterKey) -> "bytes | None":
+        ''' Returns the decrypted key of mk, None if no candidate decrypts it '''
+        keys = self.keys
+        stats.incr('dpapi.masterkey_candidates', len(keys))
+        if not self.parallel(len(keys)):
+            return _try_candidate_keys(mk.getData(), keys)
+        masterkey = mk.getData()
+        pending = {get_process_pool().submit(_try_candidate_keys, masterkey, chunk) for chunk in _chunks(keys, self.chunk_size)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    decryptedKey = future.result()
+                    if decryptedKey:
+                        return decryptedKey
+        finally:
+            for future in pending:
+                future.cancel()
+        return None
+
+@instrument('dpapi.decrypt_masterkey', outcome=True)
+def decrypt_masterkey(masterkey:bytes, domain_backupkey:bytes= None, dpapi_systemkey:Dict= None, sid: str = '', password:str = None, nthash:str = None, candidates: DPLootMasterkeyCandidates = None) -> Any:
+    if domain_backupkey is None and password is None and nthash is None and dpapi_systemkey is None and candidates is None:
         return None
     data = masterkey
     mkf = MasterKeyFile(data)
@@ -44,6 +158,11 @@ def decrypt_masterkey(masterkey:bytes, domain_backupkey:bytes= None, dpapi_syste
             key = domain_master_key['buffer'][:domain_master_key['cbMasterKey']]
             return key
 
+    if candidates is not None and len(candidates) > 0:
+        decryptedKey = candidates.decrypt(mk)
+        if decryptedKey:
+            return decryptedKey
+
     if sid != '':
         if nthash is not None:
             nthash = unhexlify(nthash)
@@ -110,6 +229,7 @@ def decrypt_masterkey(masterkey:bytes, domain_backupkey:bytes= None, dpapi_syste
                 return decryptedKey
     return None
 
+@instrument('dpapi.decrypt_credential', outcome=True)
 def decrypt_credential(credential_bytes:bytes, masterkey:MasterKey) -> Any:
     cred = CredentialFile(credential_bytes)
     decrypted = decrypt_blob(cred['Data'], masterkey)
@@ -122,6 +242,7 @@ def find_masterkey_for_credential_blob(credential_bytes:bytes, masterkeys: Any)
     cred = CredentialFile(credential_bytes)
     return find_masterkey_for_blob(cred['Data'], masterkeys=masterkeys)
 
+@instrument('dpapi.decrypt_privatekey', outcome=True)
 def decrypt_privatekey(privatekey_bytes:bytes, masterkey:Any, cng: bool = False) -> RSA.RsaKey:
     blob = PVKHeader(privatekey_bytes)
     if blob['SigHeadLen'] > 0:
@@ -146,6 +267,7 @@ def find_masterkey_for_privatekey_blob(privatekey_bytes:bytes, masterkeys: List[
     masterkey = bin_to_string(blob['Blob']['GuidMasterKey'])
     return find_masterkey(masterkey=masterkey, masterkeys=masterkeys)
 
+@instrument('dpapi.decrypt_vpol', outcome=True)
 def decrypt_vpol(vpol_bytes:bytes, masterkey:Any) -> "VAULT_VPOL_KEYS | None":
     vpol = VAULT_VPOL(vpol_bytes)
     blob = vpol['Blob']
@@ -157,6 +279,7 @@ def decrypt_vpol(vpol_bytes:bytes, masterkey:Any) -> "VAULT_VPOL_KEYS | None":
         return vpol_decrypted
     return None
         
+@instrument('dpapi.decrypt_vcrd', outcome=True)
 def decrypt_vcrd(vcrd_bytes:bytes, vpol_keys:List[bytes]) -> Any:
     blob = VAULT_VCRD(vcrd_bytes)
 
@@ -193,6 +316,7 @@ def find_masterkey_for_vpol_blob(vault_bytes:bytes, masterkeys: Any) -> "Any | N
     masterkey = bin_to_string(blob['GuidMasterKey'])
     return find_masterkey(masterkey=masterkey, masterkeys=masterkeys)
 
+@instrument('dpapi.decrypt_blob', outcome=True)
 def decrypt_blob(blob_bytes:bytes, masterkey:Any, entropy = None) -> "bytes | None":
     blob = DPAPI_BLOB(blob_bytes)
     # Ugly fix below:
@@ -268,4 +392,7 @@ def find_masterkey_for_blob(blob_bytes:bytes, masterkeys: Any) -> "Any | None":
 
 def find_masterkey(masterkey: str, masterkeys: Any) -> "Any | None":
     masterkey = masterkey.lower()
+    if hasattr(masterkeys, 'find'):
+        # LazyMasterkeys, decrypted as they are looked up
+        return masterkeys.find(masterkey)
     return next((key for key in masterkeys if key.guid.lower() == masterkey), None)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+from dploot.lib.cache import get_cache_dir
+from dploot.lib.target import Target
+
+class DPLootJournal:
+    ''' Work completed against a host, so that an interrupted run can be resumed with -resume
+
+    Units of work are (action, user, file) tuples, for files that were read and triaged. Triage
+    classes skip the units completed by a previous run and mark the units they complete. These are
+    only written when the action commits them, once it has output their findings: an interrupted run
+    never loses findings, it reads again what it had not output. With -journal-masterkeys, decrypted
+    masterkeys are written as soon as they are found, and reused instead of reading and decrypting
+    their files again. Without it, the journal holds no key material.
+    Directories are listed again: SMB errors while listing are not told apart from missing folders.
+
+    The journal of a host is a JSON lines file of the cache directory, only appended to. A run
+    without -resume starts a new one.
+    '''
+
+    def __init__(self, host: str, resume: bool = False, persist: bool = True, persist_masterkeys: bool = False) -> None:
+        self.path = os.path.join(get_cache_dir(), 'journal', '%s.jsonl' % re.sub(r'[^\w.-]', '_', host))
+        self.resume = resume
+        self.persist = persist
+        self.persist_masterkeys = persist_masterkeys
+
+        self.units = set()
+        # guid -> (sha1, user)
+        self.masterkeys: Dict[str, Tuple[str, str]] = dict()
+        self._pending: Dict[str, List[Tuple[str, str, str]]] = dict()
+        self._file = None
+        self._lock = threading.Lock()
+        if self.resume:
+            self._read()
+
+    def _read(self) -> None:
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # last line of an interrupted run
+                        continue
+                    if 'unit' in record:
+                        self.units.add(tuple(record['unit']))
+                    elif 'masterkey' in record:
+                        guid, sha1, user = record['masterkey']
+                        self.masterkeys[guid.lower()] = (sha1, user)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"Could not read journal {self.path}: {e}")
+        logging.info("Resuming from %s: %d units of work done, %d masterkeys" % (self.path, len(self.units), len(self.masterkeys)))
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        if not self.persist or len(records) == 0:
+            return
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), 0o700, exist_ok=True)
+                # it holds masterkeys
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | (os.O_APPEND if self.resume else os.O_TRUNC), 0o600)
+                self._file = os.fdopen(fd, 'w')
+            self._file.write(''.join(json.dumps(record) + '\n' for record in records))
+            self._file.flush()
+        except Exception as e:
+            logging.debug(f"Could not write journal {self.path}: {e}")
+
+    @staticmethod
+    def _unit(action: str, user: str, file: str) -> Tuple[str, str, str]:
+        return (action, user.lower(), file.lower())
+
+    def is_done(self, action: str, user: str, file: str) -> bool:
+        ''' Returns True if a previous run completed the unit '''
+        return self._unit(action, user, file) in self.units
+
+    def done(self, action: str, user: str, file: str) -> None:
+        ''' Marks the unit completed, it is written by the next commit() of action '''
+        with self._lock:
+            self._pending.setdefault(action, list()).append(self._unit(action, user, file))
+
+    def commit(self, *actions: str, output: Any = None) -> None:
+        ''' Writes the units of actions completed since their last commit, after flushing output '''
+        if output is not None:
+            output.flush()
+        with self._lock:
+            units = [unit for action in actions for unit in self._pending.pop(action, list())]
+            self.units.update(units)
+            self._write([dict(unit=list(unit)) for unit in units])
+
+    def get_masterkey(self, guid: str) -> "Tuple[str, str] | None":
+        ''' Returns (sha1, user) of a masterkey decrypted by a previous run '''
+        return self.masterkeys.get(guid.lower())
+
+    def add_masterkey(self, guid: str, sha1: str, user: str) -> None:
+        with self._lock:
+            self.masterkeys[guid.lower()] = (sha1, user)
+            if self.persist_masterkeys:
+                self._write([dict(masterkey=[guid, sha1, user])])
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_journals: Dict[Tuple[str, bool, bool, bool], DPLootJournal] = dict()
+_journals_lock = threading.Lock()
+
+def get_journal(target: Target) -> DPLootJournal:
+    ''' Returns the journal of target, shared by every triage of this process '''
+    host = target.address.lower()
+    if target.is_local:
+        host = 'LOCAL_' + hashlib.sha1(os.path.abspath(target.local_root or '.').encode()).hexdigest()[:16]
+    persist_masterkeys = getattr(target, 'journal_masterkeys', False)
+    key = (host, target.resume, target.use_cache, persist_masterkeys)
+    with _journals_lock:
+        if key not in _journals:
+            _journals[key] = DPLootJournal(host, resume=target.resume, persist=target.use_cache, persist_masterkeys=persist_masterkeys)
+        return _journals[key]
+
+def close_journals() -> None:
+    with _journals_lock:
+        journals = list(_journals.values())
+        _journals.clear()
+    for journal in journals:
+        journal.close()
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+from dploot.lib.stats import stats
+
+class DPLootMasterkeyDatabase:
+    ''' Masterkeys decrypted on any host, shared by the runs of a domain sweep with -masterkeys-db
+
+    Masterkey GUIDs are unique: a roaming profile or credential roaming puts the same masterkey files
+    on many hosts, and once one of them is decrypted, the others need not be read nor decrypted again.
+    The database is a JSON lines file, only appended to, that several dploot processes can share. When
+    a GUID is not known, what other processes appended since the last read is read first, so that the
+    masterkeys they decrypt are used as soon as they are written.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        # guid -> (sha1, user)
+        self.masterkeys: Dict[str, Tuple[str, str]] = dict()
+        self._offset = 0
+        self._file = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def _refresh(self) -> None:
+        ''' Reads the masterkeys appended since the last read, by this process or others '''
+        try:
+            if os.path.getsize(self.path) <= self._offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.debug(f"Could not read masterkeys database {self.path}: {e}")
+            return
+        # the last line may still be written by another process
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                guid, sha1, user = json.loads(line)['masterkey']
+            except (ValueError, KeyError, TypeError):
+                continue
+            self.masterkeys[guid.lower()] = (sha1, user)
+        self._offset += end
+
+    def get_masterkey(self, guid: str) -> "Tuple[str, str] | None":
+        ''' Returns (sha1, user) of a masterkey decrypted on any host sharing the database '''
+        guid = guid.lower()
+        with self._lock:
+            if guid not in self.masterkeys:
+                self._refresh()
+            known = self.masterkeys.get(guid)
+        if known is not None:
+            stats.incr('masterkeys_db.hits')
+        return known
+
+    def add_masterkey(self, guid: str, sha1: str, user: str, host: str = None) -> None:
+        with self._lock:
+            if guid.lower() in self.masterkeys:
+                return
+            self.masterkeys[guid.lower()] = (sha1, user)
+            try:
+                if self._file is None:
+                    directory = os.path.dirname(os.path.abspath(self.path))
+                    os.makedirs(directory, 0o700, exist_ok=True)
+                    # it holds masterkeys
+                    fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+                    self._file = os.fdopen(fd, 'w')
+                # one write per line, so that lines of concurrent processes do not interleave
+                self._file.write(json.dumps(dict(masterkey=[guid, sha1, user], host=host)) + '\n')
+                self._file.flush()
+            except Exception as e:
+                logging.debug(f"Could not write masterkeys database {self.path}: {e}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_databases: Dict[str, DPLootMasterkeyDatabase] = dict()
+_databases_lock = threading.Lock()
+
+def get_masterkey_database(path: str) -> DPLootMasterkeyDatabase:
+    ''' Returns the masterkeys database at path, shared by every triage of this process, whatever their target '''
+    path = os.path.abspath(path)
+    with _databases_lock:
+        if path not in _databases:
+            _databases[path] = DPLootMasterkeyDatabase(path)
+        return _databases[path]
+
+def close_masterkey_databases() -> None:
+    with _databases_lock:
+        databases = list(_databases.values())
+        _databases.clear()
+    for database in databases:
+        database.close()
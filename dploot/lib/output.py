@@ -0,0 +1,280 @@
+import dataclasses
+import datetime
+import json
+import logging
+import sys
+import threading
+from typing import Any, Dict, List, TextIO
+
+class _Skip:
+    ''' Marks values that have no meaningful serialization (impacket structures, ...) '''
+
+def serialize_value(value: Any, owner: Any = None) -> Any:
+    ''' Converts a value found on a triage object to something JSON serializable
+
+    Bytes are decoded as UTF-8 when possible and hex encoded otherwise, unless the object they come
+    from knows how to decode them (SCCM.member_to_string). Certificates and private keys are PEM
+    encoded, and XML documents are serialized.
+    '''
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        if hasattr(owner, 'member_to_string'):
+            return owner.member_to_string(bytes(value))
+        try:
+            return bytes(value).decode('utf-8')
+        except UnicodeDecodeError:
+            return bytes(value).hex()
+    if isinstance(value, (list, tuple, set)):
+        return [item for item in (serialize_value(item, owner) for item in value) if item is not _Skip]
+    if isinstance(value, dict):
+        return {str(key): item for key, item in ((key, serialize_value(item, owner)) for key, item in value.items()) if item is not _Skip}
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if hasattr(value, 'public_bytes') or hasattr(value, 'private_bytes'):
+        # cryptography objects, imported here as it is slow to load
+        from cryptography import x509
+        from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat
+        if isinstance(value, x509.Certificate):
+            return value.public_bytes(Encoding.PEM).decode('utf-8')
+        if hasattr(value, 'private_bytes'):
+            return value.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()).decode('utf-8')
+    if hasattr(value, 'getroottree'):
+        # lxml elements: only serialize documents, sub-elements are part of them
+        if value.getparent() is not None:
+            return _Skip
+        from lxml import etree
+        return etree.tostring(value).decode('utf-8')
+    if type(value).__module__.startswith('dploot.'):
+        return serialize(value)
+    return _Skip
+
+def slot_names(cls: type) -> List[str]:
+    ''' Returns the __slots__ of cls and of its bases, bases first '''
+    names = list()
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        names.extend([slots] if isinstance(slots, str) else slots)
+    return names
+
+def serialize(finding: Any) -> Dict[str, Any]:
+    ''' Returns the fields of a triage object (dataclass, plain or slotted class) as a JSON serializable dict '''
+    if dataclasses.is_dataclass(finding):
+        fields = {field.name: getattr(finding, field.name) for field in dataclasses.fields(finding)}
+    elif hasattr(finding, '__dict__'):
+        fields = {name: value for name, value in vars(finding).items() if not name.startswith('_')}
+    else:
+        fields = dict()
+        for name in slot_names(type(finding)):
+            # private slots back public properties (Masterkey.guid)
+            name = name.lstrip('_')
+            if hasattr(finding, name):
+                fields[name] = getattr(finding, name)
+    record = dict()
+    for name, value in fields.items():
+        value = serialize_value(value, finding)
+        if value is not _Skip:
+            record[name] = value
+    return record
+
+class DPLootOutput:
+    ''' Where actions send what they found: text output through the objects' dump() and dump_quiet()
+
+    Triage classes call dump() through their per_finding_callback as soon as each finding is decrypted,
+    possibly from the threads of a connection pool: the dump of a finding is never interleaved with another.
+    '''
+
+    def __init__(self, quiet: bool = False) -> None:
+        self.quiet = quiet
+        self._lock = threading.Lock()
+
+    def dump(self, finding: Any, always: bool = False) -> None:
+        # always: print the full dump even with -quiet, for what the action is meant to output
+        with self._lock:
+            if not self.quiet or always:
+                finding.dump()
+            elif hasattr(finding, 'dump_quiet'):
+                finding.dump_quiet()
+
+    def newline(self) -> None:
+        if not self.quiet:
+            print()
+
+    def flush(self) -> None:
+        ''' Makes sure what was dumped so far is written '''
+        sys.stdout.flush()
+
+class DPLootJSONLOutput(DPLootOutput):
+    ''' Writes one JSON record per finding, flushed as soon as the triage class decrypted it
+
+    {"target": "192.168.56.14", "action": "browser", "type": "LoginData", "data": {"winuser": ...}}
+    '''
+
+    def __init__(self, target: str = None, action: str = None, stream: TextIO = None) -> None:
+        super().__init__(quiet=True)
+        self.target = target
+        self.action = action
+        self.stream = stream if stream is not None else sys.stdout
+
+    def dump(self, finding: Any, always: bool = False) -> None:
+        record = dict(target=self.target, action=self.action, type=type(finding).__name__, data=serialize(finding))
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+    def newline(self) -> None:
+        pass
+
+class DPLootSQLiteExport:
+    ''' Stores findings in a SQLite database, one table per type
+
+    Tables are named after the class of the findings, with a column per field plus target and action.
+    Columns are added when a finding brings a field not seen before. Rows are buffered and inserted
+    with executemany() in one transaction per batch, and every table is indexed on target, winuser and
+    the fields commonly searched (see indexes).
+    '''
+
+    context_columns = ['target', 'action']
+    indexes = {
+        'Cookie': ['host', 'cookie_name'],
+        'LoginData': ['url', 'username'],
+        'Credential': ['username'],
+        'Certificate': ['username'],
+        'VaultCred': ['username'],
+        'WifiCred': ['ssid'],
+        'Masterkey': ['guid'],
+    }
+
+    def __init__(self, path: str, batch_size: int = 1000) -> None:
+        self.path = path
+        self.batch_size = batch_size
+
+        import sqlite3
+        self.sqlite3 = sqlite3
+        # several dploot processes may write to the same database
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self._columns = dict()
+        self._pending = dict()
+        self._pending_count = 0
+        self._lock = threading.Lock()
+
+    def _table_columns(self, table: str) -> List[str]:
+        if table not in self._columns:
+            self._columns[table] = [row[1] for row in self.db.execute('PRAGMA table_info("%s")' % table)]
+        return self._columns[table]
+
+    def _ensure_columns(self, table: str, columns: List[str]) -> None:
+        ''' Creates the table or adds the missing columns, within the write transaction of _flush() '''
+        existing = self._table_columns(table)
+        if len(existing) == 0:
+            self.db.execute('CREATE TABLE IF NOT EXISTS "%s" (%s)' % (table, ', '.join('"%s"' % column for column in columns)))
+            for column in ['target', 'winuser'] + self.indexes.get(table, []):
+                if column in columns:
+                    self.db.execute('CREATE INDEX IF NOT EXISTS "%s_%s" ON "%s" ("%s")' % (table, column, table, column))
+            # another process may have created the table first, with other columns
+            self._columns.pop(table, None)
+            existing = self._table_columns(table)
+        for column in columns:
+            if column not in existing:
+                try:
+                    self.db.execute('ALTER TABLE "%s" ADD COLUMN "%s"' % (table, column))
+                except self.sqlite3.OperationalError as e:
+                    if 'duplicate column name' not in str(e):
+                        raise
+        self._columns.pop(table, None)
+
+    def add(self, target: str, action: str, finding: Any) -> None:
+        row = dict(target=target, action=action)
+        for name, value in serialize(finding).items():
+            if name in self.context_columns:
+                name = type(finding).__name__.lower() + '_' + name
+            row[name] = json.dumps(value) if isinstance(value, (list, dict)) else value
+        with self._lock:
+            self._pending.setdefault(type(finding).__name__, list()).append(row)
+            self._pending_count += 1
+            if self._pending_count >= self.batch_size:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._pending_count == 0:
+            return
+        try:
+            with self.db:
+                # sqlite3 does not open a transaction for PRAGMA and DDL: take the write lock before
+                # reading the schema, so that other processes cannot change it until the rows are in
+                self.db.execute('BEGIN IMMEDIATE')
+                for table, rows in self._pending.items():
+                    columns = list(dict.fromkeys(name for row in rows for name in row))
+                    self._ensure_columns(table, columns)
+                    self.db.executemany(
+                        'INSERT INTO "%s" (%s) VALUES (%s)' % (table, ', '.join('"%s"' % column for column in columns), ', '.join('?' * len(columns))),
+                        [tuple(row.get(column) for column in columns) for row in rows],
+                    )
+        except self.sqlite3.Error as e:
+            # findings are flushed from the triage threads: do not fail them, nor every later add()
+            if logging.getLogger().level == logging.DEBUG:
+                import traceback
+                traceback.print_exc()
+            logging.error("Could not store %d findings in %s: %s" % (self._pending_count, self.path, e))
+        finally:
+            self._columns.clear()
+            self._pending = dict()
+            self._pending_count = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
+
+class DPLootSQLiteOutput(DPLootOutput):
+    ''' Stores findings with a DPLootSQLiteExport, and passes them on to another output '''
+
+    def __init__(self, export: DPLootSQLiteExport, output: DPLootOutput, target: str = None, action: str = None) -> None:
+        super().__init__(quiet=output.quiet)
+        self.export = export
+        self.output = output
+        self.target = target
+        self.action = action
+
+    def dump(self, finding: Any, always: bool = False) -> None:
+        self.output.dump(finding, always=always)
+        self.export.add(self.target, self.action, finding)
+
+    def newline(self) -> None:
+        self.output.newline()
+
+    def flush(self) -> None:
+        self.output.flush()
+        self.export.flush()
+
+_exports: Dict[str, DPLootSQLiteExport] = dict()
+
+def get_sqlite_export(path: str) -> DPLootSQLiteExport:
+    ''' Returns the export to path, shared by every action of this process '''
+    if path not in _exports:
+        _exports[path] = DPLootSQLiteExport(path)
+    return _exports[path]
+
+def close_outputs() -> None:
+    ''' Writes what is still buffered by the exports of this process '''
+    while len(_exports) > 0:
+        _, export = _exports.popitem()
+        try:
+            export.close()
+        except Exception as e:
+            logging.error("Could not write findings to %s: %s" % (export.path, e))
+
+def get_output(options: Any) -> DPLootOutput:
+    output_format = getattr(options, 'format', 'text')
+    if output_format == 'jsonl':
+        output = DPLootJSONLOutput(target=options.target, action=options.action)
+    else:
+        output = DPLootOutput(quiet=options.quiet)
+    if getattr(options, 'export_db', None) is not None:
+        output = DPLootSQLiteOutput(get_sqlite_export(options.export_db), output, target=options.target, action=options.action)
+    return output
@@ -0,0 +1,72 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from dploot.lib.stats import stats
+
+class DPLootTracer:
+    ''' Records spans and writes them in the Chrome trace event format
+
+    The file can be opened in chrome://tracing or https://ui.perfetto.dev. Spans are the timers of
+    dploot.lib.stats (connections, triage classes, file reads, decryption, ...), one row per thread.
+    '''
+
+    def __init__(self) -> None:
+        self.events = list()
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, duration: float, args: Dict[str, Any] = None) -> None:
+        event = dict(
+            name=name,
+            cat=name.split('.', 1)[0],
+            ph='X',
+            ts=(start - self.origin) * 1e6,
+            dur=duration * 1e6,
+            pid=os.getpid(),
+            tid=threading.get_ident(),
+        )
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+
+    def dump(self, filename: str) -> None:
+        with self._lock:
+            events = list(self.events)
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for tid in dict.fromkeys(event['tid'] for event in events):
+            events.append(dict(name='thread_name', ph='M', pid=os.getpid(), tid=tid, args=dict(name=thread_names.get(tid, str(tid)))))
+        with open(filename, 'w') as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+
+class DPLootProfiler:
+    ''' Profiles a run, with cProfile or with a DPLootTracer when filename ends with .json
+
+    cProfile output is a pstats file (python -m pstats file, snakeviz, ...). It only covers the thread
+    calling start(), use a .json trace to see what -smb-sessions workers are doing.
+    '''
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.tracer = None
+        self.profile = None
+
+    def start(self) -> None:
+        if self.filename.lower().endswith('.json'):
+            self.tracer = DPLootTracer()
+            stats.tracer = self.tracer
+        else:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self) -> None:
+        if self.tracer is not None:
+            stats.tracer = None
+            self.tracer.dump(self.filename)
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.filename)
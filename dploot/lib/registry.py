@@ -0,0 +1,173 @@
+import logging
+import ntpath
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Tuple
+
+from impacket.dcerpc.v5 import rrp
+from impacket.system_errors import ERROR_FILE_NOT_FOUND, ERROR_NO_MORE_ITEMS
+
+from dploot.lib.stats import stats
+
+if TYPE_CHECKING:
+    from impacket.examples.secretsdump import RemoteOperations
+
+class DPLootRemoteRegistry:
+    ''' Remote registry access on top of RemoteOperations' winreg pipe
+
+    Open key handles are cached for the lifetime of the object, subkeys and values are
+    enumerated with buffers sized from BaseRegQueryInfoKey so every item costs exactly one
+    round trip, and value buffers learn the largest size seen per value name.
+    '''
+
+    root_keys = {
+        'HKLM': rrp.hOpenLocalMachine,
+        'HKU': rrp.hOpenUsers,
+    }
+    samDesired = rrp.MAXIMUM_ALLOWED | rrp.KEY_ENUMERATE_SUB_KEYS | rrp.KEY_QUERY_VALUE
+    default_value_size = 512
+
+    def __init__(self, remote_ops: "RemoteOperations" = None, dce: Any = None) -> None:
+        ''' Either on the winreg pipe of remote_ops, or on dce, a winreg pipe bound by the caller '''
+        self.remote_ops = remote_ops
+        self._dce = dce
+
+        self._roots = dict()
+        self._handles = dict()
+        self._value_sizes = dict()
+        self.round_trips = 0
+
+    def _round_trip(self) -> None:
+        self.round_trips += 1
+        stats.incr('registry.round_trips')
+
+    @property
+    def dce(self) -> Any:
+        if self._dce is not None:
+            return self._dce
+        return self.remote_ops._RemoteOperations__rrp
+
+    def _root(self, root: str) -> Any:
+        root = root.upper()
+        if root not in self._roots:
+            self._round_trip()
+            self._roots[root] = self.root_keys[root](self.dce)['phKey']
+        return self._roots[root]
+
+    def open_key(self, root: str, path: str) -> "Any | None":
+        ''' Returns a (cached) handle on root\\path, or None if the key does not exist '''
+        path = ntpath.normpath(path) if path else ''
+        cache_key = (root.upper(), path.lower())
+        if cache_key in self._handles:
+            stats.incr('cache.registry_handles.hits')
+            return self._handles[cache_key]
+        try:
+            self._round_trip()
+            handle = rrp.hBaseRegOpenKey(self.dce, self._root(root), path, samDesired=self.samDesired)['phkResult']
+        except rrp.DCERPCSessionError as e:
+            if e.get_error_code() != ERROR_FILE_NOT_FOUND:
+                logging.debug(f"Error while hBaseRegOpenKey {root}\\{path}: {e}")
+            handle = None
+        self._handles[cache_key] = handle
+        return handle
+
+    def query_info(self, root: str, path: str) -> "Any | None":
+        handle = self.open_key(root, path)
+        if handle is None:
+            return None
+        self._round_trip()
+        return rrp.hBaseRegQueryInfoKey(self.dce, handle)
+
+    def enum_keys(self, root: str, path: str) -> List[str]:
+        ''' Returns the names of all the subkeys of root\\path '''
+        info = self.query_info(root, path)
+        if info is None:
+            return []
+        handle = self.open_key(root, path)
+        subkeys = list()
+        for i in range(info['lpcSubKeys']):
+            try:
+                self._round_trip()
+                ans = rrp.hBaseRegEnumKey(self.dce, handle, i)
+            except rrp.DCERPCSessionError as e:
+                # the key may have changed since we queried it
+                if e.get_error_code() == ERROR_NO_MORE_ITEMS:
+                    break
+                raise
+            subkeys.append(ans['lpNameOut'].rstrip('\0'))
+        return subkeys
+
+    def enum_values(self, root: str, path: str) -> Dict[str, Tuple[int, bytes]]:
+        ''' Returns all the values of root\\path
+
+        :return: dict of value_name: (value_type, raw_value_bytes)
+        '''
+        info = self.query_info(root, path)
+        if info is None:
+            return dict()
+        handle = self.open_key(root, path)
+        # lpcbMaxValueNameLen is in characters, without the terminating null
+        data_len = max(info['lpcbMaxValueLen'], info['lpcbMaxValueNameLen'] + 1, 1)
+        values = dict()
+        for i in range(info['lpcValues']):
+            try:
+                self._round_trip()
+                ans = rrp.hBaseRegEnumValue(self.dce, handle, i, dataLen=data_len)
+            except rrp.DCERPCSessionError as e:
+                if e.get_error_code() == ERROR_NO_MORE_ITEMS:
+                    break
+                raise
+            values[ans['lpValueNameOut'].rstrip('\0')] = (ans['lpType'], b''.join(ans['lpData']))
+        return values
+
+    def query_value(self, root: str, path: str, name: str) -> "Tuple[int, Any] | None":
+        ''' Same return value as rrp.hBaseRegQueryValue, or None if the key or value does not exist '''
+        handle = self.open_key(root, path)
+        if handle is None:
+            return None
+        data_len = self._value_sizes.get(name.lower(), self.default_value_size)
+        try:
+            self._round_trip()
+            value_type, value = rrp.hBaseRegQueryValue(self.dce, handle, name, dataLen=data_len)
+        except rrp.DCERPCSessionError as e:
+            if e.get_error_code() == ERROR_FILE_NOT_FOUND:
+                return None
+            raise
+        # remember how big this value was, so the next key does not need an ERROR_MORE_DATA round trip
+        if isinstance(value, bytes):
+            value_len = len(value)
+        elif isinstance(value, str):
+            # UTF-16, and the null terminator the server sends
+            value_len = 2 * (len(value) + 1)
+        else:
+            value_len = 8
+        if value_len > data_len:
+            self._round_trip()
+            self._value_sizes[name.lower()] = value_len
+        return value_type, value
+
+    def walk(self, root: str, path: str) -> Iterator[Tuple[str, List[str], Dict[str, Tuple[int, bytes]]]]:
+        ''' Walks the registry tree under root\\path, top-down, like os.walk()
+
+        :return: iterator of (key_path, subkey_names, values)
+        '''
+        subkeys = self.enum_keys(root, path)
+        yield path, subkeys, self.enum_values(root, path)
+        for subkey in subkeys:
+            yield from self.walk(root, ntpath.join(path, subkey))
+
+    def close_key(self, root: str, path: str) -> None:
+        path = ntpath.normpath(path) if path else ''
+        handle = self._handles.pop((root.upper(), path.lower()), None)
+        if handle is not None:
+            self._round_trip()
+            rrp.hBaseRegCloseKey(self.dce, handle)
+
+    def close(self) -> None:
+        for handle in list(self._handles.values()) + list(self._roots.values()):
+            if handle is None:
+                continue
+            try:
+                rrp.hBaseRegCloseKey(self.dce, handle)
+            except Exception as e:
+                logging.debug(f"Error while closing registry handle: {e}")
+        self._handles = dict()
+        self._roots = dict()
@@ -2,9 +2,18 @@ import socket
 import ntpath
 import os
 import logging
+import queue
+import threading
 import time
-from typing import Any, Dict, List
+from binascii import unhexlify
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Set
 
+from dploot.lib.cache import DPLootHostnameCache, DPLootIncrementalCache, get_dialect_cache, get_hostname_cache, get_incremental_cache
+from dploot.lib.registry import DPLootRemoteRegistry
+from dploot.lib.stats import instrument, stats
 from dploot.lib.target import Target
 
 from impacket.smbconnection import SMBConnection
@@ -13,18 +22,32 @@ from impacket.smb import ATTR_DIRECTORY
 from impacket.smb import SMB_DIALECT
 from impacket.smb import SharedFile
 from impacket.nmb import NetBIOSTimeout
-from impacket.examples.secretsdump import RemoteOperations,LocalOperations
 from impacket.smb3structs import FILE_READ_DATA, FILE_OPEN, FILE_NON_DIRECTORY_FILE, FILE_SHARE_READ
 
-from dploot.lib.wmi import DPLootWmiExec
+if TYPE_CHECKING:
+    from dploot.lib.wmi import DPLootWmiConnection
+
+@dataclass
+class DPLootUserProfile:
+    username: str
+    # None when the profile does not come from ProfileList
+    sid: "str | None"
+    # relative to C$
+    path: str
 
 class DPLootSMBConnection:
+    systemroot = 'C:\\Windows'
+    profile_list_key = 'Microsoft\\Windows NT\\CurrentVersion\\ProfileList'
+    false_positive_users = ['.','..', 'desktop.ini','Public','Default','Default User','All Users']
+
     # if called with target = LOCAL, return an instance of DPLootLocalSMConnection,
     # else return an instance of DPLootRemoteSMBConnection
     def __new__(cls, target=None) -> "DPLootRemoteSMBConnection | DPLootLocalSMBConnection":
         # logging.debug(f"Creating instance of DPLootSMBConnection. {cls=}, {cls.__name__=}, {target=} ")
         if target is not None and target.address.upper() == "LOCAL" and cls.__name__ != DPLootLocalSMBConnection.__name__:
             return DPLootLocalSMBConnection.__new__(DPLootLocalSMBConnection, target)
+        elif cls.__name__ == DPLootSMBConnection.__name__ and target is not None and target.smb_sessions > 1:
+            return DPLootSMBConnectionPool.__new__(DPLootSMBConnectionPool, target)
         elif cls.__name__ == DPLootSMBConnection.__name__:
             return DPLootRemoteSMBConnection.__new__(DPLootRemoteSMBConnection, target)
         else:
@@ -37,6 +60,51 @@ class DPLootSMBConnection:
         self.local_session  = None
 
         self._usersProfiles = None
+        self._user_profiles = None
+        self._user_profiles_lock = threading.Lock()
+
+    def list_user_profiles(self) -> List[DPLootUserProfile]:
+        ''' Returns the user profiles on C: of ProfileList (see getUsersProfiles), read once per connection
+
+        Folders of C:\\Users without a profile are skipped, and profiles outside of C:\\Users are
+        included. Falls back to the folders of C:\\Users when ProfileList can not be read.
+        '''
+        with self._user_profiles_lock:
+            if self._user_profiles is None:
+                self._user_profiles = self._read_user_profiles()
+            return list(self._user_profiles.values())
+
+    def _read_user_profiles(self) -> Dict[str, DPLootUserProfile]:
+        profiles = dict()
+        try:
+            users_profiles = self.getUsersProfiles()
+        except Exception as e:
+            logging.debug(f"Could not read user profiles: {e}")
+            users_profiles = None
+        if users_profiles:
+            for sid, path in users_profiles.items():
+                path = ntpath.normpath(path)
+                # LocalSystem, LocalService and NetworkService profiles live in the system root
+                if path[:3].upper() != 'C:\\' or path.lower().startswith(self.systemroot.lower() + '\\'):
+                    continue
+                username = ntpath.basename(path)
+                if username in self.false_positive_users:
+                    continue
+                profiles.setdefault(username.lower(), DPLootUserProfile(username=username, sid=sid, path=path[3:]))
+            if len(profiles) > 0:
+                return profiles
+
+        for d in self.listPath(shareName='C$', path=ntpath.normpath('Users\\*')) or []:
+            if d.get_longname() not in self.false_positive_users and d.is_directory() > 0:
+                username = d.get_longname()
+                profiles[username.lower()] = DPLootUserProfile(username=username, sid=None, path=ntpath.join('Users', username))
+        return profiles
+
+    def user_profile_path(self, username: str) -> str:
+        ''' Returns the path of the profile of username, relative to C$ '''
+        self.list_user_profiles()
+        profile = self._user_profiles.get(username.lower())
+        return profile.path if profile is not None else ntpath.join('Users', username)
 
     def listDirs(self, share: str, dirlist: List[str]) -> Dict[str, Any]:
         result = dict()
@@ -46,18 +114,63 @@ class DPLootSMBConnection:
         # logging.debug(f"listDirs called with {dirlist}, returning {result.items()}")
         return result
 
+    def acquire_locked_files(self, shareName: str, paths: Iterable[str], timeout: float = None) -> int:
+        ''' Prepares readable copies of the files of paths locked by another process, see DPLootRemoteSMBConnection '''
+        return 0
+
+    def release_locked_files(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def map(self, func: Callable, iterable: Iterable) -> List[Any]:
+        ''' Calls func on every item, concurrently if the connection has several sessions.
+
+        Like the per-user loops of the triage classes, an item whose call raises is
+        logged and skipped. Results are returned in the order of iterable.
+        '''
+        results = list()
+        for item in iterable:
+            result = self._call_logging_errors(func, item)
+            if result is not None:
+                results.append(result)
+        return results
+
+    @staticmethod
+    def _call_logging_errors(func: Callable, item: Any) -> Any:
+        try:
+            return func(item)
+        except Exception as e:
+            if logging.getLogger().level == logging.DEBUG:
+                import traceback
+                traceback.print_exc()
+                logging.debug(str(e))
+        return None
+
 class DPLootRemoteSMBConnection(DPLootSMBConnection):
+    # how long to wait for the remote copies of locked files, in seconds
+    locked_files_timeout = 120
+    # cmd.exe refuses command lines longer than 8191 characters
+    max_command_length = 8000
+
     def __init__(self, target: Target) -> None:
         super().__init__(target)
 
         self.smb_session = None
         self.smbv1 = False
+        self.bootkey = None
+        self._remote_registry = None
+        self._locked_copies = dict()
+        # (shareName, prefix) of the copies whose files may still be written after _copy_locked_files() returned
+        self._locked_leftovers = list()
+        self._wmi = None
         
         # logging.debug(f"DPLootSMBConnection.__init__ returning from {self}")
 
     def create_smbv1_conn(self, kdc=''):
         try:
-            self.smb_session = SMBConnection(self.target.address if not kdc else kdc, self.target.address if not kdc else kdc, None, preferredDialect=SMB_DIALECT)
+            self.smb_session = SMBConnection(self.target.address if not kdc else kdc, self.target.address if not kdc else kdc, None, sess_port=self.target.port, preferredDialect=SMB_DIALECT)
             self.smbv1 = True
         except socket.error as e:
             if str(e).find('Connection reset by peer') != -1:
@@ -71,7 +184,7 @@ class DPLootRemoteSMBConnection(DPLootSMBConnection):
 
     def create_smbv3_conn(self, kdc=''):
         try:
-            self.smb_session = SMBConnection(self.target.address if not kdc else kdc, self.target.address if not kdc else kdc, None)
+            self.smb_session = SMBConnection(self.target.address if not kdc else kdc, self.target.address if not kdc else kdc, None, sess_port=self.target.port)
             self.smbv1 = False
         except socket.error as e:
             if str(e).find('Too many open files') != -1:
@@ -84,44 +197,104 @@ class DPLootRemoteSMBConnection(DPLootSMBConnection):
         return True
 
     def create_conn_obj(self, kdc=''):
-        if self.create_smbv3_conn(kdc):
-            return True
-        elif self.create_smbv1_conn(kdc):
-            return True
+        # start with the dialect this host accepted last time, SMBv3 otherwise
+        remote = self.target.address if not kdc else kdc
+        dialect_cache = get_dialect_cache(self.target.use_cache)
+        attempts = [('SMBv3', self.create_smbv3_conn), ('SMBv1', self.create_smbv1_conn)]
+        known_dialect = dialect_cache.resolve(remote)
+        stats.incr('cache.dialect.hits' if known_dialect is not None else 'cache.dialect.misses')
+        if known_dialect == 'SMBv1':
+            attempts.reverse()
+        for dialect, create_conn in attempts:
+            start = time.perf_counter()
+            success = create_conn(kdc)
+            duration = time.perf_counter() - start
+            dialect_cache.record(remote, dialect if success else None, duration)
+            logging.debug("%s negotiation with %s %s in %.3fs" % (dialect, remote, "succeeded" if success else "failed", duration))
+            if success:
+                self._count_round_trips()
+                return True
         logging.debug("Could not create connection object to %s" % (self.target.address if not kdc else kdc))
         return False
 
+    def probe_hostname(self, hostname_cache: DPLootHostnameCache) -> "str | None":
+        ''' Gets the DNS hostname of the target address through an anonymous connection, and remembers it '''
+        stats.incr('cache.hostname.misses')
+        no_ntlm = False
+        if not self.create_conn_obj():
+            return None
+        try:
+            self.smb_session.login('' , '')
+        except Exception as e:
+            if "STATUS_NOT_SUPPORTED" in str(e):
+                no_ntlm = True
+            pass
+        hostname = self.smb_session.getServerDNSHostName() if not no_ntlm else self.target.address
+        self.smb_session.close()
+        if not no_ntlm:
+            hostname_cache.remember(self.target.address, hostname)
+        return hostname
+
+    def kerberos_login(self, hostname: str) -> bool:
+        ''' Connects to hostname and authenticates through Kerberos, raises if the login fails '''
+        self.target.address = hostname
+        logging.debug("Connecting to %s" % self.target.address)
+        if not self.create_conn_obj(self.target.address):
+            return False
+        logging.debug("Authenticating with %s through Kerberos" % self.target.username)
+        try:
+            self.smb_session.kerberosLogin(
+                user=self.target.username,
+                password=self.target.password,
+                domain=self.target.domain,
+                lmhash=self.target.lmhash,
+                nthash=self.target.nthash,
+                aesKey=self.target.aesKey,
+                kdcHost=self.target.kdcHost,
+                useCache=self.target.use_kcache,
+                )
+        except Exception:
+            self.smb_session.close()
+            raise
+        self.target.username = self.smb_session.getCredentials()[0]
+        return True
+
+    @instrument('smb.connect')
     def connect(self) -> "Any | None":
         try:
             if self.target.do_kerberos:
-                # getting hostname
-                no_ntlm = False
-                if not self.create_conn_obj():
-                    return None
-                try:
-                    self.smb_session.login('' , '')
-                except Exception as e:
-                    if "STATUS_NOT_SUPPORTED" in str(e):
-                        no_ntlm = True
-                    pass
-                hostname = self.smb_session.getServerDNSHostName() if not no_ntlm else self.target.address
-                self.smb_session.close()
-                self.target.address = hostname
-                logging.debug("Connecting to %s" % self.target.address)
-                if not self.create_conn_obj(self.target.address):
+                # getting hostname, from previous sessions or through an anonymous probe connection
+                hostname_cache = get_hostname_cache(self.target.hosts_file, self.target.use_cache)
+                address = self.target.address
+                hostname = hostname_cache.resolve(address)
+                if hostname is not None:
+                    logging.debug("Hostname of %s is %s (cached)" % (address, hostname))
+                    stats.incr('cache.hostname.hits')
+                    try:
+                        if self.kerberos_login(hostname):
+                            return self.smb_session
+                        error = None
+                    except Exception as e:
+                        error = e
+                    # the address may have been reassigned, or the host renamed
+                    logging.debug("Cached hostname %s of %s is stale (%s), probing it again" % (hostname, address, error))
+                    hostname_cache.forget(address)
+                    self.target.address = address
+                    stale_hostname = hostname
+                    hostname = self.probe_hostname(hostname_cache)
+                    if hostname is None:
+                        return None
+                    if hostname.lower() == stale_hostname.lower():
+                        # same name, retrying would only fail the same way, and count one more failed logon
+                        if error is not None:
+                            raise error
+                        return None
+                else:
+                    hostname = self.probe_hostname(hostname_cache)
+                    if hostname is None:
+                        return None
+                if not self.kerberos_login(hostname):
                     return None
-                logging.debug("Authenticating with %s through Kerberos" % self.target.username)
-                self.smb_session.kerberosLogin(
-                    user=self.target.username,
-                    password=self.target.password,
-                    domain=self.target.domain,
-                    lmhash=self.target.lmhash,
-                    nthash=self.target.nthash,
-                    aesKey=self.target.aesKey,
-                    kdcHost=self.target.kdcHost,
-                    useCache=self.target.use_kcache,
-                    )
-                self.target.username = self.smb_session.getCredentials()[0]
             else:
                 logging.debug("Connecting to %s" % self.target.address)
                 if not self.create_conn_obj():
@@ -142,12 +315,15 @@ class DPLootRemoteSMBConnection(DPLootSMBConnection):
             return None
         return self.smb_session
 
+    @instrument('smb.remote_list_dir')
     def remote_list_dir(self, share, path, wildcard=True) -> "Any | None":
         if wildcard:
             path = ntpath.join(path, '*')
         try:
             result = self.smb_session.listPath(shareName=share, path=ntpath.normpath(path))
             # logging.debug(f"remote_list_dir called with {path}, returning {result} ")
+            if self.incremental is not None:
+                self.incremental.record_listing(share, ntpath.dirname(ntpath.normpath(path)), result)
             return result
 
         except Exception:
@@ -162,13 +338,28 @@ class DPLootRemoteSMBConnection(DPLootSMBConnection):
             pass
         return is_admin
 
+    @instrument('smb.listPath')
     def listPath(self,  *args, **kwargs) -> Any:
         result = self.smb_session.listPath(*args, **kwargs)
         # logging.debug(f"listPath called with {args}, {kwarsgs}, returning {result}")
         return result
 
+    def _count_round_trips(self) -> None:
+        ''' Counts every SMB request of the session as a round trip: tree connects, opens, reads, closes, listings, and RPC over named pipes
+
+        A reconnection negotiates a new connection object, it must be counted again.
+        '''
+        connection = self.smb_session.getSMBServer()
+        send = connection.sendSMB
+
+        def sendSMB(*args, **kwargs):
+            stats.incr('smb.round_trips')
+            return send(*args, **kwargs)
+        connection.sendSMB = sendSMB
+
     def reconnect(self) -> bool:
         self.smb_session.reconnect()
+        self._count_round_trips()
         if self.remote_ops is not None:
             self.enable_remoteops(force=True)
 
@@ -177,18 +368,126 @@ class DPLootRemoteSMBConnection(DPLootSMBConnection):
         if self.remote_ops is not None and self.bootkey is not None and not force:
             return
         try:
+            # secretsdump is slow to import, and only needed for registry access
+            from impacket.examples.secretsdump import RemoteOperations
+            self._remote_registry = None
             self.remote_ops  = RemoteOperations(self.smb_session, self.target.do_kerberos, self.target.dc_ip)
             self.remote_ops.enableRegistry()
             self.bootkey = self.remote_ops.getBootKey()
         except Exception as e:
             logging.error('RemoteOperations failed: {}'.format(e))
 
+    @property
+    def remote_registry(self) -> DPLootRemoteRegistry:
+        ''' Registry access on the winreg pipe of RemoteOperations, raises an Exception if it could not be opened '''
+        if self._remote_registry is None:
+            self.enable_remoteops()
+            # enable_remoteops() only logs its failures, and may leave remote_ops without a winreg pipe
+            if getattr(self.remote_ops, '_RemoteOperations__rrp', None) is None:
+                raise Exception('Remote registry of %s is not available' % self.target.address)
+            self._remote_registry = DPLootRemoteRegistry(self.remote_ops)
+        return self._remote_registry
+
+    def getUsersProfiles(self) -> "Dict[str, str] | None":
+        ''' Returns the list of user profiles (from remote registry) in a dict of user_sid: path_to_profile
+
+        See DPLootLocalSMBConnection.getUsersProfiles, None if the remote registry is not reachable.
+        RemoteOperations are not enabled for this: they start the RemoteRegistry service and read the
+        bootkey. Their winreg pipe is used if it is already open, else the winreg pipe is only opened.
+        '''
+        if self._usersProfiles is not None:
+            return self._usersProfiles
+
+        result = dict()
+        key_path = ntpath.join('SOFTWARE', self.profile_list_key)
+        dce = None
+        registry = None
+        try:
+            if self.remote_ops is not None and getattr(self.remote_ops, '_RemoteOperations__rrp', None) is not None:
+                registry = self.remote_registry
+            else:
+                dce = self._connect_winreg()
+                registry = DPLootRemoteRegistry(dce=dce)
+            for user_sid in registry.enum_keys('HKLM', key_path):
+                value = registry.query_value('HKLM', ntpath.join(key_path, user_sid), 'ProfileImagePath')
+                registry.close_key('HKLM', ntpath.join(key_path, user_sid))
+                if value is None:
+                    continue
+                _, path = value
+                path = path.rstrip('\0').replace(r'%systemroot%', self.systemroot)
+                result[user_sid] = ntpath.normpath(path)
+        except Exception as e:
+            logging.debug(f"Could not read {key_path} from remote registry: {e}")
+            return None
+        finally:
+            if dce is not None:
+                if registry is not None:
+                    registry.close()
+                try:
+                    dce.disconnect()
+                except Exception as e:
+                    logging.debug(f"Error while closing winreg pipe: {e}")
+
+        self._usersProfiles = result
+        return self._usersProfiles
+
+    def _connect_winreg(self) -> Any:
+        ''' Binds the winreg pipe, which fails when the RemoteRegistry service is not running '''
+        from impacket.dcerpc.v5 import rrp, transport
+        rpc = transport.DCERPCTransportFactory(r'ncacn_np:445[\pipe\winreg]')
+        rpc.set_smb_connection(self.smb_session)
+        dce = rpc.get_dce_rpc()
+        dce.connect()
+        dce.bind(rrp.MSRPC_UUID_RRP)
+        return dce
+
     def getFile(self,  *args, **kwargs) -> "Any | None":
         result = self.smb_session.getFile(*args, **kwargs)
         # logging.debug(f"getFile called with {args} , {kwargs}")
         return result
 
+    @property
+    def incremental(self) -> "DPLootIncrementalCache | None":
+        if not self.target.incremental:
+            return None
+        return get_incremental_cache(self.target.address)
+
     def readFile(self, shareName, path, mode = FILE_OPEN, offset = 0, password = None, shareAccessMode = FILE_SHARE_READ, bypass_shared_violation = False) -> bytes:
+        incremental = self.incremental
+        if incremental is None or offset != 0:
+            return self._download_file(shareName, path, mode=mode, offset=offset, password=password, shareAccessMode=shareAccessMode, bypass_shared_violation=bypass_shared_violation)
+        if not incremental.is_listed(shareName, path):
+            self._list_file(shareName, path)
+        if incremental.is_missing(shareName, path):
+            return None
+        data = incremental.get(shareName, path)
+        if data is None:
+            data = self._download_file(shareName, path, mode=mode, offset=offset, password=password, shareAccessMode=shareAccessMode, bypass_shared_violation=bypass_shared_violation)
+            if data is not None:
+                incremental.put(shareName, path, data)
+        return data
+
+    def _list_file(self, shareName: str, path: str) -> None:
+        ''' Lists path on its own, for the incremental cache to know its size and modification time '''
+        path = ntpath.normpath(path.replace('/', '\\')).lstrip('\\')
+        try:
+            entries = self.smb_session.listPath(shareName=shareName, path=path)
+        except Exception as e:
+            if any(status in str(e) for status in ('STATUS_NO_SUCH_FILE', 'STATUS_OBJECT_NAME_NOT_FOUND', 'STATUS_OBJECT_PATH_NOT_FOUND')):
+                self.incremental.record_missing(shareName, path)
+            return
+        self.incremental.record_listing(shareName, ntpath.dirname(path), entries)
+
+    @instrument('smb.readFile', trace_args=lambda self, shareName, path, *args, **kwargs: dict(share=shareName, path=path))
+    def _download_file(self, shareName, path, mode = FILE_OPEN, offset = 0, password = None, shareAccessMode = FILE_SHARE_READ, bypass_shared_violation = False) -> bytes:
+        data = self._read_file(shareName, path, mode=mode, offset=offset, password=password, shareAccessMode=shareAccessMode, bypass_shared_violation=bypass_shared_violation)
+        if data is not None:
+            stats.incr('smb.files_read')
+            stats.incr('smb.bytes_read', len(data))
+        return data
+
+    def _read_file(self, shareName, path, mode = FILE_OPEN, offset = 0, password = None, shareAccessMode = FILE_SHARE_READ, bypass_shared_violation = False) -> bytes:
+        # not instrumented: the copies of locked files are read within the timed _download_file() call
         # ToDo: Handle situations where share is password protected
         path = path.replace('/', '\\')
         path = ntpath.normpath(path)
@@ -225,25 +524,17 @@ class DPLootRemoteSMBConnection(DPLootSMBConnection):
             elif 'STATUS_OBJECT_NAME_NOT_FOUND' in str(e):
                 pass
             elif bypass_shared_violation and 'STATUS_SHARING_VIOLATION' in str(e):
-                wmiexec = DPLootWmiExec(target=self.target)
-                command = "cmd.exe /Q /c copy \"C:\\%s\" \"C:\\Windows\\Temp\\%s\"" % (path,wmiexec.output)
-                wmiexec.run(command)
-                time.sleep(1)
-                while True:
-                    try:
-                        filepath = "Windows\\Temp\\" + wmiexec.output
-                        data = self.readFile(shareName=shareName, path=filepath)
-                        break
-                    except Exception as e:
-                        if str(e).find('STATUS_SHARING_VIOLATION') >=0:
-                            # Output not finished, let's wait
-                            time.sleep(1)
-                            pass
-                self.smb_session.deleteFile(shareName, wmiexec.output)
+                copy_path = self._locked_copies.pop((shareName.upper(), path.lower()), None)
+                stats.incr('smb.locked_files')
+                if copy_path is None:
+                    copy_path = self._copy_locked_files(shareName, [path]).get(path)
+                if copy_path is not None:
+                    data = self._read_file(shareName=shareName, path=copy_path)
+                    self._delete_file(shareName, copy_path)
             elif str(e).find('Broken') >= 0:
                 logging.debug('Connection broken, trying to recreate it')
                 self.reconnect()
-                return self.readFile(shareName=shareName, path=path, mode=mode, offset=offset, password=password, shareAccessMode=shareAccessMode, bypass_shared_violation=bypass_shared_violation)
+                return self._read_file(shareName=shareName, path=path, mode=mode, offset=offset, password=password, shareAccessMode=shareAccessMode, bypass_shared_violation=bypass_shared_violation)
             else:
                 logging.debug(str(e))
         finally:
@@ -252,8 +543,378 @@ class DPLootRemoteSMBConnection(DPLootSMBConnection):
             self.smb_session.disconnectTree(treeId)
             return data
 
+    @property
+    def wmi(self) -> "DPLootWmiConnection":
+        ''' The WMI connection to the target, shared with every other caller '''
+        if self._wmi is None:
+            # DCOM is only imported by the few actions using WMI
+            from dploot.lib.wmi import get_wmi_connection
+            self._wmi = get_wmi_connection(self.target)
+        return self._wmi
+
+    def close(self) -> None:
+        if self._wmi is not None:
+            self._wmi.close()
+        if self.smb_session is not None:
+            self._delete_leftovers()
+            try:
+                self.smb_session.close()
+            except Exception as e:
+                logging.debug(f"Error while closing SMB session to {self.target.address}: {e}")
+            self.smb_session = None
+
+    def is_locked(self, shareName: str, path: str) -> bool:
+        ''' Returns True if path exists but cannot be opened for reading because of a sharing violation '''
+        treeId = self.smb_session.connectTree(shareName)
+        try:
+            fileId = self.smb_session.openFile(treeId, path, FILE_READ_DATA, FILE_SHARE_READ, FILE_NON_DIRECTORY_FILE, FILE_OPEN, 0)
+            self.smb_session._SMBConnection.close(treeId, fileId)
+        except Exception as e:
+            return 'STATUS_SHARING_VIOLATION' in str(e)
+        finally:
+            self.smb_session.disconnectTree(treeId)
+        return False
+
+    def acquire_locked_files(self, shareName: str, paths: Iterable[str], timeout: float = None) -> int:
+        ''' Bulk locked-file acquisition: copies at once every file of paths that is locked by another process
+
+        All the copies are made by one remote command (a few if the command line gets too long) run over a
+        single WMI session, instead of one DCOM connection and one command per file. Subsequent
+        readFile(..., bypass_shared_violation=True) calls on these paths read the copies, which are deleted
+        once read, or by release_locked_files().
+
+        :return: the number of locked files copied
+        '''
+        paths = [ntpath.normpath(path.replace('/', '\\')).lstrip('\\') for path in paths]
+        paths = [path for path in dict.fromkeys(paths) if (shareName.upper(), path.lower()) not in self._locked_copies]
+        # only the files found by listing their directories are opened
+        existing = self._list_directories(shareName, paths)
+        paths = [path for path in paths if path.lower() in existing]
+        locked = self.map(lambda path: path if self.is_locked(shareName, path) else None, paths)
+        if len(locked) == 0:
+            return 0
+        logging.debug("Copying %d locked files out of %d" % (len(locked), len(paths)))
+        copies = self._copy_locked_files(shareName, locked, timeout)
+        for path, copy_path in copies.items():
+            self._locked_copies[(shareName.upper(), path.lower())] = copy_path
+        return len(copies)
+
+    def _list_directories(self, shareName: str, paths: List[str]) -> Set[str]:
+        ''' Lists the directories of paths once each, shallowest first: those under a missing directory are not listed
+
+        :return: the paths of the files found, in lowercase
+        '''
+        pending = list(dict.fromkeys(ntpath.dirname(path).lower() for path in paths))
+        missing = list()
+        existing = set()
+        while len(pending) > 0:
+            ready = [d for d in pending if not any(d.startswith(other + '\\') for other in pending)]
+            pending = [d for d in pending if d not in ready]
+            listings = self.map(lambda directory: (directory, self.remote_list_dir(shareName, directory)), ready)
+            for directory, entries in listings:
+                if entries is None:
+                    missing.append(directory)
+                for entry in entries or []:
+                    if not entry.is_directory():
+                        existing.add(ntpath.join(directory, entry.get_longname()).lower())
+            pending = [d for d in pending if not any(d.startswith(other + '\\') for other in missing)]
+        return existing
+
+    def release_locked_files(self) -> None:
+        ''' Deletes the copies made by acquire_locked_files() that were not read, and what copies that timed out left behind '''
+        while len(self._locked_copies) > 0:
+            (shareName, _), copy_path = self._locked_copies.popitem()
+            self._delete_file(shareName, copy_path)
+        self._delete_leftovers()
+
+    def _delete_leftovers(self) -> None:
+        ''' Deletes every file of the copies that timed out, best effort: a copy still running cannot be deleted '''
+        while len(self._locked_leftovers) > 0:
+            shareName, prefix = self._locked_leftovers.pop()
+            try:
+                entries = self.smb_session.listPath(shareName, prefix + '.*')
+            except Exception as e:
+                logging.debug(f"Could not list {prefix}.*: {e}")
+                continue
+            for entry in entries:
+                self._delete_file(shareName, ntpath.join(ntpath.dirname(prefix), entry.get_longname()))
+
+    def _copy_locked_files(self, shareName: str, paths: List[str], timeout: float = None) -> Dict[str, str]:
+        ''' Copies paths to Windows\\Temp, waits for the copies with an exponential backoff bounded by timeout
+
+        :return: dict of path: copy_path, for the copies that completed in time
+        '''
+        timeout = self.locked_files_timeout if timeout is None else timeout
+        drive = shareName[0] + ':' if len(shareName) == 2 and shareName[1] == '$' else 'C:'
+        prefix = 'Windows\\Temp\\dploot_%s' % str(time.time()).replace('.', '')
+
+        # each copy that succeeds writes its own marker file, and each command writes a last marker once
+        # all its copies ran, so that the copies that failed are not waited for
+        chunks = [dict()]
+        command_length = 0
+        for i, path in enumerate(paths):
+            copy_path = '%s.%d' % (prefix, i)
+            copy_command = 'copy /Y "%s\\%s" "%s\\%s" >NUL 2>&1 && echo.> "%s\\%s.ok" & ' % (drive, path, drive, copy_path, drive, copy_path)
+            if len(chunks[-1]) > 0 and command_length + len(copy_command) > self.max_command_length:
+                chunks.append(dict())
+                command_length = 0
+            chunks[-1][path] = (copy_path, copy_command)
+            command_length += len(copy_command)
+
+        markers = dict()
+        for i, chunk in enumerate(chunks):
+            marker = '%s.done%d' % (prefix, i)
+            command = 'cmd.exe /Q /c %secho.> "%s\\%s"' % (''.join(copy_command for _, copy_command in chunk.values()), drive, marker)
+            try:
+                self.wmi.execute(command)
+            except Exception as e:
+                logging.error("Could not copy locked files through WMI: %s" % e)
+                break
+            markers[marker] = {path: copy_path for path, (copy_path, _) in chunk.items()}
+
+        written = self._wait_for_markers(shareName, prefix, markers, timeout)
+        copies = dict()
+        leftovers = False
+        for marker, chunk in markers.items():
+            for path, copy_path in chunk.items():
+                if copy_path.lower() + '.ok' in written:
+                    self._delete_file(shareName, copy_path + '.ok')
+                    copies[path] = copy_path
+                    continue
+                if marker.lower() in written:
+                    logging.error("Could not copy locked file %s" % path)
+                else:
+                    logging.error("Timeout while copying locked file %s" % path)
+                # a failed copy may have left a partial file behind
+                self._delete_file(shareName, copy_path)
+            if marker.lower() in written:
+                self._delete_file(shareName, marker)
+            else:
+                # the command is still running: its copies and markers can only be deleted once it is over
+                leftovers = True
+        if leftovers:
+            self._locked_leftovers.append((shareName, prefix))
+        return copies
+
+    def _wait_for_markers(self, shareName: str, prefix: str, markers: Dict[str, Dict[str, str]], timeout: float) -> Set[str]:
+        ''' Waits until every command of markers is done, or timeout seconds, listing the files of prefix once per try
+
+        :return: the marker files written, in lowercase
+        '''
+        deadline = time.monotonic() + timeout
+        delay = 0.2
+        while True:
+            entries = self.remote_list_dir(shareName, prefix + '.*', wildcard=False) or []
+            directory = ntpath.dirname(prefix)
+            written = set(ntpath.join(directory, entry.get_longname()).lower() for entry in entries)
+            pending = [
+                marker for marker, chunk in markers.items()
+                if marker.lower() not in written and any(copy_path.lower() + '.ok' not in written for copy_path in chunk.values())
+            ]
+            remaining = deadline - time.monotonic()
+            if len(pending) == 0 or remaining <= 0:
+                return written
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 5)
+
+    def _delete_file(self, shareName: str, path: str) -> None:
+        try:
+            self.smb_session.deleteFile(shareName, path)
+        except Exception as e:
+            logging.debug(f"Could not delete {path}: {e}")
+
+class DPLootSMBConnectionPool(DPLootRemoteSMBConnection):
+    ''' Several SMB sessions to the same target, sharing one authentication
+
+    The pool itself is the primary connection: RPC over its session (remote registry,
+    LSA secrets, is_admin) is unchanged. File operations (readFile, remote_list_dir,
+    listPath, getFile) are run on worker sessions that are handed out one caller at a
+    time, so the pool can be given to any *Triage class in place of a connection.
+    Workers reuse the credentials (and with Kerberos, the tickets) of the primary
+    session, are checked when they have been idle for a while and are reconnected
+    transparently.
+    '''
+
+    health_check_interval = 30
+
+    def __init__(self, target: Target) -> None:
+        super().__init__(target)
+        self.size = target.smb_sessions
+
+        self._idle = queue.LifoQueue()
+        self._workers = list()
+        self._workers_lock = threading.Lock()
+        self._tickets = None
+
+    def connect(self) -> "Any | None":
+        if super().connect() is None:
+            return None
+        # open one worker now so authentication issues show up early
+        worker = self._create_worker()
+        if worker is not None:
+            self._release(worker)
+        return self.smb_session
+
+    def _kerberos_tickets(self) -> "Dict[str, Any]":
+        ''' Returns TGT and TGS used by workers, requested once from the KDC '''
+        if self._tickets is not None:
+            return self._tickets
+        self._tickets = dict(TGT=None, TGS=None)
+        if self.target.use_kcache:
+            # workers will find the tickets in the ccache
+            return self._tickets
+        try:
+            from impacket.krb5 import constants
+            from impacket.krb5.kerberosv5 import getKerberosTGS, getKerberosTGT
+            from impacket.krb5.types import Principal
+
+            lmhash = unhexlify(self.target.lmhash) if self.target.lmhash else b''
+            nthash = unhexlify(self.target.nthash) if self.target.nthash else b''
+            user = Principal(self.target.username, type=constants.PrincipalNameType.NT_PRINCIPAL.value)
+            tgt, cipher, oldSessionKey, sessionKey = getKerberosTGT(user, self.target.password, self.target.domain, lmhash, nthash, self.target.aesKey, self.target.kdcHost)
+            self._tickets['TGT'] = dict(KDC_REP=tgt, cipher=cipher, oldSessionKey=oldSessionKey, sessionKey=sessionKey)
+            server = Principal('cifs/%s' % self.smb_session.getRemoteName(), type=constants.PrincipalNameType.NT_SRV_INST.value)
+            tgs, cipher, oldSessionKey, sessionKey = getKerberosTGS(server, self.target.domain, self.target.kdcHost, tgt, cipher, sessionKey)
+            self._tickets['TGS'] = dict(KDC_REP=tgs, cipher=cipher, oldSessionKey=oldSessionKey, sessionKey=sessionKey)
+        except Exception as e:
+            logging.debug(f"Could not get Kerberos tickets for SMB workers, each worker will request its own: {e}")
+        return self._tickets
+
+    def _create_worker(self) -> "DPLootRemoteSMBConnection | None":
+        with self._workers_lock:
+            if len(self._workers) >= self.size:
+                return None
+            worker = DPLootRemoteSMBConnection(self.target)
+            # copies of locked files can be read from any session
+            worker._locked_copies = self._locked_copies
+            self._workers.append(worker)
+        try:
+            if not worker.create_conn_obj():
+                raise Exception("Could not create connection object to %s" % self.target.address)
+            if self.target.do_kerberos:
+                tickets = self._kerberos_tickets()
+                worker.smb_session.kerberosLogin(
+                    user=self.target.username,
+                    password=self.target.password,
+                    domain=self.target.domain,
+                    lmhash=self.target.lmhash,
+                    nthash=self.target.nthash,
+                    aesKey=self.target.aesKey,
+                    kdcHost=self.target.kdcHost,
+                    TGT=tickets['TGT'],
+                    TGS=tickets['TGS'],
+                    useCache=self.target.use_kcache,
+                    )
+            else:
+                worker.smb_session.login(
+                    user=self.target.username,
+                    password=self.target.password,
+                    domain=self.target.domain,
+                    lmhash=self.target.lmhash,
+                    nthash=self.target.nthash
+                    )
+        except Exception as e:
+            logging.debug(f"Could not open SMB worker session to {self.target.address}: {e}")
+            with self._workers_lock:
+                self._workers.remove(worker)
+            return None
+        worker.last_used = time.monotonic()
+        return worker
+
+    def _is_healthy(self, worker: DPLootRemoteSMBConnection) -> bool:
+        try:
+            if worker.smbv1:
+                tree_id = worker.smb_session.connectTree('IPC$')
+                worker.smb_session.disconnectTree(tree_id)
+            else:
+                worker.smb_session._SMBConnection.echo()
+        except Exception as e:
+            logging.debug(f"SMB worker session to {self.target.address} is not healthy: {e}")
+            return False
+        return True
+
+    def _discard(self, worker: DPLootRemoteSMBConnection) -> None:
+        with self._workers_lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        try:
+            worker.close()
+        except Exception as e:
+            logging.debug(f"Error while closing SMB worker session to {self.target.address}: {e}")
+
+    def _release(self, worker: DPLootRemoteSMBConnection, healthy: bool = True) -> None:
+        # a worker not known to be healthy is checked on its next acquire()
+        worker.last_used = time.monotonic() if healthy else float('-inf')
+        self._idle.put(worker)
+
+    @contextmanager
+    def acquire(self) -> Iterator[DPLootRemoteSMBConnection]:
+        ''' Hands out a worker session for exclusive use '''
+        try:
+            worker = self._idle.get_nowait()
+        except queue.Empty:
+            worker = self._create_worker()
+            if worker is None:
+                # every worker is busy (or none could be opened): wait for one
+                with self._workers_lock:
+                    no_workers = len(self._workers) == 0
+                if no_workers:
+                    raise Exception("No SMB session available to %s" % self.target.address)
+                worker = self._idle.get()
+        if time.monotonic() - worker.last_used > self.health_check_interval and not self._is_healthy(worker):
+            try:
+                worker.reconnect()
+            except Exception as e:
+                logging.debug(f"Could not reconnect SMB worker session to {self.target.address}: {e}")
+                # replace the dead session with a new one
+                self._discard(worker)
+                worker = self._create_worker()
+                if worker is None:
+                    raise Exception("No SMB session available to %s" % self.target.address)
+        try:
+            yield worker
+        except BaseException:
+            # the session may have died during the operation: check it before handing it out again
+            self._release(worker, healthy=False)
+            raise
+        else:
+            self._release(worker)
+
+    def close(self) -> None:
+        with self._workers_lock:
+            workers = list(self._workers)
+            self._workers = list()
+        for worker in workers:
+            worker.close()
+        self._idle = queue.LifoQueue()
+        super().close()
+
+    def map(self, func: Callable, iterable: Iterable) -> List[Any]:
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            results = executor.map(lambda item: self._call_logging_errors(func, item), iterable)
+            return [result for result in results if result is not None]
+
+    def remote_list_dir(self, share, path, wildcard=True) -> "Any | None":
+        with self.acquire() as worker:
+            return worker.remote_list_dir(share, path=path, wildcard=wildcard)
+
+    def listPath(self, *args, **kwargs) -> Any:
+        with self.acquire() as worker:
+            return worker.listPath(*args, **kwargs)
+
+    def getFile(self, *args, **kwargs) -> "Any | None":
+        with self.acquire() as worker:
+            return worker.getFile(*args, **kwargs)
+
+    def is_locked(self, shareName: str, path: str) -> bool:
+        with self.acquire() as worker:
+            return worker.is_locked(shareName, path)
+
+    def readFile(self, shareName, path, mode = FILE_OPEN, offset = 0, password = None, shareAccessMode = FILE_SHARE_READ, bypass_shared_violation = False) -> bytes:
+        with self.acquire() as worker:
+            return worker.readFile(shareName, path, mode=mode, offset=offset, password=password, shareAccessMode=shareAccessMode, bypass_shared_violation=bypass_shared_violation)
+
 class DPLootLocalSMBConnection(DPLootSMBConnection):
-    systemroot = 'C:\\Windows'
     hklm_software_path = r'Windows/System32/config/SOFTWARE'
 
     def __init__(self, target=None) -> None:
@@ -277,6 +938,7 @@ class DPLootLocalSMBConnection(DPLootSMBConnection):
         if self.local_ops is not None and self.bootkey is not None and not force:
             return
         try:
+            from impacket.examples.secretsdump import LocalOperations
             self.local_ops = LocalOperations(systemHive)
             self.bootkey  = self.local_ops.getBootKey()
         except Exception as e:
@@ -292,6 +954,7 @@ class DPLootLocalSMBConnection(DPLootSMBConnection):
         return SharedFile(ctime, atime, mtime, filesize, None, attribs, d.name, d.name)
     SharedFile.fromDirEntry = _sharedfile_fromdirentry
 
+    @instrument('local.remote_list_dir')
     def remote_list_dir(self, share, path, wildcard=True) -> "Any | None":
         path=os.path.join(self.target.local_root, path.replace('\\', os.sep))
         if not wildcard:
@@ -303,6 +966,7 @@ class DPLootLocalSMBConnection(DPLootSMBConnection):
         # logging.debug(f"remote_list_dir called with {path}, returning {result} ")
         return result
 
+    @instrument('local.listPath')
     def listPath(self, shareName:str = 'C$', path:str = None, password:str = None):
         if path[-2:] == r'\*':
             return self.remote_list_dir(shareName, path[:-2], wildcard=True)
@@ -314,6 +978,7 @@ class DPLootLocalSMBConnection(DPLootSMBConnection):
     def getFile(self,  *args, **kwargs) -> "Any | None":
         raise NotImplementedError("getFile is not implemented in LOCAL mode")
 
+    @instrument('local.readFile', trace_args=lambda self, shareName, path, *args, **kwargs: dict(share=shareName, path=path))
     def readFile(self, shareName, path, mode = FILE_OPEN, offset = 0, password = None, shareAccessMode = FILE_SHARE_READ, bypass_shared_violation = False) -> bytes:
         # logging.debug(f"readFile called with {path}")
         data = None
@@ -323,6 +988,9 @@ class DPLootLocalSMBConnection(DPLootSMBConnection):
         except Exception as e:
             logging.debug(f"Exception occurred while trying to read {path}: {e}")
 
+        if data is not None:
+            stats.incr('local.files_read')
+            stats.incr('local.bytes_read', len(data))
         return data
 
     def getUsersProfiles(self) -> dict[str, str] | None:
@@ -339,10 +1007,13 @@ class DPLootLocalSMBConnection(DPLootSMBConnection):
         result = dict()
         # open hive
         reg_file_path = os.path.join(self.target.local_root, self.hklm_software_path)
+        if not os.path.isfile(reg_file_path):
+            logging.debug(f"{reg_file_path} not found")
+            return None
         reg = Registry(reg_file_path, isRemote=False)
 
         # open key
-        key_path='Microsoft\\Windows NT\\CurrentVersion\\ProfileList'
+        key_path=self.profile_list_key
         parentKey=reg.findKey(key_path)
         if parentKey is None:
             logging.error(f"Key {key_path} not found in {reg_file_path}")
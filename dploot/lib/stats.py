@@ -0,0 +1,100 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List
+
+class DPLootStats:
+    ''' Counters and timers of what a run spent its time on
+
+    Counters are plain integers (files read, bytes read, round trips, cache hits, ...). Timers
+    count calls and add up their duration, so concurrent calls add up to more than wall clock time.
+    '''
+
+    def __init__(self) -> None:
+        self.counters = dict()
+        self.timers = dict()
+        self._lock = threading.Lock()
+        # set by DPLootProfiler to record every timed call as a span
+        self.tracer = None
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name: str, duration: float, start: float = None, args: Dict[str, Any] = None) -> None:
+        if self.tracer is not None and start is not None:
+            self.tracer.add_span(name, start, duration, args)
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = dict(calls=1, total=duration, max=duration)
+            else:
+                timer['calls'] += 1
+                timer['total'] += duration
+                timer['max'] = max(timer['max'], duration)
+
+    @contextmanager
+    def timer(self, name: str, **args: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, start, args)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters = dict()
+            self.timers = dict()
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                counters=dict(sorted(self.counters.items())),
+                timers={name: dict(timer) for name, timer in sorted(self.timers.items())},
+            )
+
+    def summary(self) -> List[str]:
+        stats = self.as_dict()
+        lines = ['%-60s %10s %10s %10s' % ('Timer', 'Calls', 'Total (s)', 'Max (s)')]
+        for name, timer in sorted(stats['timers'].items(), key=lambda item: -item[1]['total']):
+            lines.append('%-60s %10d %10.3f %10.3f' % (name, timer['calls'], timer['total'], timer['max']))
+        lines.append('')
+        lines.append('%-60s %10s' % ('Counter', 'Value'))
+        for name, value in stats['counters'].items():
+            lines.append('%-60s %10d' % (name, value))
+        return lines
+
+    def dump(self, filename: str) -> None:
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+stats = DPLootStats()
+
+def instrument(name: str = None, outcome: bool = False, trace_args: Callable[..., Dict[str, Any]] = None) -> Callable:
+    ''' Decorator timing every call of the function, under its qualified name by default
+
+    With outcome, calls returning None are counted as name.failure, others as name.success.
+    Calls raising an exception are counted as name.errors.
+    When tracing, trace_args is called with the arguments of the call and returns the span arguments.
+    '''
+    def decorator(func: Callable) -> Callable:
+        timer_name = name if name is not None else func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                stats.incr(timer_name + '.errors')
+                raise
+            finally:
+                args_ = trace_args(*args, **kwargs) if trace_args is not None and stats.tracer is not None else None
+                stats.add_time(timer_name, time.perf_counter() - start, start, args_)
+            if outcome:
+                stats.incr(timer_name + ('.failure' if result is None else '.success'))
+            return result
+        return wrapper
+    return decorator
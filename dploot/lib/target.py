@@ -17,6 +17,15 @@ class Target:
         self.aesKey: str = None
         self.local_root: str = None
         self.is_local: bool = False
+        self.smb_sessions: int = 1
+        self.hosts_file: str = None
+        self.use_cache: bool = True
+        self.port: int = 445
+        self.resume: bool = False
+        self.journal_masterkeys: bool = False
+        self.incremental: bool = False
+        self.incremental_masterkeys: bool = False
+        self.masterkeys_db: str = None
 
     @staticmethod
     def from_options(options) -> "Target":
@@ -38,7 +47,16 @@ class Target:
             no_pass    = options.no_pass,
             dc_ip = options.dc_ip,
             aesKey= options.aesKey,
-            local_root=options.localroot)
+            local_root=options.localroot,
+            smb_sessions=options.smb_sessions,
+            hosts_file=options.hosts_file,
+            use_cache=not options.no_cache,
+            port=options.port,
+            resume=options.resume,
+            journal_masterkeys=options.journal_masterkeys,
+            incremental=options.incremental,
+            incremental_masterkeys=options.incremental_masterkeys,
+            masterkeys_db=options.masterkeys_db)
        
     @staticmethod
     def create(domain: str = None,
@@ -54,7 +72,16 @@ class Target:
         no_pass: bool = False,
         dc_ip: str = None,
         aesKey: str = None,
-        local_root: str = None) -> "Target":
+        local_root: str = None,
+        smb_sessions: int = 1,
+        hosts_file: str = None,
+        use_cache: bool = True,
+        port: int = 445,
+        resume: bool = False,
+        journal_masterkeys: bool = False,
+        incremental: bool = False,
+        incremental_masterkeys: bool = False,
+        masterkeys_db: str = None) -> "Target":
 
         self = Target()
 
@@ -69,6 +96,22 @@ class Target:
                 print("Invalid options: dc-ip conflicts with target=LOCAL", file=sys.stderr)
                 sys.exit(1)
 
+        if resume and not use_cache:
+            print("Invalid options: -resume reads the journal of the previous run, which -no-cache disables", file=sys.stderr)
+            sys.exit(1)
+
+        if journal_masterkeys and not use_cache:
+            print("Invalid options: -journal-masterkeys writes the journal, which -no-cache disables", file=sys.stderr)
+            sys.exit(1)
+
+        if incremental and not use_cache:
+            print("Invalid options: -incremental keeps files in the cache directory, which -no-cache disables", file=sys.stderr)
+            sys.exit(1)
+
+        if incremental_masterkeys and not incremental:
+            print("Invalid options: -incremental-masterkeys records masterkeys in the incremental cache, which needs -incremental", file=sys.stderr)
+            sys.exit(1)
+
         if domain is None:
             domain = ""
 
@@ -110,6 +153,15 @@ class Target:
         self.dc_ip = dc_ip
         self.aesKey = aesKey
         self.local_root = local_root
+        self.smb_sessions = smb_sessions if smb_sessions is not None and smb_sessions > 0 else 1
+        self.hosts_file = hosts_file
+        self.use_cache = use_cache
+        self.port = port if port is not None else 445
+        self.resume = resume
+        self.journal_masterkeys = journal_masterkeys
+        self.incremental = incremental
+        self.incremental_masterkeys = incremental_masterkeys
+        self.masterkeys_db = masterkeys_db
 
         return self
 
@@ -156,6 +208,38 @@ def add_target_argument_group(parser: argparse.ArgumentParser,) -> None:
 
     parser.add_argument("-quiet", action="store_true", help="Only output dumped credentials")
 
+    parser.add_argument(
+        "-format",
+        action="store",
+        choices=['text', 'jsonl'],
+        default='text',
+        help=(
+            "Output format. jsonl writes one JSON record per finding on stdout as soon as it is found, "
+            "and logs to stderr (default text)"
+        ),
+    )
+
+    parser.add_argument(
+        "-export-db",
+        action="store",
+        metavar="file.db",
+        help=(
+            "Also store findings in this SQLite database, one table per type of finding. "
+            "Several runs can share the same database"
+        ),
+    )
+
+    parser.add_argument("-stats", action="store_true", help="Print on stderr where time was spent (SMB, registry, decryption, triage) and counters at the end of the run")
+
+    parser.add_argument(
+        "-stats-file",
+        action="store",
+        metavar="file.json",
+        help=(
+            "Write the timers and counters of -stats to this file, as JSON"
+        ),
+    )
+
     group = parser.add_argument_group("authentication")
     
     group.add_argument(
@@ -195,3 +279,92 @@ def add_target_argument_group(parser: argparse.ArgumentParser,) -> None:
         ),
     )
 
+    group = parser.add_argument_group("connection")
+
+    group.add_argument(
+        "-port",
+        action="store",
+        type=int,
+        default=445,
+        help="SMB port of the target (default 445)",
+    )
+
+    group.add_argument(
+        "-smb-sessions",
+        action="store",
+        type=int,
+        default=1,
+        metavar="N",
+        help=(
+            "Number of authenticated SMB sessions opened to the target and used concurrently (default 1)"
+        ),
+    )
+
+    group.add_argument(
+        "-hostsfile",
+        action="store",
+        dest="hosts_file",
+        metavar="file",
+        help=(
+            "File mapping addresses to DNS hostnames, in /etc/hosts format. With Kerberos, targets found "
+            "in this file or in the hostnames cache of previous runs are not probed for their hostname"
+        ),
+    )
+
+    group.add_argument(
+        "-no-cache",
+        action="store_true",
+        help=(
+            "Do not read nor write the hostnames and SMB dialects learnt from targets, nor the journal of "
+            "completed work, in the cache directory (~/.dploot or $DPLOOT_CACHE_DIR), only keep them for this run"
+        ),
+    )
+
+    group.add_argument(
+        "-resume",
+        action="store_true",
+        help=(
+            "Skip the work completed by the previous run against this target (interrupted by a timeout, a "
+            "dropped connection, ...), and reuse the masterkeys it decrypted with -journal-masterkeys. Every "
+            "run records its progress in ~/.dploot/journal"
+        ),
+    )
+
+    group.add_argument(
+        "-journal-masterkeys",
+        action="store_true",
+        help=(
+            "Also record the masterkeys decrypted in the journal of the target, so that a -resume run does not "
+            "decrypt them again. The journal then holds key material"
+        ),
+    )
+
+    group.add_argument(
+        "-incremental",
+        action="store_true",
+        help=(
+            "Keep the files read from the target in ~/.dploot/incremental, with the size and modification time "
+            "they were listed with, and only download the new or modified ones on the next -incremental runs. "
+            "Masterkey files are still decrypted on every run, unless -incremental-masterkeys is given"
+        ),
+    )
+
+    group.add_argument(
+        "-incremental-masterkeys",
+        action="store_true",
+        help=(
+            "Also record the SHA1 of the masterkeys decrypted in the incremental cache of the target, so that "
+            "masterkey files decrypted before are not decrypted again. The cache then holds key material"
+        ),
+    )
+
+    group.add_argument(
+        "-masterkeys-db",
+        action="store",
+        metavar="file",
+        help=(
+            "Masterkeys database shared by the runs of a sweep: masterkeys decrypted on a target are added to it, "
+            "and masterkeys it already holds (roaming profiles, credential roaming) are neither read nor "
+            "decrypted again on the next targets. Several dploot processes can share the same file"
+        ),
+    )
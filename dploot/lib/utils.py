@@ -58,4 +58,13 @@ def parse_file_as_dict(filename: str) -> Dict[str,str]:
 			tmp_line = line.rstrip('\n')
 			tmp_line = tmp_line.split(':',1)
 			arr[tmp_line[0]]=tmp_line[1]
-	return arr
\ No newline at end of file
+	return arr
+
+def parse_file_as_multidict(filename: str) -> Dict[str,List[str]]:
+	arr = dict()
+	with open(filename, 'r') as lines:
+		for line in lines:
+			tmp_line = line.rstrip('\n')
+			tmp_line = tmp_line.split(':',1)
+			arr.setdefault(tmp_line[0], list()).append(tmp_line[1])
+	return arr
@@ -1,5 +1,7 @@
 import logging
+import threading
 import time
+from typing import Any, Dict, Iterator, List
 
 from impacket.dcerpc.v5.dcom import wmi
 from impacket.dcerpc.v5.dcomrt import DCOMConnection
@@ -7,42 +9,142 @@ from impacket.dcerpc.v5.dtypes import NULL
 
 from dploot.lib.target import Target
 
+class DPLootWmiConnection:
+    ''' One DCOM connection to a target, shared by every WMI caller
+
+    DCOM activation and authentication happen once, and IWbemServices are cached per namespace.
+    The DCE transport is not thread safe, so calls are serialized with a lock.
+    The connection must be closed with close(), or close_wmi_connections(): impacket keeps a
+    ping timer thread running for as long as it is open.
+    '''
+
+    def __init__(self, target: Target) -> None:
+        self.target = target
+
+        self.lock = threading.RLock()
+        self._dcom = None
+        self._services = dict()
+        self._win32Process = None
+
+    @property
+    def dcom(self) -> DCOMConnection:
+        with self.lock:
+            if self._dcom is None:
+                if logging.getLogger().level != logging.DEBUG:
+                    logging.getLogger("impacket").disabled = True
+                self._dcom = DCOMConnection(self.target.address, self.target.username, self.target.password, self.target.domain, self.target.lmhash, self.target.nthash,
+                                            self.target.aesKey, oxidResolver=True, doKerberos=self.target.do_kerberos, kdcHost=self.target.kdcHost)
+            return self._dcom
+
+    def services(self, namespace: str = 'root\\cimv2') -> Any:
+        ''' Returns the IWbemServices of namespace, logging in on first use '''
+        key = namespace.replace('/', '\\').strip('\\').lower()
+        with self.lock:
+            if key not in self._services:
+                iInterface = self.dcom.CoCreateInstanceEx(wmi.CLSID_WbemLevel1Login,wmi.IID_IWbemLevel1Login)
+                iWbemLevel1Login = wmi.IWbemLevel1Login(iInterface)
+                self._services[key] = iWbemLevel1Login.NTLMLogin('//./%s' % namespace.replace('\\', '/').strip('/'), NULL, NULL)
+                iWbemLevel1Login.RemRelease()
+            return self._services[key]
+
+    def execute(self, command: str, pwd: str = 'C:\\') -> None:
+        ''' Starts command on the target through Win32_Process.Create '''
+        with self.lock:
+            if self._win32Process is None:
+                self._win32Process,_ = self.services('root\\cimv2').GetObject('Win32_Process')
+            self._win32Process.Create(command, pwd, None)
+
+    def query(self, namespace: str, query: str, flags: int = wmi.WBEM_FLAG_RETURN_IMMEDIATELY | wmi.WBEM_FLAG_FORWARD_ONLY) -> Any:
+        ''' Runs a WQL query in namespace, returns an IEnumWbemClassObject
+
+        By default the query is semisynchronous: the call returns at once and the server keeps evaluating
+        it while other queries are sent, objects are then fetched with enum_objects().
+        '''
+        with self.lock:
+            return self.services(namespace).ExecQuery(query, lFlags=flags)
+
+    def close(self) -> None:
+        with self.lock:
+            for iWbemServices in self._services.values():
+                try:
+                    iWbemServices.RemRelease()
+                except Exception as e:
+                    logging.debug(f"Error while releasing IWbemServices: {e}")
+            self._services = dict()
+            self._win32Process = None
+            if self._dcom is not None:
+                self._dcom.disconnect()
+                self._dcom = None
+
+def enum_objects(connection: DPLootWmiConnection, iEnum: Any, batch_size: int = 100, timeout: int = wmi.WBEM_INFINITE) -> Iterator[Any]:
+    ''' Yields the IWbemClassObject of an IEnumWbemClassObject of connection, fetching batch_size of them per round trip
+
+    Each round trip holds the lock of connection, but not the processing of the objects in between.
+    The enumerator is released once exhausted.
+    '''
+    try:
+        while True:
+            try:
+                with connection.lock:
+                    objects = iEnum.Next(timeout, batch_size)
+            except wmi.DCERPCSessionError as e:
+                # a batch shorter than batch_size comes with S_FALSE, the objects are still in the response
+                if e.get_error_code() != wmi.WBEMSTATUS.WBEM_S_FALSE or e.get_packet() is None:
+                    raise
+                yield from _objects_from_next_response(iEnum, e.get_packet())
+                return
+            yield from objects
+            if len(objects) < batch_size:
+                return
+    finally:
+        with connection.lock:
+            iEnum.RemRelease()
+
+def _objects_from_next_response(iEnum: Any, resp: Any) -> List[Any]:
+    # same as IEnumWbemClassObject.Next()
+    return [wmi.IWbemClassObject(
+                wmi.INTERFACE(iEnum.get_cinstance(), b''.join(interface['abData']), iEnum.get_ipidRemUnknown(),
+                              oxid=iEnum.get_oxid(), target=iEnum.get_target()), iEnum._IEnumWbemClassObject__iWbemServices)
+            for interface in resp['apObjects']]
+
+_wmi_connections: Dict[Any, DPLootWmiConnection] = dict()
+_wmi_connections_lock = threading.Lock()
+
+def get_wmi_connection(target: Target) -> DPLootWmiConnection:
+    ''' Returns the WMI connection shared by every caller targeting the same host with the same identity '''
+    key = (target.address.lower(), target.domain.lower(), target.username.lower())
+    with _wmi_connections_lock:
+        if key not in _wmi_connections:
+            _wmi_connections[key] = DPLootWmiConnection(target)
+        return _wmi_connections[key]
+
+def close_wmi_connections() -> None:
+    with _wmi_connections_lock:
+        connections: List[DPLootWmiConnection] = list(_wmi_connections.values())
+        _wmi_connections.clear()
+    for connection in connections:
+        try:
+            connection.close()
+        except Exception as e:
+            logging.debug(f"Error while closing WMI connection to {connection.target.address}: {e}")
+
 class DPLootWmiExec:
     def __init__(self, target:Target=None):
-        self.__username = target.username
-        self.__password = target.password
-        self.__domain = target.domain
-        self.__lmhash = target.lmhash
-        self.__nthash = target.nthash
-        self.__aesKey = target.aesKey
-        self.__addr = target.address
-        self.__kdcHost = target.kdcHost
-        self.__doKerberos = target.do_kerberos
+        self.__target = target
 
         self.__share = 'C$'
         self.__pwd = str('C:\\')
         self.output = str(time.time())
-        self.__win32Process = None
 
     def run(self, command):
-        if logging.getLogger().level != logging.DEBUG:
-            logging.getLogger("impacket").disabled = True
-        dcom = DCOMConnection(self.__addr, self.__username, self.__password, self.__domain, self.__lmhash, self.__nthash,
-                              self.__aesKey, oxidResolver=True, doKerberos=self.__doKerberos, kdcHost=self.__kdcHost)
+        # the DCOM connection stays open for the next callers, until close_wmi_connections()
         try:
-            iInterface = dcom.CoCreateInstanceEx(wmi.CLSID_WbemLevel1Login,wmi.IID_IWbemLevel1Login)
-            iWbemLevel1Login = wmi.IWbemLevel1Login(iInterface)
-            iWbemServices= iWbemLevel1Login.NTLMLogin('//./root/cimv2', NULL, NULL)
-            iWbemLevel1Login.RemRelease()
-            self.__win32Process,_ = iWbemServices.GetObject('Win32_Process')
             self.execute_remote(command)
         except  (Exception, KeyboardInterrupt) as e:
             if logging.getLogger().level == logging.DEBUG:
                 import traceback
                 traceback.print_exc()
                 logging.debug(str(e))
-        dcom.disconnect()
 
     def execute_remote(self, command):
-        self.__win32Process.Create(command, self.__pwd, None)
-        
+        get_wmi_connection(self.__target).execute(command, self.__pwd)
